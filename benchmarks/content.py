@@ -0,0 +1,77 @@
+"""Generate synthetic course content of a configurable size."""
+
+import os
+import random
+from typing import List
+
+from git import Actor, Repo  # noqa: I900
+
+AUTHOR = Actor("Benchmark", "benchmark@example.com")
+
+
+def write_files(dir: str, size: int, files: int, seed: int = 0) -> List[str]:
+    """Fill `dir` with `files` random files that add up to about `size` bytes.
+
+    The files are spread over a few nested directories, like lecture content is.
+    Random bytes are used so compression does not make the numbers look better than
+    they are.
+    """
+
+    rng = random.Random(seed)
+    paths: List[str] = []
+    per_file = max(1, size // max(1, files))
+    for i in range(files):
+        rel = os.path.join(f"week{i % 12:02d}", f"part{i % 3}", f"file{i:05d}.bin")
+        path = os.path.join(dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(rng.getrandbits(8 * per_file).to_bytes(per_file, "little"))
+        paths.append(rel)
+    return paths
+
+
+def make_directory(dir: str, size: int, files: int, seed: int = 0) -> str:
+    os.makedirs(dir, exist_ok=True)
+    write_files(dir, size, files, seed)
+    return dir
+
+
+def make_repo(dir: str, size: int, files: int, commits: int = 1, seed: int = 0) -> str:
+    """Create a git repository whose latest commit holds about `size` bytes.
+
+    Each extra commit rewrites a tenth of the files, so the history is larger than the
+    checkout like it is in a real course repository.
+
+    Returns:
+        str: a `file://` uri that can be cloned
+    """
+
+    repo = Repo.init(dir)
+    with repo.config_writer() as config:
+        # needed to serve `--filter` for the partial clone benchmark
+        config.set_value("uploadpack", "allowFilter", "true")
+    paths = write_files(dir, size, files, seed)
+    repo.index.add(paths)
+    repo.index.commit("initial content", author=AUTHOR, committer=AUTHOR)
+
+    rng = random.Random(seed)
+    for i in range(1, commits):
+        changed = rng.sample(paths, max(1, len(paths) // 10))
+        for rel in changed:
+            with open(os.path.join(dir, rel), "ab") as f:
+                f.write(rng.getrandbits(8 * 1024).to_bytes(1024, "little"))
+        repo.index.add(changed)
+        repo.index.commit(f"update {i}", author=AUTHOR, committer=AUTHOR)
+
+    repo.close()
+    return "file://" + os.path.abspath(dir)
+
+
+def tree_size(dir: str) -> int:
+    total = 0
+    for root, _, names in os.walk(dir):
+        if ".git" in root.split(os.sep):
+            continue
+        for name in names:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
@@ -0,0 +1,303 @@
+"""In-process stand-ins for the docker daemon and the Wiki.js GraphQL API.
+
+The fakes implement just enough of the docker-py client for `builder.cli.run` to go
+through every stage, the build context is fully consumed so generating it is still
+measured. The wiki is a real HTTP server on localhost so the wiki client, its
+connection handling, and the readiness probe are measured as well.
+"""
+
+import hashlib
+import io
+import json
+import re
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+
+import docker
+
+# the size of the fake wiki database that is extracted from the container
+DATABASE_SIZE: int = 4 * 1024 * 1024
+
+
+class StubWiki:
+    """A Wiki.js GraphQL endpoint that accepts every mutation."""
+
+    def __init__(self, delay: float = 0):
+        self.requests = 0
+        self.delay = delay
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                stub.requests += 1
+                if stub.delay:
+                    threading.Event().wait(stub.delay)
+
+                out = json.dumps({"data": stub.respond(body.get("query", ""))})
+                data = out.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def respond(self, query: str) -> dict:
+        data: dict = {}
+        result = {
+            "responseResult": {
+                "succeeded": True,
+                "errorCode": 0,
+                "slug": "ok",
+                "message": "",
+            }
+        }
+        for alias, namespace, field in re.findall(r"(m\d+): (\w+) \{ (\w+)", query):
+            data[alias] = {field: result}
+
+        if not data:
+            data = {
+                "__typename": "Query",
+                "storage": {"status": [{"key": "git", "status": "ok", "message": ""}]},
+            }
+        return data
+
+    def __enter__(self) -> "StubWiki":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _database_archive(size: int) -> bytes:
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w") as tar:
+        info = tarfile.TarInfo("database.sqlite")
+        info.size = size
+        tar.addfile(info, io.BytesIO(b"\0" * size))
+    return data.getvalue()
+
+
+class FakeVolume:
+    def __init__(self, name: str):
+        self.name = name
+
+    def remove(self, force: bool = False) -> None:
+        pass
+
+
+class FakeNetwork:
+    def __init__(self, name: str):
+        self.name = name
+
+    def connect(self, container) -> None:
+        pass
+
+    def disconnect(self, container) -> None:
+        pass
+
+    def remove(self) -> None:
+        pass
+
+
+class FakeContainer:
+    def __init__(self, client: "FakeDockerClient", name: str):
+        self.client = client
+        self.name = name
+        self.id = hashlib.sha256(name.encode()).hexdigest()
+        self.status = "running"
+        self.attrs: dict = {"State": {"Status": "running"}, "Mounts": []}
+        self.ports = {"3000/tcp": [{"HostPort": str(client.wiki_port)}]}
+
+    def reload(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        self.status = "exited"
+
+    def kill(self) -> None:
+        self.status = "exited"
+
+    def start(self) -> None:
+        self.status = "running"
+
+    def remove(self, force: bool = False) -> None:
+        pass
+
+    def exec_run(self, cmd, **kwargs):
+        return (0, b"")
+
+    def get_archive(self, path: str):
+        return iter([self.client.database]), {"name": path.split("/")[-1]}
+
+    def put_archive(self, path: str, data) -> bool:
+        return True
+
+
+class FakeImage:
+    def __init__(
+        self,
+        id: str,
+        tags: List[str],
+        size: int = 0,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        self.id = id
+        self.tags = tags
+        self.labels = labels or {}
+        self.attrs = {"Size": size, "RepoDigests": []}
+
+
+class _Containers:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+
+    def run(self, image: str, name: str = "", **kwargs) -> FakeContainer:
+        return FakeContainer(self.client, name)
+
+    def create(self, image: str, name: str = "", **kwargs) -> FakeContainer:
+        return FakeContainer(self.client, name)
+
+    def get(self, name: str) -> FakeContainer:
+        # the benchmarks always run as if they are on the host
+        raise docker.errors.NotFound(f"No such container: {name}")
+
+
+class _Volumes:
+    def create(self, name: str) -> FakeVolume:
+        return FakeVolume(name)
+
+
+class _Networks:
+    def create(self, name: str, **kwargs) -> FakeNetwork:
+        return FakeNetwork(name)
+
+
+class FakeRegistryData:
+    def __init__(self, digest: str):
+        self.id = digest
+
+
+class _Images:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+
+    def pull(self, repository: str, **kwargs) -> FakeImage:
+        return self.get(repository)
+
+    def get_registry_data(self, name: str) -> FakeRegistryData:
+        return FakeRegistryData(self.client.registry.digest(name))
+
+    def push(self, repository: str, **kwargs) -> str:
+        return ""
+
+    def get(self, name: str) -> FakeImage:
+        if name not in self.client.images_by_name:
+            id = "sha256:" + hashlib.sha256(name.encode()).hexdigest()
+            self.client.images_by_name[name] = FakeImage(id, [name])
+        return self.client.images_by_name[name]
+
+
+class FakeRegistry:
+    """A `registry:2` stand-in that serves a new version of every image on request."""
+
+    def __init__(self, layers: int = 4, layer_size: int = 8 * 1024 * 1024):
+        self.layers = layers
+        self.layer_size = layer_size
+        self.versions: Dict[str, int] = {}
+
+    def digest(self, name: str) -> str:
+        version = f"{name}:{self.versions.get(name, 0)}"
+        return "sha256:" + hashlib.sha256(version.encode()).hexdigest()
+
+    def publish(self, name: str) -> None:
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+
+class _Api:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+
+    def pull(self, repository: str, tag: str = "latest", **kwargs) -> Iterator[dict]:
+        name = f"{repository}:{tag}"
+        registry = self.client.registry
+        chunk = registry.layer_size // 8
+        for layer in range(registry.layers):
+            id = f"layer{layer}"
+            for current in range(chunk, registry.layer_size + 1, chunk):
+                yield {
+                    "status": "Downloading",
+                    "id": id,
+                    "progressDetail": {
+                        "current": current,
+                        "total": registry.layer_size,
+                    },
+                }
+            yield {"status": "Pull complete", "id": id}
+
+        image = self.client.images.get(name)
+        image.attrs["RepoDigests"] = [f"{repository}@{registry.digest(name)}"]
+
+    def build(
+        self,
+        fileobj=None,
+        tag: Optional[str] = None,
+        decode: bool = False,
+        labels: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ) -> Iterator[dict]:
+        # read the whole context like the daemon would before any step runs
+        size = 0
+        for chunk in fileobj:
+            size += len(chunk)
+        self.client.context_bytes = size
+
+        id = "sha256:" + hashlib.sha256(f"{tag}{size}".encode()).hexdigest()
+        image = FakeImage(id, [tag or id], size, labels)
+        self.client.images_by_name[id] = image
+        if tag:
+            self.client.images_by_name[tag] = image
+        return iter(
+            [
+                {"stream": "Step 1/1 : FROM fake\n"},
+                {"aux": {"ID": id}},
+                {"stream": f"Successfully built {id[7:19]}\n"},
+            ]
+        )
+
+
+class FakeDockerClient:
+    """Just enough of `docker.DockerClient` for a single platform build."""
+
+    def __init__(self, wiki_port: int, database_size: int = DATABASE_SIZE):
+        self.wiki_port = wiki_port
+        self.database = _database_archive(database_size)
+        self.images_by_name: Dict[str, FakeImage] = {}
+        self.registry = FakeRegistry()
+        self.context_bytes = 0
+        self.containers = _Containers(self)
+        self.volumes = _Volumes()
+        self.networks = _Networks()
+        self.images = _Images(self)
+        self.api = _Api(self)
+
+    def events(self, **kwargs) -> Iterator[dict]:
+        return iter([])
@@ -0,0 +1,250 @@
+"""Offline benchmarks for the builder orchestration.
+
+Everything runs against an in-process fake of the docker client, a stub Wiki.js
+server on localhost, and synthetic local content, so no docker daemon or network
+access is needed. The results are written as JSON so they can be compared between
+releases. Run them with `python -m benchmarks.run` from the root of the repository.
+
+Usage:
+  benchmarks.run [options]
+  benchmarks.run (-h | --help)
+
+Options:
+  --size=<size>         The total size of the synthetic content used by each benchmark. [default: 64M]
+  --files=<n>           The number of files the synthetic content is split into. [default: 200]
+  --commits=<n>         The number of commits in each synthetic git repository. [default: 5]
+  --repeat=<n>          How many times each benchmark is run, the fastest run is reported. [default: 3]
+  --only=<names>        A comma separated list of benchmark name prefixes to run.
+  --output=<file>       Where to write the results. [default: benchmark-results.json]
+  --compare=<file>      Results of an earlier run to compare against.
+  -v --verbose          Show the builder log messages.
+  -h --help             Show this help message.
+"""  # noqa E501
+
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from time import perf_counter, time
+from typing import Callable, Dict, List, Optional
+
+from docopt import docopt
+
+from benchmarks.content import make_directory, make_repo, tree_size
+from benchmarks.fakes import FakeDockerClient, StubWiki
+from builder import cli
+from builder.context import COMPRESSIONS, ContextStream
+from builder.gitcache import GitCache
+
+try:
+    from builder.__version__ import __version__  # noqa: I900
+except ImportError:
+    __version__ = "LOCAL DEV"
+
+
+def default_options(*argv: str) -> dict:
+    """The options `run()` gets when the cli is called with `argv`."""
+
+    return cli._make_opts(docopt(cli.__doc__, argv=list(argv)))
+
+
+def measure(fn: Callable[[], Optional[int]], repeat: int) -> dict:
+    """Run `fn` several times and keep the fastest run.
+
+    `fn` may return the number of bytes that it processed to get a throughput.
+    """
+
+    runs: List[float] = []
+    processed: Optional[int] = None
+    for _ in range(repeat):
+        start = perf_counter()
+        processed = fn()
+        runs.append(perf_counter() - start)
+
+    result: dict = {"seconds": min(runs), "runs": runs}
+    if processed:
+        result["bytes"] = processed
+        result["mb_per_s"] = processed / (1024 * 1024) / min(runs)
+    return result
+
+
+class Benchmarks:
+    def __init__(self, workdir: str, size: int, files: int, commits: int):
+        self.workdir = workdir
+        self.size = size
+        self.files = files
+
+        self.content = make_directory(os.path.join(workdir, "content"), size, files)
+        self.repo = make_repo(os.path.join(workdir, "repo"), size, files, commits)
+        self.bytes = tree_size(self.content)
+
+    @contextlib.contextmanager
+    def target(self):
+        dir = tempfile.mkdtemp(dir=self.workdir)
+        try:
+            yield dir
+        finally:
+            shutil.rmtree(dir, ignore_errors=True)
+
+    def copy(self, mode: str) -> Callable[[], int]:
+        def bench() -> int:
+            with self.target() as dir:
+                cli.copy_directory(self.content, dir, stage_mode=mode)
+            return self.bytes
+
+        return bench
+
+    def clone(self, mode: str, cache: Optional[GitCache] = None) -> Callable[[], int]:
+        def bench() -> int:
+            repo = cli.Repository(self.repo, None, True)
+            with self.target() as dir:
+                cli.clone_repo(repo, "repo", dir, clone_mode=mode, git_cache=cache)
+            return self.bytes
+
+        return bench
+
+    def context(self, compression: str) -> Callable[[], int]:
+        def bench() -> int:
+            stream = ContextStream(self.content, compression=compression)
+            for _ in stream:
+                pass
+            return stream.tar_bytes
+
+        return bench
+
+    def pull(self, outdated: bool) -> Callable[[], int]:
+        client = FakeDockerClient(0)
+        name = "scioer/benchmark:latest"
+        cli.fetch_latest(client, name, progress_file=io.StringIO())
+
+        def bench() -> int:
+            if outdated:
+                client.registry.publish(name)
+            return cli.fetch_latest(client, name, progress_file=io.StringIO())
+
+        return bench
+
+    def run(self, *argv: str) -> Callable[[], None]:
+        def bench() -> None:
+            with StubWiki() as wiki:
+                client = FakeDockerClient(wiki.port)
+                opts = default_options(
+                    "--no-pull",
+                    f"--hash-cache-file={os.path.join(self.workdir, 'hashes.json')}",
+                    *argv,
+                )
+                with contextlib.redirect_stdout(io.StringIO()):
+                    built = cli.run(opts, client=client, progress_file=io.StringIO())
+                if not built:
+                    raise RuntimeError("the build failed")
+
+        return bench
+
+    def all(self) -> Dict[str, Callable[[], Optional[int]]]:
+        cache = GitCache(os.path.join(self.workdir, "git-cache"))
+        return {
+            "orchestration.empty": self.run(),
+            "orchestration.wiki_repo": self.run(
+                "--wiki-git-repo=https://example.invalid/wiki.git"
+            ),
+            "end_to_end.directory": self.run(f"--lectures-directory={self.content}"),
+            "end_to_end.repository": self.run(f"--jupyter-repo={self.repo}"),
+            "staging.copy": self.copy("copy"),
+            "staging.hardlink": self.copy("hardlink"),
+            "staging.reflink": self.copy("reflink"),
+            "staging.auto": self.copy("auto"),
+            "clone.full": self.clone("full"),
+            "clone.shallow": self.clone("shallow"),
+            "clone.partial": self.clone("partial"),
+            "clone.cached": self.clone("shallow", cache),
+            **{f"context.{c}": self.context(c) for c in COMPRESSIONS},
+            "pull.current": self.pull(outdated=False),
+            "pull.outdated": self.pull(outdated=True),
+        }
+
+
+def compare(old: dict, new: dict) -> str:
+    rows = [("BENCHMARK", "BEFORE", "AFTER", "CHANGE")]
+    for name, result in new["results"].items():
+        before = old.get("results", {}).get(name)
+        if not before or "seconds" not in before or "seconds" not in result:
+            continue
+        change = (result["seconds"] - before["seconds"]) / before["seconds"] * 100
+        rows.append(
+            (
+                name,
+                f"{before['seconds']:.3f}s",
+                f"{result['seconds']:.3f}s",
+                f"{change:+.1f}%",
+            )
+        )
+
+    widths = [max(len(row[i]) for row in rows) for i in range(4)]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
+
+
+def main() -> None:
+    args = docopt(__doc__)
+    if not args["--verbose"]:
+        logging.disable(logging.CRITICAL)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    size = cli.parse_size(args["--size"])
+    repeat = max(1, int(args["--repeat"]))
+    only = [p for p in (args["--only"] or "").split(",") if p]
+
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"generating {args['--size']} of synthetic content...", file=sys.stderr)
+        benchmarks = Benchmarks(
+            workdir, size, int(args["--files"]), int(args["--commits"])
+        )
+
+        for name, bench in benchmarks.all().items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+
+            try:
+                results[name] = measure(bench, repeat)
+            except (Exception, SystemExit) as e:
+                # for example reflinks on a filesystem that does not support them
+                results[name] = {"error": str(e)}
+
+            result = results[name]
+            summary = result.get("error") or f"{result['seconds']:.3f}s"
+            if "mb_per_s" in result:
+                summary += f" ({result['mb_per_s']:.1f} MB/s)"
+            print(f"{name:28} {summary}", file=sys.stderr)
+
+    output = {
+        "meta": {
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time(),
+            "size": size,
+            "files": int(args["--files"]),
+            "commits": int(args["--commits"]),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+    with open(args["--output"], "w") as f:
+        json.dump(output, f, indent=2)
+
+    if args["--compare"]:
+        with open(args["--compare"], "r") as f:
+            print(compare(json.load(f), output))
+
+
+if __name__ == "__main__":
+    main()
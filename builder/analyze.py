@@ -0,0 +1,213 @@
+"""Report what takes up the space in a build context before it is sent to docker.
+
+Images have grown by gigabytes because a repository had build outputs or the same
+video in several places committed to it. The staged build directory is scanned for
+the size of each directory, the largest files, files with the same contents, and the
+size of the layer each `COPY` instruction of the `Dockerfile` will create. The sizes
+are checked against the budgets, so a build that is too large fails before anything
+is sent to the docker daemon.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from builder.manifest import hash_file
+
+_LOGGER = logging.getLogger(__name__)
+
+# the parts of the build context that can be given a budget
+BUDGET_DIRECTORIES: List[str] = [
+    "jupyter",
+    "lectures",
+    "practiceProblems",
+    "database.sqlite.tar",
+]
+
+# `COPY --chown=1000:1000 lectures.layers/0 /opt/static/lectures/`
+_COPY = re.compile(r"^(COPY|ADD)\s+((?:--\S+\s+)*)(.+?)\s+(\S+)\s*$", re.IGNORECASE)
+
+
+@dataclass
+class ContextFile:
+    path: str
+    size: int
+
+
+@dataclass
+class ContextReport:
+    total: int = 0
+    files: List[ContextFile] = field(default_factory=list)
+    # the size of each top level directory, the split layers count for the directory
+    directories: Dict[str, int] = field(default_factory=dict)
+    # the paths of the files that have the same contents, grouped
+    duplicates: List[List[ContextFile]] = field(default_factory=list)
+    # the `Dockerfile` instruction and the estimated size of its layer
+    layers: List[Tuple[str, int]] = field(default_factory=list)
+
+    @property
+    def duplicate_bytes(self) -> int:
+        """The bytes that would be saved if every duplicate was only included once."""
+
+        return sum(group[0].size * (len(group) - 1) for group in self.duplicates)
+
+
+def top_level(path: str) -> str:
+    name = path.split("/")[0]
+    return name[: -len(".layers")] if name.endswith(".layers") else name
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "K", "M", "G"]:
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def find_duplicates(dir: str, files: List[ContextFile]) -> List[List[ContextFile]]:
+    """Group the files with the same contents, only files of the same size are hashed."""
+
+    bySize: Dict[int, List[ContextFile]] = {}
+    for f in files:
+        if f.size > 0:
+            bySize.setdefault(f.size, []).append(f)
+
+    groups: List[List[ContextFile]] = []
+    for candidates in bySize.values():
+        if len(candidates) < 2:
+            continue
+        byHash: Dict[str, List[ContextFile]] = {}
+        for f in candidates:
+            byHash.setdefault(hash_file(os.path.join(dir, f.path)), []).append(f)
+        groups += [group for group in byHash.values() if len(group) > 1]
+
+    return sorted(groups, key=lambda g: (-g[0].size * (len(g) - 1), g[0].path))
+
+
+def estimate_layers(dir: str, sizes: Dict[str, int]) -> List[Tuple[str, int]]:
+    """The size of the files each `COPY` or `ADD` instruction adds to the image."""
+
+    path = os.path.join(dir, "Dockerfile")
+    if not os.path.isfile(path):
+        return []
+
+    with open(path, "r") as f:
+        lines = f.read().split("\n")
+
+    layers: List[Tuple[str, int]] = []
+    for line in lines:
+        match = _COPY.match(line.strip())
+        # sources from other build stages or urls are not in the context
+        if not match or "--from" in match.group(2) or "://" in match.group(3):
+            continue
+
+        size = 0
+        for source in match.group(3).split():
+            source = source.strip("/")
+            size += sum(
+                s for p, s in sizes.items() if p == source or p.startswith(f"{source}/")
+            )
+        layers.append((line.strip(), size))
+    return layers
+
+
+def add_file(report: ContextReport, dir: str, path: str) -> None:
+    """Add a file to a report, like the wiki database once it is written."""
+
+    rel = os.path.relpath(path, dir).replace(os.sep, "/")
+    size = os.lstat(os.path.join(dir, rel)).st_size
+    report.files.append(ContextFile(rel, size))
+    report.total += size
+    key = top_level(rel)
+    report.directories[key] = report.directories.get(key, 0) + size
+    report.layers = estimate_layers(dir, {f.path: f.size for f in report.files})
+
+
+def analyze_context(dir: str, exclude: Sequence[str] = ()) -> ContextReport:
+    """Scan everything in the build directory that is sent to docker.
+
+    Args:
+        exclude (Sequence[str]): top level names to skip, along with the files that
+            start with them, like a file that is still being written next to them
+    """
+
+    report = ContextReport()
+    for root, dirs, names in os.walk(dir):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, dir).replace(os.sep, "/")
+            if any(rel.split("/")[0].startswith(e) for e in exclude):
+                continue
+            size = os.lstat(path).st_size
+            report.files.append(ContextFile(rel, size))
+            report.total += size
+            key = top_level(rel)
+            report.directories[key] = report.directories.get(key, 0) + size
+
+    report.duplicates = find_duplicates(
+        dir, [f for f in report.files if not os.path.islink(os.path.join(dir, f.path))]
+    )
+    report.layers = estimate_layers(dir, {f.path: f.size for f in report.files})
+    return report
+
+
+def format_report(report: ContextReport, top: int = 10) -> str:
+    lines = [f"build context: {format_size(report.total)} in {len(report.files)} files"]
+
+    lines.append("directories:")
+    for name, size in sorted(report.directories.items(), key=lambda d: -d[1]):
+        lines.append(f"  {format_size(size):>8} {name}")
+
+    lines.append("largest files:")
+    for f in sorted(report.files, key=lambda f: (-f.size, f.path))[:top]:
+        lines.append(f"  {format_size(f.size):>8} {f.path}")
+
+    if report.duplicates:
+        lines.append(
+            f"duplicate files, {format_size(report.duplicate_bytes)} could be saved:"
+        )
+        for group in report.duplicates[:top]:
+            lines.append(
+                f"  {format_size(group[0].size):>8} x{len(group)} "
+                + ", ".join(f.path for f in group)
+            )
+
+    lines.append("estimated layers:")
+    for instruction, size in report.layers:
+        lines.append(f"  {format_size(size):>8} {instruction}")
+    return "\n".join(lines)
+
+
+def check_budgets(
+    report: ContextReport,
+    max_size: Optional[int] = None,
+    budgets: Optional[Dict[str, int]] = None,
+) -> List[str]:
+    """Check the size of the context and of its directories against their budgets.
+
+    Returns:
+        List[str]: a message for each budget that was exceeded
+    """
+
+    errors: List[str] = []
+    if max_size is not None and report.total > max_size:
+        errors.append(
+            f"the build context is {format_size(report.total)}, more than the maximum of {format_size(max_size)}"
+        )
+
+    for name, budget in (budgets or {}).items():
+        size = report.directories.get(name, 0)
+        if size > budget:
+            largest = [
+                f.path
+                for f in sorted(report.files, key=lambda f: -f.size)
+                if top_level(f.path) == name
+            ][:3]
+            errors.append(
+                f'"{name}" is {format_size(size)}, more than its budget of {format_size(budget)}, the largest files are {", ".join(largest)}'
+            )
+    return errors
@@ -0,0 +1,191 @@
+"""Build several course images from a single manifest file.
+
+The manifest is a TOML file with an optional `[defaults]` table and one `[[course]]`
+table for each image to build. Both use the same option names as the cli, with the
+leading dashes removed and the other dashes replaced by underscores:
+
+    [defaults]
+    base = "scioer/java-resource:latest"
+    wiki_navigation = "TREE"
+
+    [[course]]
+    name = "CIS*1300"
+    tag = "scioer/cis1300:latest"
+    jupyter_repo = "https://github.com/example/jupyter.git"
+    example = ["https://github.com/example/a1.git", "https://github.com/example/a2.git"]
+"""
+
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib  # noqa: I900
+
+_LOGGER = logging.getLogger(__name__)
+
+# the options that can not be set for a single course
+IGNORED_OPTIONS: List[str] = [
+    "help",
+    "version",
+    "interactive",
+    "batch",
+    "serve",
+    "concurrency",
+    "pool_size",
+    "listen",
+    "state_dir",
+    "token_file",
+    "<manifest>",
+]
+
+# the options for the paths that a build writes to, each course gets its own unless
+# the course sets them itself
+OUTPUT_OPTIONS: List[str] = ["workdir", "trace_file", "metrics_file"]
+
+LIST_OPTIONS: List[str] = [
+    "example",
+    "example_dir",
+    "sparse",
+    "extra_tag",
+    "context_budget",
+]
+
+
+@dataclass
+class CourseResult:
+    name: str
+    tag: str
+    succeeded: bool
+    duration: float
+    message: str = ""
+
+
+def load_manifest(path: str) -> Tuple[dict, List[dict]]:
+    """Read a batch manifest file.
+
+    Returns:
+        Tuple[dict, List[dict]]: the default options and the options of each course
+    """
+
+    with open(path, "rb") as f:
+        manifest = tomllib.load(f)
+
+    unknown = set(manifest.keys()) - {"defaults", "course"}
+    if unknown:
+        raise ValueError(f"unknown sections in the manifest: {sorted(unknown)}")
+
+    courses = manifest.get("course", [])
+    if not courses:
+        raise ValueError("the manifest does not contain any [[course]] entries")
+
+    return manifest.get("defaults", {}), courses
+
+
+def output_path(option: str, path: str, key: str) -> str:
+    """The path of an output option for a single course.
+
+    The workdir of a course is a directory in the shared workdir, and the name of a
+    file gets `key` added before its extension, like `trace-cis1300.json`.
+    """
+
+    key = re.sub(r"[^\w.-]+", "-", key).strip("-.") or "course"
+    if option == "workdir":
+        return os.path.join(path, key)
+    root, ext = os.path.splitext(path)
+    return f"{root}-{key}{ext}"
+
+
+def course_options(
+    opts: dict, defaults: dict, course: dict, id: Optional[str] = None
+) -> dict:
+    """Merge the cli options, the manifest defaults, and the course options.
+
+    The `OUTPUT_OPTIONS` that the course does not set itself are made unique to the
+    course with `output_path`, so builds that run at the same time do not use the
+    same workdir or overwrite each other's trace and metrics.
+
+    Args:
+        id (Optional[str]): what makes the outputs of the course unique, its name
+            by default
+
+    Raises:
+        ValueError: if the manifest uses an option that does not exist
+    """
+
+    merged = dict(opts)
+    for section in [defaults, course]:
+        for key, value in section.items():
+            if key == "name":
+                continue
+            if key not in opts or key in IGNORED_OPTIONS:
+                raise ValueError(f"'{key}' is not a valid course option")
+            if key in LIST_OPTIONS and isinstance(value, str):
+                value = [value]
+            merged[key] = value
+
+    merged["name"] = course.get("name") or merged["tag"]
+    for option in OUTPUT_OPTIONS:
+        if merged.get(option) and option not in course:
+            merged[option] = output_path(option, merged[option], id or merged["name"])
+    return merged
+
+
+def run_batch(
+    courses: List[dict],
+    build: Callable[[dict, int], Optional[bool]],
+    concurrency: int = 1,
+) -> List[CourseResult]:
+    """Build every course, with at most `concurrency` builds running at a time.
+
+    A failing course does not stop the others from being built.
+
+    Args:
+        courses (List[dict]): the options for each course
+        build (Callable[[dict, int], Optional[bool]]): builds a single course given
+            its options and its index, returns False or raises if it failed
+        concurrency (int): the maximum number of builds to run at the same time
+
+    Returns:
+        List[CourseResult]: the results in the same order as the courses
+    """
+
+    def build_course(index: int, course: dict) -> CourseResult:
+        start = monotonic()
+        try:
+            succeeded = build(course, index) is not False
+            message = "" if succeeded else "build failed"
+        except SystemExit as e:
+            succeeded, message = False, str(e.code)
+        except Exception as e:
+            _LOGGER.error(f"Failed to build `{course['name']}`: {e}")
+            succeeded, message = False, str(e)
+
+        return CourseResult(
+            course["name"], course["tag"], succeeded, monotonic() - start, message
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(build_course, i, c) for i, c in enumerate(courses)]
+        return [future.result() for future in futures]
+
+
+def format_summary(results: List[CourseResult]) -> str:
+    rows: List[Tuple[str, ...]] = [("COURSE", "TAG", "RESULT", "DURATION")]
+    for result in results:
+        minutes, seconds = divmod(int(round(result.duration)), 60)
+        status = "ok" if result.succeeded else f"failed: {result.message}"
+        rows.append((result.name, result.tag, status, f"{minutes}m{seconds:02d}s"))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
@@ -0,0 +1,270 @@
+"""Run BuildKit builds through the buildx cli.
+
+The plain progress output of buildx is parsed into the steps of the build while it
+runs, so it can be reported how long each `Dockerfile` step took and which steps were
+taken from the cache.
+A local cache directory can be imported from and exported to, so builds on machines
+that do not keep the BuildKit state between runs, like CI runners, can still reuse
+the layers of an earlier build.
+"""
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import uuid
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+from builder.gitcache import file_lock
+
+_LOGGER = logging.getLogger(__name__)
+
+# `#5 [2/6] COPY motd /etc/motd` or `#5 [linux/arm64 2/6] COPY ...`
+_STEP_START = re.compile(r"^#(\d+) \[(?:(\S+) )?(\d+)/(\d+)\] (.*)$")
+_VERTEX_START = re.compile(r"^#(\d+) (\[[^\]]+\] .*|[a-z].*)$")
+_VERTEX_DONE = re.compile(r"^#(\d+) DONE (\d+(?:\.\d+)?)s$")
+_VERTEX_CACHED = re.compile(r"^#(\d+) CACHED$")
+_VERTEX_ERROR = re.compile(r"^#(\d+) ERROR: (.*)$")
+
+# the destinations of the course content, only the copies into these are linked
+LINK_DESTINATIONS: List[str] = [
+    "/builtin/jupyter/",
+    "/builtin/practiceProblems/",
+    "/opt/static/lectures/",
+]
+
+# `COPY --chown=... <source> <destination>`, without `--link` yet
+_COPY = re.compile(r"^COPY\s+((?:--\S+\s+)*)(\S+)\s+(\S+)\s*$", re.IGNORECASE)
+
+
+@dataclass
+class BuildStep:
+    id: int
+    name: str
+    # the position in the `Dockerfile` as `(step, total)`, None for internal vertices
+    position: Optional[tuple] = None
+    platform: Optional[str] = None
+    cached: bool = False
+    done: bool = False
+    error: Optional[str] = None
+    duration: float = 0
+    # the `perf_counter` time when the step was first seen in the output
+    started: float = 0
+
+    def __str__(self) -> str:
+        if self.position is None:
+            return self.name
+        platform = f"{self.platform} " if self.platform else ""
+        return f"[{platform}{self.position[0]}/{self.position[1]}] {self.name}"
+
+
+class BuildProgress:
+    """Follow the `--progress=plain` output of a buildx build."""
+
+    def __init__(self):
+        self.steps: Dict[int, BuildStep] = {}
+
+    def feed(self, line: str) -> Optional[BuildStep]:
+        """Parse one line of the output.
+
+        Returns:
+            Optional[BuildStep]: the step the line is about, if any
+        """
+
+        line = line.rstrip()
+        match = _VERTEX_CACHED.match(line)
+        if match:
+            step = self._get(int(match.group(1)))
+            step.cached = True
+            step.done = True
+            return step
+
+        match = _VERTEX_DONE.match(line)
+        if match:
+            step = self._get(int(match.group(1)))
+            step.done = True
+            step.duration = float(match.group(2))
+            return step
+
+        match = _VERTEX_ERROR.match(line)
+        if match:
+            step = self._get(int(match.group(1)))
+            step.error = match.group(2)
+            return step
+
+        match = _STEP_START.match(line)
+        if match:
+            id = int(match.group(1))
+            if id not in self.steps:
+                self.steps[id] = BuildStep(
+                    id,
+                    match.group(5),
+                    (int(match.group(3)), int(match.group(4))),
+                    match.group(2),
+                    started=perf_counter(),
+                )
+            return self.steps[id]
+
+        match = _VERTEX_START.match(line)
+        if match:
+            id = int(match.group(1))
+            if id not in self.steps:
+                self.steps[id] = BuildStep(id, match.group(2), started=perf_counter())
+            return self.steps[id]
+
+        return None
+
+    def _get(self, id: int) -> BuildStep:
+        if id not in self.steps:
+            self.steps[id] = BuildStep(id, f"#{id}", started=perf_counter())
+        return self.steps[id]
+
+    def dockerfile_steps(self) -> List[BuildStep]:
+        """The steps of the `Dockerfile` in order, without the internal vertices."""
+
+        steps = [s for s in self.steps.values() if s.position is not None]
+        return sorted(steps, key=lambda s: (s.platform or "", s.position, s.id))
+
+    def report(self) -> str:
+        """A line for each `Dockerfile` step with how long it took and if it was cached."""
+
+        lines = []
+        steps = self.dockerfile_steps()
+        for step in steps:
+            status = "CACHED" if step.cached else "built"
+            lines.append(f"{step.duration:7.1f}s {status:6} {step}")
+
+        hits = len([s for s in steps if s.cached])
+        total = sum(s.duration for s in self.steps.values())
+        lines.append(
+            f"{hits} of {len(steps)} steps were cached, {total:.1f}s spent in the steps"
+        )
+        return "\n".join(lines)
+
+
+class LocalCache:
+    """A BuildKit cache that is kept in a local directory.
+
+    Every build exports its cache next to the old one and it is swapped in after the
+    build succeeded, otherwise the local cache only ever grows.
+    """
+
+    def __init__(self, dir: str):
+        self.dir = os.path.abspath(os.path.expanduser(dir))
+        self.new = f"{self.dir}.new-{uuid.uuid4().hex[:8]}"
+
+    def args(self) -> List[str]:
+        """The buildx arguments to import from and export to the cache."""
+
+        args = []
+        if os.path.isfile(os.path.join(self.dir, "index.json")):
+            args += ["--cache-from", f"type=local,src={self.dir}"]
+        else:
+            _LOGGER.info(f"the build cache in `{self.dir}` is empty")
+
+        args += ["--cache-to", f"type=local,dest={self.new},mode=max"]
+        return args
+
+    def commit(self, succeeded: bool = True) -> None:
+        """Replace the cache with the one that was exported by the build."""
+
+        if not os.path.isdir(self.new):
+            return
+
+        if not succeeded:
+            shutil.rmtree(self.new, ignore_errors=True)
+            return
+
+        os.makedirs(os.path.dirname(self.dir), exist_ok=True)
+        old = f"{self.dir}.old-{uuid.uuid4().hex[:8]}"
+        # builds that share the cache directory may finish at the same time
+        with file_lock(f"{self.dir}.lock"):
+            if os.path.exists(self.dir):
+                os.rename(self.dir, old)
+            os.rename(self.new, self.dir)
+        shutil.rmtree(old, ignore_errors=True)
+        _LOGGER.info(f"updated the build cache in `{self.dir}`")
+
+
+def link_line(line: str) -> str:
+    """Add `--link` to a `COPY` of the course content that sets its owner."""
+
+    match = _COPY.match(line)
+    if (
+        match is None
+        or "--link" in match.group(1)
+        or "--chown" not in match.group(1)
+        or match.group(3) not in LINK_DESTINATIONS
+    ):
+        return line
+    return f"COPY --link {match.group(1)}{match.group(2)} {match.group(3)}"
+
+
+def link_copies(dir: str) -> None:
+    """Add `--link` to the `COPY` instructions of the content in the `Dockerfile`.
+
+    The layers of linked instructions do not depend on the layers before them, so
+    they can be built in parallel and stay cached when an earlier layer changes. This
+    is only supported by BuildKit.
+
+    A linked layer holds the parent directories of its destination with the default
+    owner and mode, and they replace the ones of the base image. So only the copies
+    into `LINK_DESTINATIONS` that set their owner with `--chown` are linked, the wiki
+    database and the motd go into directories that the base image sets up.
+    """
+
+    path = os.path.join(dir, "Dockerfile")
+    with open(path, "r") as f:
+        lines = f.read().split("\n")
+
+    lines = [link_line(line) for line in lines]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def run_buildx(
+    cmd: List[str],
+    on_line: Optional[Callable[[str, Optional[BuildStep]], None]] = None,
+) -> BuildProgress:
+    """Run a `docker buildx build` command and follow its plain progress output.
+
+    Args:
+        cmd (List[str]): the command to run, it needs to use `--progress=plain`
+        on_line (Optional[Callable]): called with every line of the output as soon as
+            it is written and the step it is about
+
+    Raises:
+        subprocess.CalledProcessError: if the build failed
+    """
+
+    progress = BuildProgress()
+    _LOGGER.debug(f"build command: `{' '.join(cmd)}`")
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        # the progress is written to stderr
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+    )
+    try:
+        for line in process.stdout:
+            step = progress.feed(line)
+            if line.strip():
+                _LOGGER.info(line.rstrip())
+            if on_line:
+                on_line(line.rstrip(), step)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        for step in progress.steps.values():
+            if step.error:
+                _LOGGER.error(f"{step.name}: {step.error}")
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+    return progress
@@ -0,0 +1,149 @@
+"""Stream a docker build context straight from the staged build directory.
+
+docker-py writes the whole build context to a temporary tarball before it starts to
+upload it. Here the tar is generated in a background thread while it is being sent to
+the daemon, only a few chunks are ever held in memory and nothing is written to disk.
+"""
+
+import logging
+import os
+import queue
+import tarfile
+import threading
+from typing import Iterator, List, Optional
+
+try:
+    import zstandard  # noqa: I900
+except ImportError:
+    zstandard = None
+
+_LOGGER = logging.getLogger(__name__)
+
+COMPRESSIONS: List[str] = ["none", "gzip", "zstd"]
+
+CHUNK_SIZE: int = 1024 * 1024
+
+_DONE = object()
+
+
+def missing_package(compression: str) -> Optional[str]:
+    """The package that `compression` needs, if it is not installed."""
+
+    return "zstandard" if compression == "zstd" and zstandard is None else None
+
+
+class _QueueWriter:
+    """A write only file object that hands the written bytes to the consumer."""
+
+    def __init__(self, chunks: "queue.Queue", closed: threading.Event):
+        self.chunks = chunks
+        self.closed = closed
+        self.buffer = bytearray()
+        self.written = 0
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.written += len(data)
+        while len(self.buffer) >= CHUNK_SIZE:
+            self._put(bytes(self.buffer[:CHUNK_SIZE]))
+            del self.buffer[:CHUNK_SIZE]
+        return len(data)
+
+    def flush(self) -> None:
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def _put(self, item) -> None:
+        while not self.closed.is_set():
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise BrokenPipeError("the build context stream has been closed")
+
+
+def _add_tree(tar: tarfile.TarFile, dir: str) -> None:
+    for root, dirs, files in os.walk(dir):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            path = os.path.join(root, name)
+            arcname = os.path.relpath(path, dir).replace(os.sep, "/")
+            tar.add(path, arcname=arcname, recursive=False)
+
+
+class ContextStream:
+    """Iterate over the chunks of a tar archive of `dir` as it is being created.
+
+    Args:
+        dir (str): the directory to use as the build context
+        compression (str): one of 'none', 'gzip', or 'zstd'
+        max_chunks (int): the number of chunks that can be buffered in memory
+    """
+
+    def __init__(self, dir: str, compression: str = "none", max_chunks: int = 8):
+        if compression not in COMPRESSIONS:
+            raise ValueError(
+                f"'{compression}' is not a valid compression, must be one of {COMPRESSIONS}"
+            )
+        if missing_package(compression):
+            raise ValueError(
+                "the `zstandard` package is needed for zstd compression, install it with `pip install scioer-builder[zstd]`"
+            )
+
+        self.dir = dir
+        self.compression = compression
+        self.chunks: "queue.Queue" = queue.Queue(maxsize=max_chunks)
+        self.closed = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.tar_bytes = 0
+        self.sent_bytes = 0
+        self.thread = threading.Thread(
+            target=self._produce,
+            name=f"{threading.current_thread().name}-context",
+            daemon=True,
+        )
+
+    def _produce(self) -> None:
+        writer = _QueueWriter(self.chunks, self.closed)
+        try:
+            if self.compression == "zstd":
+                compressor = zstandard.ZstdCompressor().stream_writer(
+                    writer, closefd=False
+                )
+                with tarfile.open(fileobj=compressor, mode="w|") as tar:
+                    _add_tree(tar, self.dir)
+                compressor.close()
+            else:
+                mode = "w|gz" if self.compression == "gzip" else "w|"
+                with tarfile.open(fileobj=writer, mode=mode) as tar:
+                    _add_tree(tar, self.dir)
+            writer.flush()
+        except BaseException as e:  # handed to the consumer thread
+            self.error = e
+        finally:
+            self.tar_bytes = writer.written
+            try:
+                writer._put(_DONE)
+            except BrokenPipeError:
+                pass
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.thread.start()
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is _DONE:
+                    break
+                self.sent_bytes += len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+        if self.error is not None:
+            raise self.error
+        _LOGGER.debug(f"sent a {self.sent_bytes} byte build context")
+
+    def close(self) -> None:
+        self.closed.set()
@@ -0,0 +1,303 @@
+"""A persistent on disk cache of bare git mirrors.
+
+Each repository that gets cloned is stored as a bare mirror in the cache directory,
+keyed by its normalized URI. Later builds only need to fetch the new commits into the
+mirror and then clone the working tree from the local mirror.
+
+The cache can be shared by several builder processes, each mirror is protected by its
+own lock file and the whole cache is locked while entries are being evicted.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from git import Repo  # noqa: I900
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+    import msvcrt
+
+_LOGGER = logging.getLogger(__name__)
+
+LAST_USED_FILE: str = "scioer-last-used"
+
+# the errors `msvcrt.locking` fails with when the file is locked by someone else
+LOCK_HELD_ERRORS = {errno.EACCES, errno.EDEADLK}
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False, blocking: bool = True) -> Iterator[bool]:
+    """Hold an advisory lock on `path` for the duration of the context.
+
+    Windows does not have shared locks, there a shared lock is an exclusive one. The
+    callers only use shared locks to let readers run at the same time, so they are
+    still correct, just slower.
+
+    Args:
+        path (str): the lock file to use, it will be created if it does not exist
+        shared (bool): take a shared lock instead of an exclusive one (posix only)
+        blocking (bool): wait for the lock, otherwise yield False if it is held
+
+    Yields:
+        bool: if the lock was acquired, always True when blocking
+
+    Raises:
+        OSError: if the lock could not be taken for another reason than it being held
+    """
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    acquired = False
+    try:
+        if fcntl is not None:
+            flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(fd, flags)
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+        else:
+            mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+            while not acquired:
+                try:
+                    msvcrt.locking(fd, mode, 1)
+                    acquired = True
+                except OSError as e:
+                    if e.errno not in LOCK_HELD_ERRORS:
+                        raise
+                    if not blocking:
+                        break
+                    # `LK_LOCK` gives up after about 10 seconds, keep waiting
+
+        yield acquired
+    finally:
+        if acquired:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+def normalize_uri(uri: str) -> str:
+    """Normalize a git URI so that equivalent ways of writing it share a mirror.
+
+    The credentials, scheme, trailing slashes and `.git` suffix are dropped and the
+    host name is lower cased. `git@host:path` style URIs map to the same key as
+    `ssh://git@host/path` and local paths are resolved to their real path.
+    """
+
+    uri = uri.strip()
+
+    scp = re.match(r"^(?:[^@/]+@)?([^:/]+):(?!//)(.*)$", uri)
+    if "://" in uri:
+        parts = urlsplit(uri)
+        if parts.scheme == "file":
+            normalized = "file://" + os.path.realpath(parts.path)
+        else:
+            host = (parts.hostname or "").lower()
+            port = f":{parts.port}" if parts.port else ""
+            normalized = f"{host}{port}/{parts.path.lstrip('/')}"
+    elif scp and not os.path.exists(uri) and sys.platform != "win32":
+        normalized = f"{scp.group(1).lower()}/{scp.group(2).lstrip('/')}"
+    else:
+        normalized = "file://" + os.path.realpath(os.path.expanduser(uri))
+
+    normalized = normalized.rstrip("/")
+    if normalized.endswith(".git"):
+        normalized = normalized[:-4]
+    return normalized.rstrip("/")
+
+
+def redact_uri(text: str) -> str:
+    """Hide the credentials of every url in `text`, like a git command line."""
+
+    return re.sub(r"(\w+://)[^/@\s]+@", r"\1***@", text)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class GitCache:
+    root: str
+    max_size: Optional[int]
+    max_age: Optional[float]
+
+    def __init__(
+        self, root: str, max_size: Optional[int] = None, max_age: Optional[float] = None
+    ):
+        """
+        Args:
+            root (str): the directory the mirrors are stored in
+            max_size (Optional[int]): the total size in bytes the cache is evicted to
+            max_age (Optional[float]): the number of seconds an unused mirror is kept
+        """
+
+        self.root = os.path.realpath(os.path.expanduser(root))
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, uri: str) -> str:
+        return hashlib.sha256(normalize_uri(uri).encode("utf-8")).hexdigest()[:32]
+
+    def mirror_path(self, uri: str) -> str:
+        return os.path.join(self.root, f"{self.key(uri)}.git")
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.lock")
+
+    def _touch(self, mirror: str) -> None:
+        with open(os.path.join(mirror, LAST_USED_FILE), "w") as f:
+            f.write(str(time.time()))
+
+    def _fetch(self, uri: str, mirror: str, env: dict) -> None:
+        if not os.path.isdir(mirror):
+            _LOGGER.info(f'creating git cache mirror for "{redact_uri(uri)}"...')
+            tmp = f"{mirror}.tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            Repo.clone_from(uri, tmp, mirror=True, env=env)
+            mirror_repo = Repo(tmp)
+            mirror_repo.git.config("uploadpack.allowFilter", "true")
+            mirror_repo.git.remote("remove", "origin")
+            with open(os.path.join(tmp, "scioer-uri"), "w") as f:
+                json.dump({"uri": normalize_uri(uri)}, f)
+            os.rename(tmp, mirror)
+            return
+
+        _LOGGER.info(f'updating git cache mirror for "{redact_uri(uri)}"...')
+        # the mirrors do not have a remote, always fetch from the uri that was given
+        # so that credentials are never persisted in the cache
+        Repo(mirror).git.fetch(
+            uri,
+            "+refs/heads/*:refs/heads/*",
+            "+refs/tags/*:refs/tags/*",
+            "--prune",
+            env=env,
+        )
+        remote_head = Repo(mirror).git.ls_remote("--symref", uri, "HEAD", env=env)
+        match = re.search(r"^ref: (\S+)\s+HEAD", remote_head, re.MULTILINE)
+        if match:
+            Repo(mirror).git.symbolic_ref("HEAD", match.group(1))
+
+    def clone(
+        self,
+        uri: str,
+        folder: str,
+        env: Optional[dict] = None,
+        branch: Optional[str] = None,
+        sparse_paths: Sequence[str] = (),
+        **kwargs,
+    ) -> Repo:
+        """Clone `uri` into `folder` through the cache.
+
+        The mirror for the repository is created or updated first, then the working
+        tree is cloned and checked out from the local mirror, so the blobs of a
+        partial clone are fetched from the mirror as well. The `origin` remote of the
+        new clone points at the original uri afterwards. Any extra keyword arguments
+        are passed through to `git clone`.
+        """
+
+        env = env or {}
+        key = self.key(uri)
+        mirror = self.mirror_path(uri)
+
+        with ExitStack() as stack:
+            # `evict` needs the cache lock, holding it while the mirror lock is
+            # downgraded keeps the mirror from being removed before it is cloned
+            with file_lock(os.path.join(self.root, "cache.lock"), shared=True):
+                with file_lock(self._lock_path(key)):
+                    self._fetch(uri, mirror, env)
+                    self._touch(mirror)
+                stack.enter_context(file_lock(self._lock_path(key), shared=True))
+
+            options = dict(kwargs)
+            if branch:
+                options["branch"] = branch
+            source = mirror
+            if any(k in options for k in ("depth", "filter")):
+                # shallow and partial clones are ignored for plain local paths
+                source = "file://" + mirror.replace(os.sep, "/")
+            repo = Repo.clone_from(source, folder, env=env, **options)
+            if sparse_paths:
+                repo.git.sparse_checkout("set", *sparse_paths, env=env)
+
+        repo.git.remote("set-url", "origin", uri)
+        return repo
+
+    def entries(self) -> List[Tuple[str, float, int]]:
+        """List the mirrors in the cache.
+
+        Returns:
+            List[Tuple[str, float, int]]: the key, last use time, and size of each mirror
+        """
+
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".git"):
+                continue
+
+            path = os.path.join(self.root, name)
+            try:
+                last_used = os.path.getmtime(os.path.join(path, LAST_USED_FILE))
+            except OSError:
+                last_used = os.path.getmtime(path)
+            entries.append((name[:-4], last_used, directory_size(path)))
+        return entries
+
+    def evict(self) -> List[str]:
+        """Remove the mirrors that are too old, then the least recently used mirrors
+        until the cache fits in `max_size`. Mirrors that are in use are skipped.
+
+        Returns:
+            List[str]: the keys of the mirrors that were removed
+        """
+
+        if self.max_size is None and self.max_age is None:
+            return []
+
+        removed: List[str] = []
+        with file_lock(os.path.join(self.root, "cache.lock")):
+            entries = sorted(self.entries(), key=lambda e: e[1])
+            total = sum(size for _, _, size in entries)
+            now = time.time()
+
+            for key, last_used, size in entries:
+                expired = self.max_age is not None and now - last_used > self.max_age
+                too_big = self.max_size is not None and total > self.max_size
+                if not expired and not too_big:
+                    continue
+
+                with file_lock(self._lock_path(key), blocking=False) as acquired:
+                    if not acquired:
+                        _LOGGER.debug(f"git cache entry {key} is in use, skipping")
+                        continue
+
+                    _LOGGER.info(f"evicting git cache entry {key}...")
+                    shutil.rmtree(os.path.join(self.root, f"{key}.git"))
+                    total -= size
+                    removed.append(key)
+
+        return removed
@@ -0,0 +1,145 @@
+"""Split large content directories over several image layers.
+
+Each file is placed in a bucket by hashing its path, so a file always lands in the
+same bucket no matter what else changes. The buckets are then packed into the
+requested number of groups by their rounded size, so a bucket only moves to another
+group when the sizes change significantly. Each group gets its own `COPY` instruction.
+Docker can then push and pull the groups in parallel and a change to a single file
+only changes the layer of its group.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+from typing import Dict, List, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+
+SPLIT_DIRECTORIES: List[str] = ["lectures", "practiceProblems"]
+
+# the number of hash buckets for each group, more buckets give a better balance
+BUCKETS_PER_GROUP: int = 16
+
+# bucket sizes are rounded to this fraction of a group before they are packed, so
+# small changes to the content do not move buckets between groups
+SIZE_RESOLUTION: int = 32
+
+
+def list_files(dir: str) -> List[Tuple[str, int]]:
+    files: List[Tuple[str, int]] = []
+    for root, dirs, names in os.walk(dir):
+        # links to directories are not followed, they are moved like files
+        links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        for name in names + links:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, dir).replace(os.sep, "/")
+            files.append((rel, os.lstat(path).st_size))
+    return sorted(files)
+
+
+def assign_groups(files: List[Tuple[str, int]], groups: int) -> Dict[str, int]:
+    """Assign every file to one of `groups` size balanced groups.
+
+    Args:
+        files (List[Tuple[str, int]]): the relative path and size of each file
+        groups (int): the number of groups
+
+    Returns:
+        Dict[str, int]: the group of each file, keyed by its path
+    """
+
+    buckets = groups * BUCKETS_PER_GROUP
+    bucket_of: Dict[str, int] = {}
+    sizes = [0] * buckets
+    for path, size in files:
+        digest = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        bucket = int(digest[:8], 16) % buckets
+        bucket_of[path] = bucket
+        sizes[bucket] += size
+
+    unit = max(1, sum(sizes) // (groups * SIZE_RESOLUTION))
+    rounded = [round(size / unit) for size in sizes]
+
+    loads = [0] * groups
+    group_of_bucket: Dict[int, int] = {}
+    for bucket in sorted(range(buckets), key=lambda b: (-rounded[b], b)):
+        group = min(range(groups), key=lambda g: (loads[g], g))
+        group_of_bucket[bucket] = group
+        loads[group] += rounded[bucket]
+
+    return {path: group_of_bucket[bucket] for path, bucket in bucket_of.items()}
+
+
+def split_directory(dir: str, name: str, groups: int) -> List[str]:
+    """Move the files of `dir/name` into `groups` directories next to it.
+
+    Every group is copied on top of the same destination. The full directory
+    structure is recreated in the first group so that empty directories are kept.
+
+    Returns:
+        List[str]: the paths of the groups relative to `dir`
+    """
+
+    source = os.path.join(dir, name)
+    layers = [f"{name}.layers/{i}" for i in range(groups)]
+    if not os.path.isdir(source):
+        return [name]
+
+    files = list_files(source)
+    assignment = assign_groups(files, groups)
+
+    for root, _, _ in os.walk(source):
+        rel = os.path.relpath(root, source)
+        os.makedirs(os.path.normpath(os.path.join(dir, layers[0], rel)), exist_ok=True)
+
+    loads = [0] * groups
+    for path, size in files:
+        group = assignment[path]
+        target = os.path.join(dir, layers[group], *path.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(os.path.join(source, *path.split("/")), target)
+        loads[group] += size
+
+    for layer in layers:
+        os.makedirs(os.path.join(dir, layer), exist_ok=True)
+    shutil.rmtree(source)
+
+    _LOGGER.info(f'split "{name}" into {groups} layers of {loads} bytes')
+    return layers
+
+
+def write_dockerfile(dir: str, layers: Dict[str, List[str]]) -> None:
+    """Replace the `COPY` instruction for each split directory with one per group."""
+
+    dockerfile = os.path.join(dir, "Dockerfile")
+    with open(dockerfile, "r") as f:
+        lines = f.read().split("\n")
+
+    output: List[str] = []
+    for line in lines:
+        match = re.match(r"^(COPY\s+(?:--\S+\s+)*)(\S+)(\s+\S+)\s*$", line)
+        if match and match.group(2) in layers:
+            for layer in layers[match.group(2)]:
+                output.append(f"{match.group(1)}{layer}{match.group(3)}")
+        else:
+            output.append(line)
+
+    with open(dockerfile, "w") as f:
+        f.write("\n".join(output))
+
+
+def split_layers(dir: str, groups: int) -> Dict[str, List[str]]:
+    """Split all of the large content directories in the build directory.
+
+    Returns:
+        Dict[str, List[str]]: the groups that each directory was split into
+    """
+
+    if groups <= 1:
+        return {}
+
+    layers = {name: split_directory(dir, name, groups) for name in SPLIT_DIRECTORIES}
+    write_dockerfile(dir, layers)
+    return layers
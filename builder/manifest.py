@@ -0,0 +1,183 @@
+"""Describe everything that goes into an image so unchanged rebuilds can be skipped.
+
+The content manifest holds a hash of each input of the build, such as the commit of
+a repository, the contents of a local directory, or the id of the base image. It is
+stored as a label on the image, so the next build can compare it with its own inputs
+and tell which of them changed, or that the image would be the same.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional
+
+import docker
+
+from builder.gitcache import file_lock
+
+_LOGGER = logging.getLogger(__name__)
+
+MANIFEST_LABEL: str = "org.sci-oer.content-manifest"
+
+# the size of the blocks that files are read in while they are hashed
+_BLOCK_SIZE: int = 1024 * 1024
+
+
+def hash_value(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """Remember the hash of each file by its path, size, modification time, and inode.
+
+    A file that has not changed since it was last hashed is not read again. The cache
+    file can be shared by several builder processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, list] = self._read()
+        self.updated: Dict[str, list] = {}
+
+    def _read(self) -> Dict[str, list]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def hash_file(self, path: str) -> str:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = [st.st_size, st.st_mtime_ns, st.st_ino]
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry[:3] == key:
+            return entry[3]
+
+        digest = hash_file(path)
+        with self.lock:
+            self.entries[path] = self.updated[path] = key + [digest]
+        return digest
+
+    def save(self) -> None:
+        """Write the new hashes into the cache file, the files that are gone are dropped."""
+
+        with self.lock:
+            updated = dict(self.updated)
+            self.updated.clear()
+        if not updated:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with file_lock(f"{self.path}.lock"):
+            entries = self._read()
+            entries.update(updated)
+            entries = {k: v for k, v in entries.items() if os.path.exists(k)}
+
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+
+
+def hash_tree(dir: str, cache: Optional[HashCache] = None) -> str:
+    """Hash the names, link targets, and contents of all the files in `dir`.
+
+    Args:
+        cache (Optional[HashCache]): where to look up the hashes of unchanged files
+    """
+
+    hasher = cache.hash_file if cache is not None else hash_file
+    digest = hashlib.sha256()
+    for root, dirs, names in os.walk(dir):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, dir).replace(os.sep, "/")
+            if os.path.islink(path):
+                entry = f"link {rel} {os.readlink(path)}"
+            else:
+                entry = f"file {rel} {hasher(path)}"
+            digest.update(entry.encode("utf-8", "surrogateescape") + b"\0")
+    return digest.hexdigest()
+
+
+def encode(manifest: Dict[str, str]) -> str:
+    return json.dumps(manifest, sort_keys=True, separators=(",", ":"))
+
+
+def decode(label: Optional[str]) -> Optional[Dict[str, str]]:
+    if not label:
+        return None
+    try:
+        manifest = json.loads(label)
+    except ValueError:
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def changed_inputs(old: Dict[str, str], new: Dict[str, str]) -> List[str]:
+    return sorted(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+
+def local_manifest(client: docker.DockerClient, name: str) -> Optional[Dict[str, str]]:
+    """The content manifest of the local image called `name`, if it has one."""
+
+    try:
+        image = client.images.get(name)
+    except docker.errors.ImageNotFound:
+        return None
+    return decode((image.labels or {}).get(MANIFEST_LABEL))
+
+
+def remote_manifest(name: str) -> Optional[Dict[str, str]]:
+    """The content manifest of the image called `name` in its registry.
+
+    Only the image config is fetched, through `docker buildx imagetools`, so this
+    works for multi-arch images as well.
+    """
+
+    res = subprocess.run(
+        [
+            "docker",
+            "buildx",
+            "imagetools",
+            "inspect",
+            name,
+            "--format",
+            "{{json .Image}}",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if res.returncode != 0:
+        _LOGGER.debug(
+            f"could not inspect `{name}` in the registry: {res.stderr.strip()}"
+        )
+        return None
+
+    try:
+        image = json.loads(res.stdout)
+    except ValueError:
+        return None
+
+    # a multi-arch image has an entry for each platform, they all have the same labels
+    configs = [image] if "config" in image else list(image.values())
+    for config in configs:
+        labels = (config.get("config") or {}).get("Labels") or {}
+        if MANIFEST_LABEL in labels:
+            return decode(labels[MANIFEST_LABEL])
+    return None
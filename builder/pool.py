@@ -0,0 +1,143 @@
+"""Keep expensive resources prepared ahead of time so that builds do not wait for them.
+
+The pool holds up to `size` idle items for each key. Taking an item hands out one that
+is ready, or one that is still being prepared if none are, and only creates a new one
+when there are no idle items left. Returned items are reset in the background and go
+back into the pool, or are destroyed when the pool is already full.
+
+An item is prepared in a worker thread that is named after the thread that asked for
+it, like `job-<id>-pool`, so the logs of preparing it go with that build.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+_LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class WarmPool(Generic[T]):
+    """A pool of items that are created and reset by background workers.
+
+    Args:
+        size (int): the number of idle items to keep for each key
+        create (Callable[[Hashable], T]): creates a new ready to use item for a key
+        reset (Callable[[T], None]): returns a used item to its pristine state, raises
+            if the item can not be reused
+        destroy (Callable[[T], None]): releases all of the resources of an item
+        workers (Optional[int]): the number of items that can be prepared at once
+    """
+
+    def __init__(
+        self,
+        size: int,
+        create: Callable[[Hashable], T],
+        reset: Callable[[T], None],
+        destroy: Callable[[T], None],
+        workers: Optional[int] = None,
+    ):
+        self.size = size
+        self.create = create
+        self.reset = reset
+        self.destroy = destroy
+        self.lock = threading.Lock()
+        self.idle: Dict[Hashable, List[Future]] = {}
+        self.closed = False
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or max(1, size) * 2, thread_name_prefix="pool"
+        )
+
+    def _submit(self, key: Hashable, item: Optional[T] = None) -> Future:
+        owner = threading.current_thread().name
+        return self.executor.submit(self._prepare, owner, key, item)
+
+    def _prepare(self, owner: str, key: Hashable, item: Optional[T] = None) -> T:
+        thread = threading.current_thread()
+        name = thread.name
+        thread.name = f"{owner}-pool"
+        try:
+            if item is not None:
+                try:
+                    self.reset(item)
+                    return item
+                except Exception as e:
+                    _LOGGER.warning(f"Failed to reset a pooled item, replacing it: {e}")
+                    self._destroy(item)
+            return self.create(key)
+        finally:
+            thread.name = name
+
+    def _destroy(self, item: T) -> None:
+        try:
+            self.destroy(item)
+        except Exception as e:
+            _LOGGER.warning(f"Failed to destroy a pooled item: {e}")
+
+    def acquire(self, key: Hashable) -> T:
+        """Take an item for `key` out of the pool, blocking until it is ready.
+
+        The pool for a key is filled the first time that it is used.
+        """
+
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("the pool has been closed")
+
+            if key not in self.idle:
+                _LOGGER.info(f"warming {self.size} pooled item(s) for {key}")
+                self.idle[key] = [self._submit(key) for _ in range(self.size)]
+
+            idle = self.idle[key]
+            if idle:
+                ready = [future for future in idle if future.done()]
+                future = (ready or idle)[0]
+                idle.remove(future)
+            else:
+                future = self._submit(key)
+
+        if not future.done():
+            _LOGGER.info(f"waiting for a pooled item for {key} to be ready...")
+        return future.result()
+
+    def release(self, key: Hashable, item: T, reusable: bool = True) -> None:
+        """Give an item back to the pool.
+
+        Args:
+            key (Hashable): the key the item was acquired with
+            item (T): the item
+            reusable (bool): False to destroy the item instead of resetting it
+        """
+
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if self.closed or not reusable or len(idle) >= self.size:
+                keep = False
+            else:
+                keep = True
+                idle.append(self._submit(key, item))
+
+        if not keep:
+            self._destroy(item)
+
+    def close(self) -> None:
+        """Destroy every idle item, items that are still in use are left alone."""
+
+        with self.lock:
+            self.closed = True
+            futures = [future for idle in self.idle.values() for future in idle]
+            self.idle = {}
+
+        for future in futures:
+            future.cancel()
+        for future in futures:
+            if future.cancelled():
+                continue
+            try:
+                self._destroy(future.result())
+            except Exception as e:
+                _LOGGER.debug(f"pooled item failed while it was being prepared: {e}")
+
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,240 @@
+"""Only pull a base image when the registry has a newer version of it.
+
+The digest of the manifest in the registry is compared with the repo digests of the
+local image, so an image that is already current is not pulled at all. The result of
+a check is cached on disk for a while so that repeated builds do not even have to ask
+the registry again.
+"""
+
+import json
+import logging
+import os
+import threading
+from time import monotonic, time
+from typing import Any, Dict, List, Optional, Tuple
+
+import docker
+from docker.utils import parse_repository_tag
+from tqdm import tqdm
+
+from builder.gitcache import file_lock
+
+_LOGGER = logging.getLogger(__name__)
+
+# the statuses that mean a layer does not need to be downloaded anymore
+_LAYER_DONE: List[str] = [
+    "Download complete",
+    "Pull complete",
+    "Already exists",
+    "Verifying Checksum",
+    "Extracting",
+]
+
+
+def _normalize(repository: str) -> str:
+    for prefix in ["docker.io/", "index.docker.io/", "registry-1.docker.io/"]:
+        if repository.startswith(prefix):
+            repository = repository[len(prefix) :]
+    if repository.startswith("library/"):
+        repository = repository[len("library/") :]
+    return repository
+
+
+def split_image(name: str) -> Tuple[str, str]:
+    """Split an image name into the repository and the tag or digest."""
+
+    repository, tag = parse_repository_tag(name)
+    if tag and tag.startswith("sha256:"):
+        return repository, tag
+    return repository, tag or "latest"
+
+
+def local_digests(
+    client: docker.DockerClient, name: str
+) -> Tuple[Optional[str], List[str]]:
+    """Get the id and the repo digests of the local image.
+
+    Returns:
+        Tuple[Optional[str], List[str]]: the image id, or None if there is no local
+            image, and the manifest digests it was pulled as
+    """
+
+    try:
+        image = client.images.get(name)
+    except docker.errors.ImageNotFound:
+        return None, []
+
+    repository = _normalize(split_image(name)[0])
+    digests = []
+    for repoDigest in image.attrs.get("RepoDigests") or []:
+        repo, _, digest = repoDigest.partition("@")
+        if _normalize(repo) == repository:
+            digests.append(digest)
+    return image.id, digests
+
+
+def remote_digest(client: docker.DockerClient, name: str) -> Optional[str]:
+    """Ask the registry for the digest of the manifest that `name` points to.
+
+    Returns:
+        Optional[str]: the digest, or None if the registry could not be reached
+    """
+
+    try:
+        return client.images.get_registry_data(name).id
+    except docker.errors.APIError as e:
+        _LOGGER.warning(f"Failed to check the registry for `{name}`: {e}")
+        return None
+
+
+class PullCache:
+    """Remember when each image was last found to be current.
+
+    The cache file can be shared by several builder processes.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def fresh(self, name: str, image_id: Optional[str]) -> bool:
+        """If `name` was found to be current within the ttl and is still the same image."""
+
+        if image_id is None or self.ttl <= 0:
+            return False
+
+        entry = self._read().get(name)
+        return (
+            entry is not None
+            and entry.get("image_id") == image_id
+            and time() - entry.get("checked", 0) < self.ttl
+        )
+
+    def record(self, name: str, image_id: str, digest: Optional[str]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.lock, file_lock(f"{self.path}.lock"):
+            entries = self._read()
+            entries[name] = {"image_id": image_id, "digest": digest, "checked": time()}
+
+            # drop the entries that would not be used anymore
+            entries = {
+                k: v
+                for k, v in entries.items()
+                if time() - v.get("checked", 0) < max(self.ttl, 24 * 60 * 60)
+            }
+
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+
+
+def pull_image(
+    client: docker.DockerClient,
+    name: str,
+    progress_file: Optional[Any] = None,
+    position: Optional[int] = None,
+) -> int:
+    """Pull an image and show the download progress of all of its layers.
+
+    Returns:
+        int: the number of bytes that were downloaded
+
+    Raises:
+        docker.errors.APIError: if the pull failed
+    """
+
+    repository, tag = split_image(name)
+    layers: Dict[str, Tuple[int, int]] = {}
+    start = monotonic()
+
+    bar = tqdm(
+        total=0,
+        unit="B",
+        unit_scale=True,
+        desc=f"Pulling {name}",
+        leave=False,
+        file=progress_file,
+        position=position,
+    )
+    try:
+        for event in client.api.pull(repository, tag=tag, stream=True, decode=True):
+            if "error" in event:
+                raise docker.errors.APIError(event["error"])
+
+            layer = event.get("id", "")
+            status = event.get("status", "")
+            detail = event.get("progressDetail") or {}
+
+            if status == "Downloading" and detail.get("total"):
+                layers[layer] = (detail.get("current", 0), detail["total"])
+            elif status in _LAYER_DONE and layer in layers:
+                layers[layer] = (layers[layer][1], layers[layer][1])
+
+            if status in ["Pull complete", "Already exists"]:
+                _LOGGER.debug(f"layer {layer}: {status}")
+
+            bar.total = sum(total for _, total in layers.values())
+            bar.n = sum(current for current, _ in layers.values())
+            bar.refresh()
+    finally:
+        bar.close()
+
+    downloaded = sum(total for _, total in layers.values())
+    elapsed = max(monotonic() - start, 1e-6)
+    _LOGGER.info(
+        f"pulled {len(layers)} layer(s) of `{name}`, {downloaded} bytes at {downloaded / elapsed / 1024 / 1024:.1f} MB/s"
+    )
+    return downloaded
+
+
+def ensure_latest(
+    client: docker.DockerClient,
+    name: str,
+    cache: Optional[PullCache] = None,
+    progress_file: Optional[Any] = None,
+    position: Optional[int] = None,
+) -> int:
+    """Pull `name` unless the local image is already the latest one in the registry.
+
+    Returns:
+        int: the number of bytes that were downloaded, 0 if nothing was pulled
+    """
+
+    imageId, digests = local_digests(client, name)
+    if cache and cache.fresh(name, imageId):
+        _LOGGER.info(f"`{name}` was checked recently, not checking the registry")
+        return 0
+
+    repository, tag = split_image(name)
+    if tag.startswith("sha256:") and imageId is not None:
+        _LOGGER.info(f"`{name}` is pinned to a digest and is already available")
+        return 0
+
+    digest = remote_digest(client, name)
+    if digest is not None and digest in digests:
+        _LOGGER.info(f"`{name}` is already the latest version, skipping the pull")
+        if cache:
+            cache.record(name, imageId, digest)
+        return 0
+
+    _LOGGER.info(
+        f'pulling latest version of the "{name}" docker image, this may take a while...'
+    )
+    downloaded = pull_image(
+        client, name, progress_file=progress_file, position=position
+    )
+
+    if cache:
+        imageId, _ = local_digests(client, name)
+        if imageId:
+            cache.record(name, imageId, digest)
+    return downloaded
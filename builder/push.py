@@ -0,0 +1,213 @@
+"""Push an image to one or more tags and registries.
+
+The push is streamed so the progress of every layer is shown. A failed push is
+retried with a backoff, the registry then reports the layers that were already sent
+as existing so only the failed layers are sent again. When an image is pushed to
+several tags, the first tag of each registry is pushed before the others so the
+layers of the other tags are mounted from it instead of being uploaded again.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import Any, Dict, List, Optional, Tuple
+
+import docker
+from docker.auth import resolve_repository_name
+from docker.models.images import Image
+from requests.exceptions import RequestException
+from tqdm import tqdm
+
+from builder.pull import split_image
+
+_LOGGER = logging.getLogger(__name__)
+
+# errors that will not go away by trying again
+_FATAL_ERRORS: List[str] = [
+    "denied",
+    "unauthorized",
+    "authentication required",
+    "does not exist",
+]
+
+
+def expand_tags(tag: str, extra: List[str]) -> List[str]:
+    """The full names of all of the tags, `:<tag>` is a tag in the same repository."""
+
+    repository, _ = split_image(tag)
+    names = [tag]
+    for name in extra:
+        name = f"{repository}{name}" if name.startswith(":") else name
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def registry_of(name: str) -> str:
+    return resolve_repository_name(split_image(name)[0])[0]
+
+
+def push_tag(
+    client: docker.DockerClient,
+    name: str,
+    progress_file: Optional[Any] = None,
+    position: Optional[int] = None,
+) -> Tuple[str, int]:
+    """Push a single tag and show the upload progress of all of its layers.
+
+    Returns:
+        Tuple[str, int]: the digest of the pushed manifest and the number of bytes
+            that were uploaded
+
+    Raises:
+        docker.errors.APIError: if the push failed
+    """
+
+    repository, tag = split_image(name)
+    layers: Dict[str, Tuple[int, int]] = {}
+    skipped = 0
+    digest = ""
+    start = monotonic()
+
+    bar = tqdm(
+        total=0,
+        unit="B",
+        unit_scale=True,
+        desc=f"Pushing {name}",
+        leave=False,
+        file=progress_file,
+        position=position,
+    )
+    try:
+        for event in client.api.push(repository, tag=tag, stream=True, decode=True):
+            if "error" in event:
+                raise docker.errors.APIError(event["error"])
+
+            layer = event.get("id", "")
+            status = event.get("status", "")
+            detail = event.get("progressDetail") or {}
+
+            if status == "Pushing" and detail.get("total"):
+                layers[layer] = (detail.get("current", 0), detail["total"])
+            elif status == "Pushed" and layer in layers:
+                layers[layer] = (layers[layer][1], layers[layer][1])
+            elif status == "Layer already exists" or status.startswith("Mounted from"):
+                skipped += 1
+                _LOGGER.debug(f"layer {layer}: {status}")
+
+            if "Digest" in event.get("aux", {}):
+                digest = event["aux"]["Digest"]
+
+            bar.total = sum(total for _, total in layers.values())
+            bar.n = sum(current for current, _ in layers.values())
+            bar.refresh()
+    finally:
+        bar.close()
+
+    uploaded = sum(current for current, _ in layers.values())
+    elapsed = max(monotonic() - start, 1e-6)
+    _LOGGER.info(
+        f"pushed `{name}`: {len(layers)} layer(s) uploaded, {skipped} already in the registry, "
+        f"{uploaded} bytes at {uploaded / elapsed / 1024 / 1024:.1f} MB/s"
+    )
+    return digest, uploaded
+
+
+def push_with_retry(
+    client: docker.DockerClient,
+    name: str,
+    retries: int = 3,
+    backoff: float = 2,
+    progress_file: Optional[Any] = None,
+) -> Tuple[str, int]:
+    """Push a tag and try again with an exponential backoff if it fails.
+
+    Raises:
+        docker.errors.APIError: if the push failed every time
+    """
+
+    attempt = 0
+    while True:
+        try:
+            return push_tag(client, name, progress_file=progress_file)
+        except (docker.errors.APIError, RequestException) as e:
+            message = str(e).lower()
+            if attempt >= retries or any(err in message for err in _FATAL_ERRORS):
+                raise
+
+            delay = backoff * 2**attempt
+            attempt += 1
+            _LOGGER.warning(
+                f"Failed to push `{name}` ({e}), trying again in {delay:g} seconds ({attempt}/{retries})"
+            )
+            sleep(delay)
+
+
+def push_tags(
+    client: docker.DockerClient,
+    image: Image,
+    names: List[str],
+    retries: int = 3,
+    progress_file: Optional[Any] = None,
+) -> Dict[str, str]:
+    """Push `image` as each of `names`.
+
+    The registries are pushed to at the same time. In each registry the first tag is
+    pushed on its own, then the other tags are pushed at the same time.
+
+    Returns:
+        Dict[str, str]: the manifest digest of each tag
+
+    Raises:
+        docker.errors.APIError: if any of the tags could not be pushed
+    """
+
+    registries: Dict[str, List[str]] = {}
+    for name in names:
+        repository, tag = split_image(name)
+        if name not in image.tags:
+            image.tag(repository, tag)
+        registries.setdefault(registry_of(name), []).append(name)
+
+    digests: Dict[str, str] = {}
+    errors: Dict[str, Exception] = {}
+
+    def push(name: str) -> None:
+        try:
+            digests[name], _ = push_with_retry(
+                client, name, retries=retries, progress_file=progress_file
+            )
+        except (docker.errors.APIError, RequestException) as e:
+            errors[name] = e
+
+    def push_registry(tags: List[str]) -> None:
+        push(tags[0])
+        if tags[0] in errors:
+            # the other tags would fail the same way
+            for name in tags[1:]:
+                errors[name] = errors[tags[0]]
+            return
+        with ThreadPoolExecutor(
+            max_workers=max(1, len(tags) - 1),
+            thread_name_prefix=f"{threading.current_thread().name}-tag",
+        ) as pool:
+            list(pool.map(push, tags[1:]))
+
+    # the threads are named after the one pushing so the log is kept with its build
+    with ThreadPoolExecutor(
+        max_workers=len(registries),
+        thread_name_prefix=f"{threading.current_thread().name}-push",
+    ) as pool:
+        list(pool.map(push_registry, registries.values()))
+
+    for name, e in errors.items():
+        _LOGGER.error(f"Failed to push `{name}`: {e}")
+    if errors:
+        raise docker.errors.APIError(
+            f"failed to push {len(errors)} of {len(names)} tag(s), are you sure you have properly authenticated with the registry"
+        )
+
+    for name in names:
+        _LOGGER.info(f"pushed `{name}` as {digests[name] or 'an unknown digest'}")
+    return digests
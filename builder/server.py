@@ -0,0 +1,562 @@
+"""A long running build server with an HTTP API.
+
+Builds are submitted as JSON objects that use the same option names as the batch
+manifest. Every job is stored as a JSON file in the state directory, so queued jobs
+survive a restart of the server, and the log of each job is written next to it.
+
+    POST   /jobs                       submit a build, returns the new job
+    GET    /jobs                       list all of the jobs
+    GET    /jobs/<id>                  the status and progress of a job
+    GET    /jobs/<id>/log[?follow=1]   the log of a job, optionally streamed until it ends
+    GET    /jobs/<id>/progress         stream the progress of a job as JSON lines
+    DELETE /jobs/<id>                  cancel a queued or running job
+
+Every request needs the token of the server as an `Authorization: Bearer <token>`
+header, and jobs are submitted as `application/json`. A job can only set the options
+in `JOB_OPTIONS`, anything that reads from or writes to the host, like directories,
+key files, or the trace file, can only be set on the command line of the server.
+
+The options in `SECRET_OPTIONS` are never sent back by the API. They are kept in the
+job files so that queued jobs can still be built after a restart, which is why the
+state directory and everything in it is only readable by the user of the server.
+"""
+
+import hmac
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from typing import Any, Callable, Dict, IO, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+_LOGGER = logging.getLogger(__name__)
+
+QUEUED: str = "queued"
+RUNNING: str = "running"
+SUCCEEDED: str = "succeeded"
+FAILED: str = "failed"
+CANCELLED: str = "cancelled"
+
+FINISHED: List[str] = [SUCCEEDED, FAILED, CANCELLED]
+
+# how often a streamed log or progress is checked for changes, in seconds
+POLL_INTERVAL: float = 0.5
+
+# the options that `ask_interactive` asks for, without the ones that are host paths
+JOB_OPTIONS: List[str] = [
+    "name",
+    "tag",
+    "base",
+    "no_pull",
+    "push",
+    "multi_arch",
+    "no_verify_host",
+    "keep_git",
+    "clone_mode",
+    "wiki_title",
+    "wiki_git_repo",
+    "wiki_git_branch",
+    "wiki_git_user",
+    "wiki_git_password",
+    "wiki_git_no_verify",
+    "wiki_comments",
+    "wiki_navigation",
+    "jupyter_repo",
+    "lectures_repo",
+    "example",
+    "sparse",
+    "static_url",
+]
+
+# the options of a job that are replaced with `REDACTED` in the responses of the API
+SECRET_OPTIONS: List[str] = ["wiki_git_password"]
+
+REDACTED: str = "***"
+
+
+@dataclass
+class Job:
+    id: str
+    spec: Dict[str, Any]
+    status: str = QUEUED
+    message: str = ""
+    created: float = field(default_factory=time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+
+def public_job(job: Job) -> Dict[str, Any]:
+    """The JSON form of a job that the API responds with, without its secrets."""
+
+    data = asdict(job)
+    data["spec"] = {
+        key: REDACTED if key in SECRET_OPTIONS and value else value
+        for key, value in job.spec.items()
+    }
+    return data
+
+
+def _private_open(path: str, flags: int) -> int:
+    """Open a file that only the user of the server can read, like the token."""
+
+    fd = os.open(path, flags | os.O_CREAT, 0o600)
+    if hasattr(os, "fchmod"):
+        # a file from an older version of the server may be readable by anyone
+        os.fchmod(fd, 0o600)
+    return fd
+
+
+class _NullWriter(io.TextIOBase):
+    """Where the progress bars of the jobs are drawn, the server reads them directly."""
+
+    def write(self, s: str) -> int:
+        return len(s)
+
+
+def check_spec(spec: dict) -> None:
+    """Make sure that a submitted job only sets the options a job is allowed to.
+
+    Raises:
+        ValueError: if the spec has any other keys
+    """
+
+    unknown = sorted(set(spec) - set(JOB_OPTIONS))
+    if unknown:
+        raise ValueError(f"these options can not be set by a job: {unknown}")
+
+
+class JobLogHandler(logging.Handler):
+    """Write each log record into the log file of the job that emitted it.
+
+    The worker thread of a job is named after it, and the threads that a build starts
+    use that name as their prefix.
+    """
+
+    def __init__(self, store: "JobStore"):
+        super().__init__()
+        self.store = store
+        self.files: Dict[str, IO[str]] = {}
+        self.files_lock = threading.Lock()
+        self.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s (%(module)s): %(message)s")
+        )
+
+    def open(self, job: Job) -> None:
+        with self.files_lock:
+            self.files[job.id] = os.fdopen(
+                _private_open(self.store.log_path(job.id), os.O_WRONLY | os.O_APPEND),
+                "a",
+            )
+
+    def close_job(self, job: Job) -> None:
+        with self.files_lock:
+            f = self.files.pop(job.id, None)
+        if f:
+            f.close()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        name = record.threadName or ""
+        if not name.startswith("job-"):
+            return
+
+        jobId = name[len("job-") :].split("-", 1)[0]
+        with self.files_lock:
+            f = self.files.get(jobId)
+            if f is None:
+                return
+            try:
+                f.write(self.format(record) + "\n")
+                f.flush()
+            except Exception:
+                self.handleError(record)
+
+
+class JobStore:
+    """Keep every job as a JSON file in `dir`.
+
+    The specs of the jobs can have credentials in them, so `dir` and the files in it
+    are only accessible by the user of the server.
+    """
+
+    def __init__(self, dir: str):
+        self.dir = dir
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+        os.makedirs(dir, mode=0o700, exist_ok=True)
+        os.chmod(dir, 0o700)
+
+    def path(self, id: str) -> str:
+        return os.path.join(self.dir, f"{id}.json")
+
+    def log_path(self, id: str) -> str:
+        return os.path.join(self.dir, f"{id}.log")
+
+    def load(self) -> List[Job]:
+        """Read all of the stored jobs, oldest first."""
+
+        for name in os.listdir(self.dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.dir, name), "r") as f:
+                    job = Job(**json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                _LOGGER.warning(f"Skipping unreadable job file `{name}`: {e}")
+                continue
+            self.jobs[job.id] = job
+        return sorted(self.jobs.values(), key=lambda job: job.created)
+
+    def save(self, job: Job) -> None:
+        with self.lock:
+            self.jobs[job.id] = job
+            tmp = f"{self.path(job.id)}.tmp"
+            fd = _private_open(tmp, os.O_WRONLY | os.O_TRUNC)
+            with os.fdopen(fd, "w") as f:
+                json.dump(asdict(job), f)
+            os.replace(tmp, self.path(job.id))
+
+    def get(self, id: str) -> Optional[Job]:
+        return self.jobs.get(id)
+
+    def all(self) -> List[Job]:
+        return sorted(self.jobs.values(), key=lambda job: job.created)
+
+
+class BuildServer:
+    """Run the submitted jobs with a fixed number of worker threads.
+
+    Args:
+        store (JobStore): where the jobs are kept
+        validate (Callable[[dict, str], dict]): turns a submitted spec and the id of
+            its job into the build options, raises ValueError if it is not valid
+        build (Callable[[dict, Any, IO[str]], Optional[bool]]): builds a job given its
+            options, its cleanup record, and the file to draw its progress bar in
+        new_cleanup (Callable[[], Any]): creates an empty cleanup record for a job
+        interrupt (Callable[[Any], None]): tells the build of a cleanup record to stop,
+            it is called from the thread that cancels a running job
+        release (Callable[[Any], None]): releases all of the resources in a cleanup
+            record, it is called from the thread of a cancelled job once its build
+            has stopped
+        workers (int): the number of jobs to build at the same time
+        token (Optional[str]): the token every request has to be authorized with
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        validate: Callable[[dict, str], dict],
+        build: Callable[[dict, Any, IO[str]], Optional[bool]],
+        new_cleanup: Callable[[], Any],
+        interrupt: Callable[[Any], None],
+        release: Callable[[Any], None],
+        workers: int = 1,
+        token: Optional[str] = None,
+    ):
+        self.store = store
+        self.validate = validate
+        self.build = build
+        self.new_cleanup = new_cleanup
+        self.interrupt = interrupt
+        self.release = release
+        self.workers = max(1, workers)
+        self.token = token
+        self.queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.running: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+        self.logs = JobLogHandler(store)
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start the workers and queue the jobs that had not finished before."""
+
+        logging.getLogger().addHandler(self.logs)
+
+        for job in self.store.load():
+            if job.status in [QUEUED, RUNNING]:
+                # a job that was running when the server stopped is built again
+                job.status = QUEUED
+                self.store.save(job)
+                self.queue.put(job.id)
+
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"worker-{i}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        logging.getLogger().removeHandler(self.logs)
+
+    def submit(self, spec: dict) -> Job:
+        """Add a job to the queue.
+
+        Raises:
+            ValueError: if the spec is not valid
+        """
+
+        id = uuid.uuid4().hex[:12]
+        self.options(spec, id)
+        job = Job(id, spec)
+        self.store.save(job)
+        self.queue.put(job.id)
+        _LOGGER.info(f"queued job `{job.id}`")
+        return job
+
+    def options(self, spec: dict, id: str) -> dict:
+        """The build options of the spec of a job.
+
+        Raises:
+            ValueError: if the spec is not valid
+        """
+
+        check_spec(spec)
+        return self.validate(spec, id)
+
+    def cancel(self, job: Job) -> Job:
+        with self.lock:
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED, "cancelled before it started")
+            elif job.status == RUNNING:
+                _LOGGER.info(f"cancelling job `{job.id}`...")
+                self._finish(job, CANCELLED, "cancelled while it was running")
+                # the build stops at its next check, the worker then releases it
+                cleanup = self.running.get(job.id)
+                if cleanup is not None:
+                    self.interrupt(cleanup)
+        return job
+
+    def progress(self, job: Job) -> dict:
+        progress: Dict[str, Any] = {"id": job.id, "status": job.status}
+        bar = getattr(self.running.get(job.id), "progress_bar", None)
+        if bar is not None:
+            progress.update(step=bar.n, total=bar.total, description=bar.desc)
+        return progress
+
+    def _finish(self, job: Job, status: str, message: str = "") -> None:
+        job.status = status
+        job.message = message
+        job.finished = time()
+        self.store.save(job)
+
+    def _release(self, job: Job, cleanup: Any) -> None:
+        try:
+            self.release(cleanup)
+        except Exception as e:
+            _LOGGER.warning(f"Failed to clean up after job `{job.id}`: {e}")
+
+    def _work(self) -> None:
+        worker = threading.current_thread().name
+        while True:
+            id = self.queue.get()
+            if id is None:
+                return
+
+            job = self.store.get(id)
+            with self.lock:
+                if job is None or job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                job.started = time()
+                self.store.save(job)
+                cleanup = self.new_cleanup()
+                self.running[job.id] = cleanup
+
+            threading.current_thread().name = f"job-{job.id}"
+            self.logs.open(job)
+            progressFile = _NullWriter()
+            try:
+                _LOGGER.info(f"starting job `{job.id}`")
+                succeeded = self.build(
+                    self.options(job.spec, job.id), cleanup, progressFile
+                )
+                status, message = (
+                    (SUCCEEDED, "")
+                    if succeeded is not False
+                    else (FAILED, "build failed")
+                )
+            except SystemExit as e:
+                status, message = FAILED, str(e.code)
+            except Exception as e:
+                if job.status != CANCELLED:
+                    _LOGGER.error(f"Job `{job.id}` failed: {e}")
+                status, message = FAILED, str(e)
+            finally:
+                progressFile.close()
+                if job.status == CANCELLED:
+                    self._release(job, cleanup)
+                threading.current_thread().name = worker
+
+            with self.lock:
+                self.running.pop(job.id, None)
+                if job.status == RUNNING:
+                    self._finish(job, status, message)
+            _LOGGER.info(f"job `{job.id}` {job.status}")
+            self.logs.close_job(job)
+
+    def serve(self, host: str, port: int) -> None:
+        httpd = ThreadingHTTPServer((host, port), make_handler(self))
+        httpd.daemon_threads = True
+        _LOGGER.warning(f"Listening for builds on http://{host}:{port}")
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+
+
+def make_handler(server: BuildServer) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args) -> None:
+            _LOGGER.debug(f"{self.address_string()} {format % args}")
+
+        def send_json(
+            self, status: int, body: Any, headers: Optional[Dict[str, str]] = None
+        ) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def authorized(self) -> bool:
+            """Check the token of the request, a 401 is sent if it is not valid."""
+
+            if server.token is None:
+                return True
+            scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+            if scheme.lower() == "bearer" and hmac.compare_digest(
+                token.strip().encode("utf-8"), server.token.encode("utf-8")
+            ):
+                return True
+
+            self.send_json(
+                401, {"error": "not authorized"}, {"WWW-Authenticate": "Bearer"}
+            )
+            return False
+
+        def find_job(self, parts: List[str]) -> Optional[Job]:
+            job = server.store.get(parts[1]) if len(parts) > 1 else None
+            if job is None:
+                self.send_json(404, {"error": "no such job"})
+            return job
+
+        def do_GET(self) -> None:
+            if not self.authorized():
+                return
+            url = urlsplit(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            query = parse_qs(url.query)
+
+            if parts == ["jobs"]:
+                self.send_json(200, [public_job(job) for job in server.store.all()])
+                return
+            if not parts or parts[0] != "jobs" or len(parts) > 3:
+                self.send_json(404, {"error": "not found"})
+                return
+
+            job = self.find_job(parts)
+            if job is None:
+                return
+            if len(parts) == 2:
+                self.send_json(
+                    200, dict(public_job(job), progress=server.progress(job))
+                )
+            elif parts[2] == "log":
+                follow = query.get("follow", ["0"])[0] not in ["0", "false", ""]
+                self.stream_log(job, follow)
+            elif parts[2] == "progress":
+                self.stream_progress(job)
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            if not self.authorized():
+                return
+            if urlsplit(self.path).path.rstrip("/") != "/jobs":
+                self.send_json(404, {"error": "not found"})
+                return
+            if self.headers.get_content_type() != "application/json":
+                self.send_json(
+                    415, {"error": "the build spec must be application/json"}
+                )
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                spec = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(spec, dict):
+                    raise ValueError("the build spec must be a JSON object")
+                job = server.submit(spec)
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            self.send_json(201, public_job(job))
+
+        def do_DELETE(self) -> None:
+            if not self.authorized():
+                return
+            parts = [p for p in urlsplit(self.path).path.split("/") if p]
+            if len(parts) != 2 or parts[0] != "jobs":
+                self.send_json(404, {"error": "not found"})
+                return
+
+            job = self.find_job(parts)
+            if job is not None:
+                self.send_json(200, public_job(server.cancel(job)))
+
+        def stream_log(self, job: Job, follow: bool) -> None:
+            # the length is not known while following, so the connection is closed
+            # to mark the end of the log
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.end_headers()
+
+            path = server.store.log_path(job.id)
+            position = 0
+            while True:
+                finished = job.status in FINISHED
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        f.seek(position)
+                        data = f.read()
+                    if data:
+                        position += len(data)
+                        self.wfile.write(data)
+                        self.wfile.flush()
+
+                if not follow or finished:
+                    return
+                sleep(POLL_INTERVAL)
+
+        def stream_progress(self, job: Job) -> None:
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+
+            last = None
+            while True:
+                progress = server.progress(job)
+                if progress != last:
+                    self.wfile.write(json.dumps(progress).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                    last = progress
+                if job.status in FINISHED:
+                    return
+                sleep(POLL_INTERVAL)
+
+    return Handler
@@ -0,0 +1,421 @@
+"""Run the stages of a build as a dependency graph.
+
+Every stage declares the values it needs and the values it produces. A stage starts
+as soon as all of its inputs have been produced, so stages that do not depend on each
+other run at the same time, up to a limit. The time of each stage is kept so the
+critical path, the chain of stages that decided how long the build took, can be
+reported once the graph is done.
+
+Stages with a fingerprint are checkpointed: their outputs are saved with a key of the
+fingerprint and their inputs, so a later run can use them again instead of running
+the stage, as long as nothing that goes into the stage changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StopGraph(Exception):
+    """Raised by a stage to end the graph early without an error.
+
+    The stages that have not started are skipped and the ones that are running are
+    waited for, then the exception is raised from `StageGraph.run` with its `result`.
+    A running stage that fails once the graph was stopped, for example because
+    `on_stop` interrupted it, does not turn the stop into an error.
+    """
+
+    def __init__(self, result: Any = None):
+        super().__init__("the stage graph was stopped")
+        self.result = result
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[..., Any]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    # called with the inputs of the stage, the stage is only checkpointed when it
+    # returns something other than None
+    fingerprint: Optional[Callable[..., Any]] = None
+    # called with the inputs of the stage and the outputs of its checkpoint, to check
+    # that the outputs are still there to be used
+    exists: Optional[Callable[..., bool]] = None
+    # the `perf_counter` time the stage started, and how long it took once it is done
+    start: Optional[float] = None
+    duration: Optional[float] = None
+    restored: bool = False
+
+    @property
+    def end(self) -> float:
+        return (self.start or 0) + (self.duration or 0)
+
+
+class Checkpoints:
+    """The outputs of the finished stages of a build, kept in a json file."""
+
+    def __init__(self, path: str, resume: bool = True):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+        if resume and os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                _LOGGER.warning(f"Failed to read the checkpoints in `{path}`: {e}")
+
+    def get(self, name: str, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is None or entry.get("key") != key:
+            return None
+        return entry["outputs"]
+
+    def save(self, name: str, key: str, outputs: Dict[str, Any]) -> None:
+        with self.lock:
+            self.entries[name] = {"key": key, "outputs": outputs}
+            self._write()
+
+    def discard(self, name: str) -> None:
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self._write()
+
+    def _write(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def hash_value(value: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class StageGraph:
+    """A set of stages that are run in the order their inputs are produced in.
+
+    The function of a stage is called with its inputs as keyword arguments. A stage
+    with a single output returns its value, a stage with several outputs returns a
+    tuple with them in the order they were declared in.
+    """
+
+    def __init__(self, checkpoints: Optional[Checkpoints] = None):
+        self.stages: Dict[str, Stage] = {}
+        self.values: Dict[str, Any] = {}
+        self.checkpoints = checkpoints
+        # the checkpoint key of each stage that has one
+        self.keys: Dict[str, str] = {}
+        # set once a stage failed or stopped the graph, for stages that can stop early
+        self.stopping = threading.Event()
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        inputs: Iterable[str] = (),
+        outputs: Iterable[str] = (),
+        fingerprint: Optional[Callable[..., Any]] = None,
+        exists: Optional[Callable[..., bool]] = None,
+    ) -> None:
+        if name in self.stages:
+            raise ValueError(f"there already is a stage called `{name}`")
+        self.stages[name] = Stage(
+            name, fn, list(inputs), list(outputs), fingerprint, exists
+        )
+
+    def producers(self) -> Dict[str, str]:
+        """The stage that produces each value.
+
+        Raises:
+            ValueError: if a value is produced by several stages
+        """
+
+        producers: Dict[str, str] = {}
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(
+                        f"`{output}` is produced by both `{producers[output]}` and `{stage.name}`"
+                    )
+                producers[output] = stage.name
+        return producers
+
+    def dependencies(self) -> Dict[str, Set[str]]:
+        """The stages that each stage needs the outputs of.
+
+        Raises:
+            ValueError: if a value is produced by several stages or by none of them
+        """
+
+        producers = self.producers()
+        dependencies: Dict[str, Set[str]] = {}
+        for stage in self.stages.values():
+            dependencies[stage.name] = set()
+            for input in stage.inputs:
+                if input in producers:
+                    dependencies[stage.name].add(producers[input])
+                elif input not in self.values:
+                    raise ValueError(
+                        f"the `{stage.name}` stage needs `{input}`, but no stage produces it"
+                    )
+        return dependencies
+
+    def order(self) -> List[str]:
+        """The stages in an order that they could be run one after the other in.
+
+        Raises:
+            ValueError: if the stages depend on each other in a cycle
+        """
+
+        dependencies = self.dependencies()
+        order: List[str] = []
+        done: Set[str] = set()
+        while len(order) < len(self.stages):
+            ready = [
+                name
+                for name in self.stages
+                if name not in done and dependencies[name] <= done
+            ]
+            if not ready:
+                cycle = sorted(set(self.stages) - done)
+                raise ValueError(f"the stages {cycle} depend on each other")
+            order += ready
+            done.update(ready)
+        return order
+
+    def _key(self, stage: Stage) -> Optional[str]:
+        """The checkpoint key of a stage from its fingerprint and its inputs.
+
+        The inputs that come from checkpointed stages are represented by their keys,
+        the fingerprint has to cover everything else that goes into the stage.
+        """
+
+        if self.checkpoints is None or stage.fingerprint is None:
+            return None
+        fingerprint = stage.fingerprint(
+            **{input: self.values[input] for input in stage.inputs}
+        )
+        if fingerprint is None:
+            return None
+
+        producers = self.producers()
+        inputs = {
+            input: self.keys[producers[input]]
+            for input in stage.inputs
+            if producers.get(input) in self.keys
+        }
+        return hash_value(
+            {"stage": stage.name, "fingerprint": fingerprint, "inputs": inputs}
+        )
+
+    def _restore(self, stage: Stage, dependencies: Set[str]) -> bool:
+        """Use the checkpoint of a stage instead of running it, if it is still valid.
+
+        A stage is only restored when all of the checkpointed stages it depends on
+        were restored as well, the outputs of a stage that ran again may differ.
+        """
+
+        key = self._key(stage)
+        if key is None:
+            return False
+        self.keys[stage.name] = key
+
+        ran = [
+            name
+            for name in dependencies
+            if self.stages[name].fingerprint is not None
+            and not self.stages[name].restored
+        ]
+        outputs = None if ran else self.checkpoints.get(stage.name, key)
+        inputs = {input: self.values[input] for input in stage.inputs}
+        if outputs is not None and (
+            stage.exists is None or stage.exists(**inputs, **outputs)
+        ):
+            _LOGGER.info(f"using the checkpoint of the `{stage.name}` stage")
+            self.values.update(outputs)
+            stage.restored = True
+            return True
+
+        self.checkpoints.discard(stage.name)
+        return False
+
+    def _run_stage(self, stage: Stage) -> Dict[str, Any]:
+        args = {input: self.values[input] for input in stage.inputs}
+        _LOGGER.debug(f"starting the `{stage.name}` stage")
+        stage.start = perf_counter()
+        try:
+            result = stage.fn(**args)
+        finally:
+            stage.duration = perf_counter() - stage.start
+
+        if len(stage.outputs) == 0:
+            return {}
+        if len(stage.outputs) == 1:
+            return {stage.outputs[0]: result}
+        return dict(zip(stage.outputs, result))
+
+    def run(
+        self,
+        max_parallel: int = 4,
+        values: Optional[Dict[str, Any]] = None,
+        check: Optional[Callable[[], None]] = None,
+        on_stop: Optional[Callable[[], None]] = None,
+    ) -> Dict[str, Any]:
+        """Run all of the stages, at most `max_parallel` of them at the same time.
+
+        Args:
+            max_parallel (int): the number of stages that can run at the same time
+            values (Optional[Dict[str, Any]]): inputs that are not produced by a stage
+            check (Optional[Callable]): called before each stage is started, it can
+                raise to stop the graph, like when the build was cancelled
+            on_stop (Optional[Callable]): called once when a stage failed or stopped
+                the graph, to make the stages that are still running end sooner
+
+        Returns:
+            Dict[str, Any]: all of the values that were produced
+
+        Raises:
+            StopGraph: if one of the stages stopped the graph
+            ValueError: if the stages do not form a graph that can be run
+        """
+
+        self.values.update(values or {})
+        self.order()
+        dependencies = self.dependencies()
+        maxParallel = max(1, max_parallel)
+
+        def stop() -> None:
+            if self.stopping.is_set():
+                return
+            self.stopping.set()
+            if on_stop is not None:
+                try:
+                    on_stop()
+                except Exception as e:
+                    _LOGGER.debug(f"failed to stop the running stages: {e!r}")
+
+        pending = list(self.stages)
+        running: Dict[Future, str] = {}
+        done: Set[str] = set()
+        error: Optional[BaseException] = None
+        stopped: Optional[StopGraph] = None
+
+        with ThreadPoolExecutor(
+            max_workers=maxParallel,
+            thread_name_prefix=f"{threading.current_thread().name}-graph",
+        ) as pool:
+            while pending or running:
+                # restoring a stage can make the stages after it ready right away
+                scheduled = True
+                while scheduled and not self.stopping.is_set():
+                    scheduled = False
+                    for name in [n for n in pending if dependencies[n] <= done]:
+                        if len(running) >= maxParallel:
+                            break
+                        try:
+                            if check is not None:
+                                check()
+                            restored = self._restore(
+                                self.stages[name], dependencies[name]
+                            )
+                        except BaseException as e:
+                            error = e
+                            stop()
+                            break
+                        pending.remove(name)
+                        scheduled = True
+                        if restored:
+                            done.add(name)
+                        else:
+                            future = pool.submit(self._run_stage, self.stages[name])
+                            running[future] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        outputs = future.result()
+                        self.values.update(outputs)
+                        done.add(name)
+                        if name in self.keys:
+                            self.checkpoints.save(name, self.keys[name], outputs)
+                    except StopGraph as e:
+                        _LOGGER.debug(f"the `{name}` stage stopped the build")
+                        stopped = stopped or e
+                        stop()
+                    except BaseException as e:
+                        _LOGGER.debug(f"the `{name}` stage failed: {e!r}")
+                        if stopped is None:
+                            error = error or e
+                        stop()
+
+        if error is not None:
+            raise error
+        if stopped is not None:
+            raise stopped
+        return self.values
+
+    def critical_path(self) -> List[Stage]:
+        """The chain of stages that the end of the last stage waited on.
+
+        Each stage in the chain is the input of the next one that finished last, so
+        making any other stage faster would not have made the graph finish sooner.
+        """
+
+        dependencies = self.dependencies()
+        finished = [s for s in self.stages.values() if s.duration is not None]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda s: s.end)]
+        while True:
+            before = [
+                self.stages[name]
+                for name in dependencies[path[-1].name]
+                if self.stages[name].duration is not None
+            ]
+            if not before:
+                break
+            path.append(max(before, key=lambda s: s.end))
+        return list(reversed(path))
+
+    def report(self) -> str:
+        """A line with the critical path, then how long each stage took."""
+
+        finished = [s for s in self.stages.values() if s.duration is not None]
+        if not finished:
+            return "no stages were run"
+
+        path = self.critical_path()
+        start = min(s.start for s in finished)
+        total = max(s.end for s in finished) - start
+        lines = [
+            f"critical path ({sum(s.duration for s in path):.1f}s of {total:.1f}s): "
+            + " -> ".join(f"{s.name} {s.duration:.1f}s" for s in path)
+        ]
+        critical = [s.name for s in path]
+        for stage in sorted(finished, key=lambda s: s.start):
+            marker = "*" if stage.name in critical else " "
+            lines.append(
+                f"{marker} {stage.start - start:7.1f}s +{stage.duration:6.1f}s {stage.name}"
+            )
+        for stage in self.stages.values():
+            if stage.restored:
+                lines.append(f"  {'checkpoint':>17} {stage.name}")
+        return "\n".join(lines)
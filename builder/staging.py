@@ -0,0 +1,152 @@
+"""Stage local directories into the build directory without copying every byte.
+
+Each file is cloned with a reflink when the filesystem supports it (btrfs, xfs, ...),
+otherwise it is hard linked, and only copied when neither of those are possible.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import sys
+from dataclasses import dataclass
+from typing import List
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+
+_LOGGER = logging.getLogger(__name__)
+
+STAGE_MODES: List[str] = ["auto", "reflink", "hardlink", "copy"]
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE: int = 0x40049409
+
+# the errors that mean a link type is not supported between the two paths
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.EPERM,
+    errno.EMLINK,
+    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+}
+
+
+@dataclass
+class StageStats:
+    files: int = 0
+    copied_bytes: int = 0
+    hardlinked_bytes: int = 0
+    reflinked_bytes: int = 0
+
+    @property
+    def linked_bytes(self) -> int:
+        return self.hardlinked_bytes + self.reflinked_bytes
+
+    def __add__(self, other: "StageStats") -> "StageStats":
+        return StageStats(
+            self.files + other.files,
+            self.copied_bytes + other.copied_bytes,
+            self.hardlinked_bytes + other.hardlinked_bytes,
+            self.reflinked_bytes + other.reflinked_bytes,
+        )
+
+
+def reflink(source: str, target: str) -> None:
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(target)
+            raise
+    shutil.copystat(source, target)
+
+
+class Stager:
+    """Stage files with the cheapest method that works.
+
+    In `auto` mode a method that fails because it is not supported between the two
+    filesystems is not tried again for the rest of the files. When a mode is forced
+    any failure is raised instead of falling back to a copy.
+    """
+
+    def __init__(self, mode: str = "auto"):
+        if mode not in STAGE_MODES:
+            raise ValueError(
+                f"'{mode}' is not a valid stage mode, must be one of {STAGE_MODES}"
+            )
+
+        self.mode = mode
+        self.methods = ["reflink", "hardlink", "copy"] if mode == "auto" else [mode]
+        self.stats = StageStats()
+
+    def stage_file(self, source: str, target: str) -> None:
+        size = os.stat(source).st_size
+
+        for method in list(self.methods):
+            try:
+                if method == "reflink":
+                    reflink(source, target)
+                    self.stats.reflinked_bytes += size
+                elif method == "hardlink":
+                    os.link(source, target)
+                    self.stats.hardlinked_bytes += size
+                else:
+                    shutil.copy2(source, target)
+                    self.stats.copied_bytes += size
+                self.stats.files += 1
+                return
+            except OSError as e:
+                if (
+                    self.mode != "auto"
+                    or method == "copy"
+                    or e.errno not in _UNSUPPORTED
+                ):
+                    raise
+                _LOGGER.debug(f"can not {method} `{source}`, falling back: {e}")
+                self.methods.remove(method)
+
+    def stage_tree(self, source: str, target: str) -> StageStats:
+        """Stage every file in `source` into `target`, merging with any existing files.
+
+        Symbolic links are followed like `shutil.copytree` does by default.
+
+        Returns:
+            StageStats: the stats for this tree only
+        """
+
+        before = self.stats
+        self.stats = StageStats()
+
+        created = []
+        for root, dirs, files in os.walk(source, followlinks=True):
+            rel = os.path.relpath(root, source)
+            dest = os.path.normpath(os.path.join(target, rel))
+            os.makedirs(dest, exist_ok=True)
+            created.append((root, dest))
+
+            for name in files:
+                path = os.path.join(dest, name)
+                if os.path.lexists(path):
+                    os.unlink(path)
+                self.stage_file(os.path.join(root, name), path)
+
+        # the permissions are copied last in case a directory is read only
+        for root, dest in reversed(created):
+            shutil.copystat(root, dest)
+
+        stats = self.stats
+        self.stats = before + stats
+        return stats
+
+
+def stage_tree(source: str, target: str, mode: str = "auto") -> StageStats:
+    return Stager(mode).stage_tree(source, target)
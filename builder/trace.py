@@ -0,0 +1,164 @@
+"""Record how long each stage of a build takes.
+
+Spans are recorded with the thread they ran in so that nested spans, such as the API
+calls made while the wiki is being configured, show up under their stage. The spans
+can be written as a Chrome trace (open it in `chrome://tracing` or Perfetto), and the
+totals as a Prometheus textfile for the node exporter textfile collector.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import perf_counter, time
+from typing import Any, Dict, Iterator, List
+
+_LOGGER = logging.getLogger(__name__)
+
+METRIC_PREFIX: str = "scioer_builder"
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: float
+    thread: str
+    args: Dict[str, Any] = field(default_factory=dict)
+
+
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans: List[Span] = []
+        self.counters: Dict[str, float] = {}
+        self.origin = perf_counter()
+        self.started = time()
+
+    @contextmanager
+    def span(self, name: str, **args) -> Iterator[None]:
+        """Time the body of the `with` block as a span called `name`."""
+
+        start = perf_counter()
+        try:
+            yield
+        except BaseException:
+            args["error"] = True
+            raise
+        finally:
+            span = Span(
+                name,
+                start - self.origin,
+                perf_counter() - start,
+                threading.current_thread().name,
+                args,
+            )
+            with self.lock:
+                self.spans.append(span)
+
+    def record(
+        self, name: str, start: float, duration: float, thread: str, **args
+    ) -> None:
+        """Add a span that was timed elsewhere, `start` is a `perf_counter` time."""
+
+        span = Span(name, start - self.origin, duration, thread, args)
+        with self.lock:
+            self.spans.append(span)
+
+    def count(self, name: str, value: float) -> None:
+        """Add `value` to the counter called `name`, used for byte counts."""
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def durations(self) -> Dict[str, float]:
+        """The total time spent in each span name, in seconds."""
+
+        totals: Dict[str, float] = {}
+        with self.lock:
+            for span in self.spans:
+                totals[span.name] = totals.get(span.name, 0) + span.duration
+        return totals
+
+    def write_chrome_trace(self, path: str) -> None:
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+
+        threads: Dict[str, int] = {}
+        events: List[dict] = []
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads))
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "build",
+                    "ph": "X",
+                    "ts": round(span.start * 1e6),
+                    "dur": round(span.duration * 1e6),
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": span.args,
+                }
+            )
+
+        for name, tid in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+
+        _write_atomic(
+            path,
+            json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str),
+        )
+        _LOGGER.info(f"wrote the build trace to `{path}`")
+
+    def write_metrics(self, path: str, labels: Dict[str, str]) -> None:
+        """Write the stage durations and counters in the Prometheus text format."""
+
+        base = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+        sep = "," if base else ""
+
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_duration_seconds The total time spent in each stage of the build.",
+            f"# TYPE {METRIC_PREFIX}_stage_duration_seconds gauge",
+        ]
+        for name, seconds in sorted(self.durations().items()):
+            lines.append(
+                f'{METRIC_PREFIX}_stage_duration_seconds{{{base}{sep}stage="{_escape(name)}"}} {seconds:.6f}'
+            )
+
+        with self.lock:
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            metric = f"{METRIC_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{{{base}}} {value:g}")
+
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_build_timestamp_seconds gauge")
+        lines.append(
+            f"{METRIC_PREFIX}_last_build_timestamp_seconds{{{base}}} {self.started:.0f}"
+        )
+
+        _write_atomic(path, "\n".join(lines) + "\n")
+        _LOGGER.info(f"wrote the build metrics to `{path}`")
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: str, content: str) -> None:
+    # the textfile collector may read the file at any time, so it is replaced at once
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
@@ -0,0 +1,724 @@
+"""Compile a Wiki.js database from a wiki git repository without running Wiki.js.
+
+The files of the repository are imported the way the git storage module of Wiki.js
+imports them: `.md` and `.html` files become pages, with the metadata taken from
+their front matter, and every other file becomes an asset. The pages are rendered,
+their tags, links, and the page tree are written, and the site settings are changed,
+all in a copy of the empty database from the base image.
+
+The pages are rendered with `markdown-it-py` using the options Wiki.js uses, and the
+header anchors, table of contents, and link classes Wiki.js adds. Content that needs
+one of the Wiki.js rendering plugins, such as diagrams or math, is left as it is in
+the markdown. Use "Rerender All Pages" in the Wiki.js admin utilities to render it.
+
+The database can also be optimized once it is written, either here or by Wiki.js, so
+the image gets the smallest database with up to date query planner statistics.
+"""
+
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from markdown_it import MarkdownIt  # noqa: I900
+    from markdown_it.token import Token  # noqa: I900
+except ImportError:
+    MarkdownIt = None
+
+try:
+    import linkify_it  # noqa: F401, I900
+except ImportError:
+    linkify_it = None
+
+_LOGGER = logging.getLogger(__name__)
+
+# the administrator that was created when the wiki was set up, it owns the content
+ROOT_USER_ID: int = 1
+
+# the file extension of each page content type
+PAGE_EXTENSIONS: Dict[str, str] = {"md": "markdown", "html": "html"}
+
+# the page sizes that sqlite supports
+PAGE_SIZES: List[int] = [2**n for n in range(9, 17)]
+
+# the editor used for each content type when the page does not say
+DEFAULT_EDITORS: Dict[str, str] = {"markdown": "markdown", "html": "ckeditor"}
+
+_FRONT_MATTER = {
+    "markdown": re.compile(
+        r"^(-{3}(?:\n|\r)([\w\W]+?)(?:\n|\r)-{3})?(?:\n|\r)*([\w\W]*)"
+    ),
+    "html": re.compile(
+        r"^(<!-{2}(?:\n|\r)([\w\W]+?)(?:\n|\r)-{2}>)?(?:\n|\r)*([\w\W]*)"
+    ),
+}
+
+# links to these prefixes are wiki functions like `/a/` for the admin area
+_RESERVED_PREFIX = re.compile(r"^/[a-z]/", re.IGNORECASE)
+# a link can start with the locale of the page it points to, like `/en/home`
+_LOCALE_SEGMENT = re.compile(r"^[a-z]{2}(-[a-z]{2})?$", re.IGNORECASE)
+
+
+class CompileError(Exception):
+    pass
+
+
+@dataclass
+class WikiPage:
+    path: str
+    locale: str
+    content_type: str
+    content: str
+    title: str
+    description: str = ""
+    tags: List[str] = field(default_factory=list)
+    editor: str = "markdown"
+    created: str = ""
+    updated: str = ""
+
+
+@dataclass
+class WikiAsset:
+    # the path of the file in the repository
+    source: str
+    folders: List[str]
+    filename: str
+    mime: str
+    size: int
+
+
+@dataclass
+class WikiSettings:
+    title: Optional[str] = None
+    navigation: str = "TREE"
+    comments: bool = False
+    # the config of the git storage target, when it should be kept
+    storage: Optional[Dict[str, Any]] = None
+
+
+def timestamp(when: float) -> str:
+    """Format a unix time like the dates Wiki.js stores."""
+
+    date = datetime.fromtimestamp(when, tz=timezone.utc)
+    return date.strftime("%Y-%m-%dT%H:%M:%S.") + f"{date.microsecond // 1000:03d}Z"
+
+
+def page_hash(path: str, locale: str, private_ns: str = "") -> str:
+    return hashlib.sha1(f"{locale}|{path}|{private_ns}".encode("utf-8")).hexdigest()
+
+
+def parse_front_matter(text: str) -> Dict[str, str]:
+    """Read the `key: value` lines of a Wiki.js page header."""
+
+    meta: Dict[str, str] = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(":")
+        if not sep or not key.strip() or key[0].isspace():
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+        meta[key.strip()] = value
+    return meta
+
+
+def parse_page(rel: str, raw: str, locale: str, default_date: str) -> WikiPage:
+    ext = rel.rsplit(".", 1)[-1]
+    contentType = PAGE_EXTENSIONS[ext]
+    # the same as Wiki.js, that drops every dot in the path with the extension
+    path = "".join(rel.split(".")[:-1])
+
+    match = _FRONT_MATTER[contentType].match(raw)
+    meta = parse_front_matter(match.group(2)) if match and match.group(2) else {}
+    content = match.group(3) if match and match.group(2) else raw
+
+    tags = [t.strip().lower() for t in meta.get("tags", "").split(",")]
+    return WikiPage(
+        path=path,
+        locale=locale,
+        content_type=contentType,
+        content=content,
+        title=meta.get("title") or path.split("/")[-1],
+        description=meta.get("description", ""),
+        tags=list(dict.fromkeys(t for t in tags if t)),
+        editor=meta.get("editor") or DEFAULT_EDITORS[contentType],
+        created=meta.get("dateCreated") or meta.get("date") or default_date,
+        updated=meta.get("date") or default_date,
+    )
+
+
+def sanitize_name(name: str) -> str:
+    name = re.sub(r'[/\\?<>:*|"\x00-\x1f]', "", name)
+    return re.sub(r"[\s,;#]+", "_", name).lower()
+
+
+def load_repository(
+    dir: str, locale: str, default_date: str
+) -> Tuple[List[WikiPage], List[WikiAsset]]:
+    """Read all of the pages and assets of a checked out wiki repository."""
+
+    pages: List[WikiPage] = []
+    assets: List[WikiAsset] = []
+    for root, dirs, names in os.walk(dir):
+        dirs.sort()
+        for name in sorted(names):
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, dir).replace(os.sep, "/")
+            # Wiki.js skips everything with `.git` in its path and all empty files
+            if ".git" in rel or len(rel) <= 3 or os.path.islink(full):
+                continue
+            size = os.path.getsize(full)
+            if size < 1:
+                continue
+
+            ext = rel.rsplit(".", 1)[-1] if "." in name else ""
+            if ext in PAGE_EXTENSIONS:
+                with open(full, "r", encoding="utf-8", errors="replace") as f:
+                    page = parse_page(rel, f.read(), locale, default_date)
+                if not page.content.strip():
+                    _LOGGER.warning(f"skipping the page `{rel}`, it has no content")
+                    continue
+                pages.append(page)
+            else:
+                base, extension = os.path.splitext(name)
+                assets.append(
+                    WikiAsset(
+                        source=rel,
+                        folders=[p for p in rel.split("/")[:-1]],
+                        filename=sanitize_name(base) + extension.lower(),
+                        mime=mimetypes.guess_type(name)[0]
+                        or "application/octet-stream",
+                        size=size,
+                    )
+                )
+    return pages, assets
+
+
+def slugify(text: str) -> str:
+    slug = re.sub(r"[^\w\s-]", "", text.strip().lower())
+    return re.sub(r"\s+", "-", slug)
+
+
+def missing_packages() -> List[str]:
+    """The packages that are needed to compile the wiki database but not installed."""
+
+    missing = []
+    if MarkdownIt is None:
+        missing.append("markdown-it-py")
+    if linkify_it is None:
+        missing.append("linkify-it-py")
+    return missing
+
+
+class PageRenderer:
+    """Render pages like the markdown-core and html-core renderers of Wiki.js."""
+
+    def __init__(self, paths: Set[Tuple[str, str]]):
+        missing = missing_packages()
+        if missing:
+            raise CompileError(
+                f"compiling the wiki database needs {' and '.join(f'`{m}`' for m in missing)}, install them with `pip install scioer-builder[wiki]`"
+            )
+
+        # the paths of all of the pages, to mark the links to missing pages
+        self.paths = paths
+        self.md = MarkdownIt(
+            "js-default",
+            {"html": True, "breaks": True, "linkify": True},
+        )
+
+    def render(self, page: WikiPage) -> Tuple[str, List[dict], List[Tuple[str, str]]]:
+        """Render a page.
+
+        Returns:
+            Tuple[str, List[dict], List[Tuple[str, str]]]: the html, the table of
+                contents, and the locale and path of the pages that the page links to
+        """
+
+        if page.content_type != "markdown":
+            return page.content, [], []
+
+        tokens = self.md.parse(page.content)
+        strict = any(t.type == "heading_open" and t.tag == "h1" for t in tokens)
+        headers: List[str] = []
+        toc: List[dict] = []
+        links: List[Tuple[str, str]] = []
+
+        for i, token in enumerate(tokens):
+            if token.type == "heading_open":
+                inline = tokens[i + 1]
+                title = "".join(
+                    c.content
+                    for c in inline.children or []
+                    if c.type in ["text", "code_inline"]
+                )
+                slug = self.unique_slug(slugify(title), headers)
+                token.attrSet("id", slug)
+                token.attrJoin("class", "toc-header")
+                anchor = Token("html_inline", "", 0)
+                anchor.content = f'<a class="toc-anchor" href="#{slug}">&#xB6;</a> '
+                inline.children = [anchor] + list(inline.children or [])
+
+                depth = int(token.tag[1]) - (1 if strict else 2)
+                self.add_toc_entry(
+                    toc, depth, {"title": title.strip(), "anchor": f"#{slug}"}
+                )
+
+            if token.type == "inline":
+                for child in token.children or []:
+                    if child.type == "link_open":
+                        link = self.link(page, child)
+                        if link is not None and link not in links:
+                            links.append(link)
+
+        html = self.md.renderer.render(tokens, self.md.options, {})
+        return html, toc, links
+
+    @staticmethod
+    def unique_slug(slug: str, headers: List[str]) -> str:
+        if re.match(r"^\d", slug):
+            slug = f"h-{slug}"
+        unique = slug
+        index = 1
+        while unique in headers:
+            unique = f"{slug}-{index}"
+            index += 1
+        headers.append(unique)
+        return unique
+
+    @staticmethod
+    def add_toc_entry(toc: List[dict], depth: int, entry: dict) -> None:
+        level = toc
+        for _ in range(max(depth, 0)):
+            if not level:
+                # a header that skips a level is left out, like Wiki.js does
+                return
+            level = level[-1]["children"]
+        level.append({**entry, "children": []})
+
+    def link(self, page: WikiPage, token: Any) -> Optional[Tuple[str, str]]:
+        """Add the Wiki.js classes to a link and get the locale and path of the page
+        it points to."""
+
+        href = token.attrGet("href") or ""
+        if not href or href.startswith(("#", "mailto:", "tel:")):
+            return None
+
+        if "://" in href:
+            token.attrJoin("class", "is-external-link")
+            return None
+
+        href = href[:-1] if href.endswith("/") else href
+        if _RESERVED_PREFIX.match(href):
+            token.attrJoin("class", "is-system-link")
+        elif "." in href:
+            token.attrJoin("class", "is-asset-link")
+        else:
+            if not href.startswith("/"):
+                href = f"/{href}" if page.path == "home" else f"/{page.path}/{href}"
+            locale = page.locale
+            parts = [p for p in href.split("#")[0].split("/") if p.strip()]
+            if len(parts) > 1 and _LOCALE_SEGMENT.match(parts[0]):
+                locale = parts.pop(0)
+            path = "/".join(parts)
+            valid = (locale, path) in self.paths
+            token.attrJoin("class", "is-internal-link")
+            token.attrJoin("class", "is-valid-page" if valid else "is-invalid-page")
+            token.attrSet("href", href)
+            return locale, path
+
+        token.attrSet("href", href)
+        return None
+
+
+def build_tree(
+    pages: List[Tuple[int, str, str, str, bool, Optional[str]]]
+) -> List[dict]:
+    """Build the page tree of Wiki.js from all of the pages.
+
+    Args:
+        pages: the id, path, locale, title, if it is private, and the private
+            namespace of each page, sorted by locale and path
+
+    Returns:
+        List[dict]: the rows of the `pageTree` table
+    """
+
+    tree: List[dict] = []
+    nodes: Dict[Tuple[str, str], dict] = {}
+    for pageId, path, locale, title, private, privateNS in pages:
+        parts = path.split("/")
+        current = ""
+        parent: Optional[int] = None
+        ancestors: List[int] = []
+        for depth, part in enumerate(parts, start=1):
+            folder = depth < len(parts)
+            current = f"{current}/{part}" if current else part
+            node = nodes.get((locale, current))
+            if node is None:
+                node = {
+                    "id": len(tree) + 1,
+                    "localeCode": locale,
+                    "path": current,
+                    "depth": depth,
+                    "title": part if folder else title,
+                    "isFolder": folder,
+                    "isPrivate": not folder and private,
+                    "privateNS": None if folder else privateNS,
+                    "parent": parent,
+                    "pageId": None if folder else pageId,
+                    "ancestors": json.dumps(ancestors),
+                }
+                tree.append(node)
+                nodes[(locale, current)] = node
+            elif folder:
+                node["isFolder"] = True
+            parent = node["id"]
+            ancestors = ancestors + [parent]
+    return tree
+
+
+class WikiDatabase:
+    """Write to a copy of the Wiki.js database of the base image."""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.columns: Dict[str, List[str]] = {}
+
+    def table_columns(self, table: str) -> List[str]:
+        if table not in self.columns:
+            rows = self.conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+            self.columns[table] = [row[1] for row in rows]
+        return self.columns[table]
+
+    def insert(self, table: str, row: Dict[str, Any]) -> int:
+        # only the columns this version of Wiki.js has are written
+        columns = [c for c in row if c in self.table_columns(table)]
+        names = ", ".join(f'"{c}"' for c in columns)
+        values = ", ".join("?" for _ in columns)
+        cursor = self.conn.execute(
+            f'INSERT INTO "{table}" ({names}) VALUES ({values})',
+            [row[c] for c in columns],
+        )
+        return cursor.lastrowid
+
+    def update(self, table: str, id: int, row: Dict[str, Any]) -> None:
+        columns = [c for c in row if c in self.table_columns(table)]
+        assignments = ", ".join(f'"{c}" = ?' for c in columns)
+        self.conn.execute(
+            f'UPDATE "{table}" SET {assignments} WHERE id = ?',
+            [row[c] for c in columns] + [id],
+        )
+
+    def setting(self, key: str) -> Any:
+        row = self.conn.execute(
+            "SELECT value FROM settings WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def set_setting(self, key: str, value: Any, now: str) -> None:
+        # plain values are wrapped like the Wiki.js config service does
+        value = value if isinstance(value, dict) else {"v": value}
+        updated = self.conn.execute(
+            'UPDATE settings SET value = ?, "updatedAt" = ? WHERE key = ?',
+            (json.dumps(value), now, key),
+        ).rowcount
+        if not updated:
+            self.insert(
+                "settings", {"key": key, "value": json.dumps(value), "updatedAt": now}
+            )
+
+    def locale(self) -> Tuple[str, bool]:
+        lang = self.setting("lang") or {}
+        return lang.get("code", "en"), bool(lang.get("namespacing", False))
+
+    def write_pages(
+        self, pages: List[WikiPage], renderer: PageRenderer, now: str
+    ) -> Dict[int, List[Tuple[str, str]]]:
+        """Insert or update the pages and their tags.
+
+        Returns:
+            Dict[int, List[Tuple[str, str]]]: the locale and path of the pages each
+                page links to, by the page id
+        """
+
+        existing = {
+            (row[1], row[2]): row[0]
+            for row in self.conn.execute('SELECT id, path, "localeCode" FROM pages')
+        }
+        tags = {row[1]: row[0] for row in self.conn.execute("SELECT id, tag FROM tags")}
+        links: Dict[int, List[Tuple[str, str]]] = {}
+
+        for page in pages:
+            html, toc, pageLinks = renderer.render(page)
+            row = {
+                "path": page.path,
+                "hash": page_hash(page.path, page.locale),
+                "title": page.title,
+                "description": page.description,
+                "isPrivate": False,
+                # Wiki.js publishes all imported pages
+                "isPublished": True,
+                "privateNS": None,
+                "publishStartDate": "",
+                "publishEndDate": "",
+                "content": page.content,
+                "render": html,
+                "toc": json.dumps(toc),
+                "contentType": page.content_type,
+                "createdAt": page.created,
+                "updatedAt": page.updated,
+                "editorKey": page.editor,
+                "localeCode": page.locale,
+                "authorId": ROOT_USER_ID,
+                "creatorId": ROOT_USER_ID,
+                "extra": json.dumps({"js": "", "css": ""}),
+            }
+            pageId = existing.get((page.path, page.locale))
+            if pageId is None:
+                pageId = self.insert("pages", row)
+            else:
+                row.pop("createdAt")
+                self.update("pages", pageId, row)
+
+            self.conn.execute('DELETE FROM "pageTags" WHERE "pageId" = ?', (pageId,))
+            for tag in page.tags:
+                if tag not in tags:
+                    tags[tag] = self.insert(
+                        "tags",
+                        {"tag": tag, "title": tag, "createdAt": now, "updatedAt": now},
+                    )
+                self.insert("pageTags", {"pageId": pageId, "tagId": tags[tag]})
+            links[pageId] = pageLinks
+
+        for pageId, targets in links.items():
+            self.conn.execute('DELETE FROM "pageLinks" WHERE "pageId" = ?', (pageId,))
+            for locale, path in targets:
+                self.insert(
+                    "pageLinks", {"pageId": pageId, "path": path, "localeCode": locale}
+                )
+        return links
+
+    def write_tree(self) -> int:
+        pages = self.conn.execute(
+            'SELECT id, path, "localeCode", title, "isPrivate", "privateNS" FROM pages ORDER BY "localeCode", path'
+        ).fetchall()
+        tree = build_tree([(p[0], p[1], p[2], p[3], bool(p[4]), p[5]) for p in pages])
+        self.conn.execute('DELETE FROM "pageTree"')
+        for node in tree:
+            self.insert("pageTree", node)
+        return len(tree)
+
+    def write_assets(self, dir: str, assets: List[WikiAsset], now: str) -> None:
+        folders = {
+            (row[1], row[2]): row[0]
+            for row in self.conn.execute(
+                'SELECT id, "parentId", slug FROM "assetFolders"'
+            )
+        }
+
+        for asset in assets:
+            folderId: Optional[int] = None
+            slugs = []
+            for name in asset.folders:
+                slug = sanitize_name(name)
+                slugs.append(slug)
+                if (folderId, slug) not in folders:
+                    folders[(folderId, slug)] = self.insert(
+                        "assetFolders",
+                        {"name": name, "slug": slug, "parentId": folderId},
+                    )
+                folderId = folders[(folderId, slug)]
+
+            self.conn.execute(
+                'DELETE FROM "assetData" WHERE id IN (SELECT id FROM assets WHERE filename = ? AND "folderId" IS ?)',
+                (asset.filename, folderId),
+            )
+            self.conn.execute(
+                'DELETE FROM assets WHERE filename = ? AND "folderId" IS ?',
+                (asset.filename, folderId),
+            )
+
+            assetPath = "/".join(slugs + [asset.filename])
+            assetId = self.insert(
+                "assets",
+                {
+                    "filename": asset.filename,
+                    "hash": page_hash(assetPath, ""),
+                    "ext": os.path.splitext(asset.filename)[1],
+                    "kind": "image" if asset.mime.startswith("image/") else "binary",
+                    "mime": asset.mime,
+                    "fileSize": asset.size,
+                    "metadata": None,
+                    "createdAt": now,
+                    "updatedAt": now,
+                    "folderId": folderId,
+                    "authorId": ROOT_USER_ID,
+                },
+            )
+            with open(os.path.join(dir, asset.source), "rb") as f:
+                self.insert("assetData", {"id": assetId, "data": f.read()})
+
+    def write_settings(self, settings: WikiSettings, now: str) -> None:
+        if settings.title is not None:
+            self.set_setting("title", settings.title, now)
+
+        nav = self.setting("nav") or {}
+        self.set_setting("nav", {**nav, "mode": settings.navigation}, now)
+
+        features = self.setting("features") or {}
+        self.set_setting(
+            "features", {**features, "featurePageComments": settings.comments}, now
+        )
+
+        # the api is disabled once the wiki is configured, like the live setup does
+        api = self.setting("api") or {}
+        self.set_setting("api", {**api, "isEnabled": False}, now)
+
+        if settings.storage is not None:
+            row = {
+                "key": "git",
+                "isEnabled": True,
+                "mode": "pull",
+                "config": json.dumps(settings.storage),
+                "syncInterval": "PT5M",
+                "state": json.dumps(
+                    {"status": "pending", "message": "", "lastAttempt": None}
+                ),
+            }
+            self.conn.execute("DELETE FROM storage WHERE key = 'git'")
+            self.insert("storage", row)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def compile_database(
+    template: str,
+    output: str,
+    repo_dir: Optional[str],
+    settings: WikiSettings,
+    date: Optional[float] = None,
+) -> None:
+    """Write a Wiki.js database with the contents of the wiki repository to `output`.
+
+    Args:
+        template (str): the database of the base image
+        output (str): where to write the new database
+        repo_dir (Optional[str]): the checked out wiki repository, None for no content
+        settings (WikiSettings): the site settings to set
+        date (Optional[float]): the time to use for the content that does not have a
+            date of its own, for example the time of the latest commit
+
+    Raises:
+        CompileError: if the database could not be written
+    """
+
+    shutil.copyfile(template, output)
+    now = timestamp(
+        date if date is not None else datetime.now(timezone.utc).timestamp()
+    )
+
+    db = WikiDatabase(output)
+    try:
+        locale, namespacing = db.locale()
+        if namespacing:
+            _LOGGER.warning(
+                "the wiki uses locale namespaces, all pages are imported into the default locale"
+            )
+
+        if repo_dir:
+            pages, assets = load_repository(repo_dir, locale, now)
+            renderer = PageRenderer({(p.locale, p.path) for p in pages})
+            db.write_pages(pages, renderer, now)
+            db.write_assets(repo_dir, assets, now)
+            nodes = db.write_tree()
+            _LOGGER.info(
+                f"compiled {len(pages)} page(s), {len(assets)} asset(s), and {nodes} page tree node(s)"
+            )
+
+        db.write_settings(settings, now)
+        db.conn.commit()
+    except sqlite3.Error as e:
+        raise CompileError(f"failed to write the wiki database: {e}") from e
+    finally:
+        db.close()
+
+
+def write_archive(database: str, archive: str, mtime: Optional[float] = None) -> None:
+    """Put the database in the tar file that the `Dockerfile` adds to the image."""
+
+    with tarfile.open(archive, "w") as tar:
+        info = tar.gettarinfo(database, arcname="database.sqlite")
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        info.mode = 0o644
+        if mtime is not None:
+            info.mtime = int(mtime)
+        with open(database, "rb") as f:
+            tar.addfile(info, f)
+
+
+def optimize_database(path: str, page_size: Optional[int] = None) -> None:
+    """Rebuild the database without its free pages and update its query statistics.
+
+    The rollback journal is used instead of a write-ahead log, so the database in the
+    image is a single file that can be opened read-only.
+    """
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = DELETE")
+        if page_size:
+            # the new page size is only used once the database is vacuumed
+            conn.execute(f"PRAGMA page_size = {int(page_size)}")
+        conn.execute("VACUUM")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+
+
+def optimize_archive(archive: str, page_size: Optional[int] = None) -> Tuple[int, int]:
+    """Optimize the database in the tar file that the `Dockerfile` adds to the image.
+
+    Returns:
+        Tuple[int, int]: the size of the database before and after
+
+    Raises:
+        sqlite3.DatabaseError: if the database could not be optimized
+        tarfile.TarError: if the archive could not be read
+    """
+
+    with tempfile.TemporaryDirectory() as work:
+        path = os.path.join(work, "database.sqlite")
+        with tarfile.open(archive) as tar:
+            members = [m for m in tar.getmembers() if m.isfile()]
+            if not members:
+                raise tarfile.TarError("there is no database in the archive")
+            member = members[0]
+            with tar.extractfile(member) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+        before = os.path.getsize(path)
+        optimize_database(path, page_size)
+        after = os.path.getsize(path)
+
+        # the owner, mode, and name of the database in the archive stay the same
+        member.size = after
+        tmp = f"{archive}.tmp"
+        with tarfile.open(tmp, "w") as tar, open(path, "rb") as f:
+            tar.addfile(member, f)
+        os.replace(tmp, archive)
+
+    return before, after
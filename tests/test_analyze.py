@@ -0,0 +1,148 @@
+import io
+import os
+import shutil
+
+import pytest
+
+from benchmarks.fakes import FakeDockerClient, StubWiki
+from benchmarks.run import default_options
+from builder import cli
+from builder.analyze import (
+    add_file,
+    analyze_context,
+    check_budgets,
+    format_report,
+    format_size,
+)
+from builder.cli import parse_budgets
+from builder.layers import write_dockerfile
+
+DOCKERFILE = os.path.join(
+    os.path.dirname(__file__), "..", "builder", "data", "Dockerfile"
+)
+
+
+def write(path, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def context(tmp_path):
+    shutil.copy2(DOCKERFILE, tmp_path / "Dockerfile")
+    write(tmp_path / "lectures.layers" / "0" / "week1" / "video.mp4", b"v" * 4000)
+    write(tmp_path / "lectures.layers" / "1" / "week2" / "video.mp4", b"v" * 4000)
+    write(tmp_path / "lectures.layers" / "1" / "notes.md", b"n" * 100)
+    write(tmp_path / "practiceProblems" / "one.ipynb", b"p" * 300)
+    write(tmp_path / "practiceProblems" / "two.ipynb", b"q" * 300)
+    write(tmp_path / "jupyter" / "empty.txt", b"")
+    write(tmp_path / "jupyter" / "also-empty.txt", b"")
+    write_dockerfile(
+        str(tmp_path), {"lectures": ["lectures.layers/0", "lectures.layers/1"]}
+    )
+    return tmp_path
+
+
+def test_analyze_context(context):
+    report = analyze_context(str(context), exclude=["Dockerfile"])
+
+    assert report.total == 8700
+    assert report.directories == {
+        "lectures": 8100,
+        "practiceProblems": 600,
+        "jupyter": 0,
+    }
+    # files with the same size but other contents and empty files are not duplicates
+    assert [[f.path for f in group] for group in report.duplicates] == [
+        ["lectures.layers/0/week1/video.mp4", "lectures.layers/1/week2/video.mp4"]
+    ]
+    assert report.duplicate_bytes == 4000
+
+    layers = dict(report.layers)
+    assert (
+        layers["COPY --chown=${UID}:${UID} lectures.layers/1 /opt/static/lectures/"]
+        == 4100
+    )
+    assert (
+        layers["COPY --chown=${UID}:${UID} practiceProblems /builtin/practiceProblems/"]
+        == 600
+    )
+    assert layers["ADD --chown=${UID}:${UID} database.sqlite.tar /opt/wiki/"] == 0
+
+
+def test_add_file(context):
+    report = analyze_context(str(context), exclude=["database.sqlite.tar"])
+    write(context / "database.sqlite.tar", b"d" * 2048)
+    total = report.total
+    add_file(report, str(context), str(context / "database.sqlite.tar"))
+
+    assert report.total == total + 2048
+    assert report.directories["database.sqlite.tar"] == 2048
+    assert (
+        dict(report.layers)["ADD --chown=${UID}:${UID} database.sqlite.tar /opt/wiki/"]
+        == 2048
+    )
+
+
+def test_check_budgets(context):
+    report = analyze_context(str(context))
+    assert check_budgets(report) == []
+    assert check_budgets(report, report.total, {"lectures": 8100}) == []
+
+    errors = check_budgets(
+        report, 1024, {"lectures": 4096, "practiceProblems": 1024, "jupyter": 0}
+    )
+    assert len(errors) == 2
+    assert errors[0].startswith("the build context is ")
+    assert errors[1].startswith('"lectures" is 7.9K, more than its budget of 4.0K')
+    assert errors[1].endswith(
+        "lectures.layers/0/week1/video.mp4, lectures.layers/1/week2/video.mp4, lectures.layers/1/notes.md"
+    )
+
+
+def test_parse_budgets():
+    assert parse_budgets([]) == {}
+    assert parse_budgets(["lectures/=1K", "database.sqlite.tar=2M"]) == {
+        "lectures": 1024,
+        "database.sqlite.tar": 2 * 1024**2,
+    }
+    with pytest.raises(ValueError, match="must be one of"):
+        parse_budgets(["lecture=1G"])
+    with pytest.raises(ValueError, match="<directory>=<size>"):
+        parse_budgets(["lectures"])
+    with pytest.raises(ValueError, match="not a valid size"):
+        parse_budgets(["lectures=big"])
+
+
+def test_format_report(context):
+    report = analyze_context(str(context), exclude=["Dockerfile"])
+    lines = format_report(report, top=2).split("\n")
+
+    assert lines[0] == "build context: 8.5K in 7 files"
+    files = lines.index("largest files:")
+    assert lines[files + 1 : files + 3] == [
+        "      3.9K lectures.layers/0/week1/video.mp4",
+        "      3.9K lectures.layers/1/week2/video.mp4",
+    ]
+    assert "duplicate files, 3.9K could be saved:" in lines
+    assert format_size(100) == "100B"
+    assert format_size(3 * 1024**4) == "3.0T"
+
+
+@pytest.mark.parametrize(
+    "budget", ["--context-budget=lectures=1K", "--max-context-size=1K"]
+)
+def test_build_over_its_budget(tmp_path, budget):
+    write(tmp_path / "lectures" / "video.mp4", b"v" * 4096)
+    with StubWiki() as wiki:
+        client = FakeDockerClient(wiki.port)
+        opts = default_options(
+            "--no-pull",
+            f"--lectures-directory={tmp_path / 'lectures'}",
+            "--hash-cache-file=",
+            budget,
+        )
+        with pytest.raises(SystemExit, match="over its budget"):
+            cli.run(opts, client=client, progress_file=io.StringIO())
+    assert client.context_bytes == 0
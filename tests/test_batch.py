@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from benchmarks.run import default_options
+from builder.batch import (
+    course_options,
+    format_summary,
+    load_manifest,
+    output_path,
+    run_batch,
+)
+
+MANIFEST = """
+[defaults]
+base = "scioer/c-resource:latest"
+wiki_navigation = "TREE"
+example = "https://github.com/example/default.git"
+
+[[course]]
+name = "CIS*1300"
+tag = "scioer/cis1300:latest"
+example = ["https://github.com/example/a1.git", "https://github.com/example/a2.git"]
+
+[[course]]
+tag = "scioer/cis2500:latest"
+base = "scioer/java-resource:latest"
+workdir = "/builds/cis2500"
+"""
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    path = tmp_path / "courses.toml"
+    path.write_text(MANIFEST)
+    return str(path)
+
+
+def test_course_options(manifest):
+    opts = default_options(
+        "--workdir=/builds", "--trace-file=trace.json", "--wiki-title=Course"
+    )
+    defaults, courses = load_manifest(manifest)
+    first, second = [course_options(opts, defaults, course) for course in courses]
+
+    assert first["name"] == "CIS*1300"
+    assert first["base"] == "scioer/c-resource:latest"
+    assert first["example"] == [
+        "https://github.com/example/a1.git",
+        "https://github.com/example/a2.git",
+    ]
+    assert first["wiki_title"] == "Course"
+    assert (first["workdir"], first["trace_file"]) == (
+        os.path.join("/builds", "CIS-1300"),
+        "trace-CIS-1300.json",
+    )
+
+    assert second["name"] == "scioer/cis2500:latest"
+    assert second["base"] == "scioer/java-resource:latest"
+    assert second["example"] == ["https://github.com/example/default.git"]
+    # a course that sets an output itself keeps it
+    assert second["workdir"] == "/builds/cis2500"
+    assert second["trace_file"] == "trace-scioer-cis2500-latest.json"
+    assert second["metrics_file"] is None
+
+
+def test_output_path():
+    assert output_path("workdir", "/builds", "a/b") == os.path.join("/builds", "a-b")
+    assert output_path("metrics_file", "/m/build.prom", "42") == "/m/build-42.prom"
+    assert output_path("trace_file", "trace", "..") == "trace-course"
+
+
+@pytest.mark.parametrize(
+    "course, error",
+    [
+        ({"tag": "x", "no_such_option": 1}, "'no_such_option' is not a valid"),
+        ({"tag": "x", "concurrency": 2}, "'concurrency' is not a valid"),
+    ],
+)
+def test_invalid_course_options(course, error):
+    with pytest.raises(ValueError, match=error):
+        course_options(default_options(), {}, course)
+
+
+@pytest.mark.parametrize(
+    "text, error",
+    [
+        ("[defaults]\nbase = 'x'\n", "does not contain any"),
+        ("[[course]]\ntag = 'x'\n[other]\n", "unknown sections"),
+    ],
+)
+def test_invalid_manifests(tmp_path, text, error):
+    path = tmp_path / "courses.toml"
+    path.write_text(text)
+    with pytest.raises(ValueError, match=error):
+        load_manifest(str(path))
+
+
+def test_run_batch():
+    courses = [{"name": name, "tag": f"{name}:latest"} for name in ["a", "b", "c", "d"]]
+
+    def build(course: dict, index: int):
+        if course["name"] == "b":
+            return False
+        if course["name"] == "c":
+            raise SystemExit("Failed to push the image")
+        if course["name"] == "d":
+            raise RuntimeError("broken")
+
+    results = run_batch(courses, build, concurrency=2)
+    assert [(r.name, r.succeeded, r.message) for r in results] == [
+        ("a", True, ""),
+        ("b", False, "build failed"),
+        ("c", False, "Failed to push the image"),
+        ("d", False, "broken"),
+    ]
+
+    summary = format_summary(results).splitlines()
+    assert summary[0].split() == ["COURSE", "TAG", "RESULT", "DURATION"]
+    assert summary[1].split() == ["a", "a:latest", "ok", "0m00s"]
+    assert "failed: broken" in summary[4]
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import pytest
+
+from builder.buildkit import BuildProgress, LocalCache, link_copies, link_line
+from builder.layers import write_dockerfile
+
+DOCKERFILE = os.path.join(
+    os.path.dirname(__file__), "..", "builder", "data", "Dockerfile"
+)
+
+
+@pytest.fixture
+def dockerfile(tmp_path):
+    shutil.copy2(DOCKERFILE, tmp_path / "Dockerfile")
+    return tmp_path
+
+
+def copies(dir) -> list:
+    with open(os.path.join(dir, "Dockerfile")) as f:
+        return [
+            line for line in f.read().split("\n") if line.startswith(("COPY", "ADD"))
+        ]
+
+
+def test_only_the_content_is_linked(dockerfile):
+    link_copies(str(dockerfile))
+    link_copies(str(dockerfile))
+
+    assert copies(dockerfile) == [
+        "COPY --link --chown=${UID}:${UID} jupyter /builtin/jupyter/",
+        "COPY --link --chown=${UID}:${UID} practiceProblems /builtin/practiceProblems/",
+        "ADD --chown=${UID}:${UID} database.sqlite.tar /opt/wiki/",
+        "COPY --link --chown=${UID}:${UID} lectures /opt/static/lectures/",
+        "COPY --chown=${UID}:${UID} motd.txt /scripts/motd.txt",
+    ]
+
+
+def test_split_layers_are_linked(dockerfile):
+    write_dockerfile(
+        str(dockerfile), {"lectures": ["lectures.layers/0", "lectures.layers/1"]}
+    )
+    link_copies(str(dockerfile))
+    assert copies(dockerfile)[3:5] == [
+        "COPY --link --chown=${UID}:${UID} lectures.layers/0 /opt/static/lectures/",
+        "COPY --link --chown=${UID}:${UID} lectures.layers/1 /opt/static/lectures/",
+    ]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        # the owner of the files would be root
+        "COPY lectures /opt/static/lectures/",
+        "COPY --chown=1000:1000 notes /home/jovyan/",
+        "ADD --chown=1000:1000 lectures /opt/static/lectures/",
+        "COPY --link --chown=1000:1000 lectures /opt/static/lectures/",
+    ],
+)
+def test_lines_that_are_not_linked(line):
+    assert link_line(line) == line
+
+
+def test_build_progress():
+    progress = BuildProgress()
+    for line in [
+        "#1 [internal] load build definition from Dockerfile",
+        "#1 DONE 0.1s",
+        "#5 [2/3] COPY --link jupyter /builtin/jupyter/",
+        "#6 [3/3] COPY --link lectures /opt/static/lectures/",
+        "#5 CACHED",
+        "#6 DONE 2.5s",
+        "#7 exporting to image",
+        "#7 ERROR: failed to export",
+    ]:
+        progress.feed(line)
+
+    steps = progress.dockerfile_steps()
+    assert [str(s) for s in steps] == [
+        "[2/3] COPY --link jupyter /builtin/jupyter/",
+        "[3/3] COPY --link lectures /opt/static/lectures/",
+    ]
+    assert [(s.cached, s.duration) for s in steps] == [(True, 0), (False, 2.5)]
+    assert progress.steps[7].error == "failed to export"
+    assert progress.report().endswith(
+        "1 of 2 steps were cached, 2.6s spent in the steps"
+    )
+
+
+def test_local_cache(tmp_path):
+    cache = LocalCache(str(tmp_path / "cache"))
+    assert "--cache-from" not in cache.args()
+
+    os.makedirs(cache.new)
+    (tmp_path / os.path.basename(cache.new) / "index.json").write_text("{}")
+    cache.commit()
+    assert os.path.isfile(tmp_path / "cache" / "index.json")
+
+    cache = LocalCache(str(tmp_path / "cache"))
+    assert cache.args()[:2] == ["--cache-from", f"type=local,src={tmp_path / 'cache'}"]
+    os.makedirs(cache.new)
+    cache.commit(succeeded=False)
+    assert not os.path.exists(cache.new)
+    assert os.path.isfile(tmp_path / "cache" / "index.json")
@@ -0,0 +1,95 @@
+import gzip
+import io
+import tarfile
+
+import docker
+import pytest
+
+from benchmarks.content import make_directory
+from benchmarks.fakes import FakeDockerClient
+from builder import cli
+from builder.context import ContextStream
+
+
+@pytest.fixture
+def context_dir(tmp_path):
+    # more than a few chunks, so the producer has to wait for the consumer
+    return make_directory(str(tmp_path / "context"), 6 * 1024 * 1024, 16)
+
+
+def names(data: bytes) -> list:
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:") as tar:
+        return sorted(m.name for m in tar.getmembers() if m.isfile())
+
+
+def test_stream_is_a_tar_of_the_directory(context_dir):
+    context = ContextStream(context_dir, max_chunks=2)
+    data = b"".join(context)
+
+    assert len(names(data)) == 16
+    assert context.sent_bytes == len(data) == context.tar_bytes
+    assert not context.thread.is_alive()
+
+
+def test_gzip_stream(context_dir):
+    context = ContextStream(context_dir, compression="gzip")
+    data = b"".join(context)
+    assert len(names(gzip.decompress(data))) == 16
+
+
+def test_invalid_compression(context_dir):
+    with pytest.raises(ValueError, match="not a valid compression"):
+        ContextStream(context_dir, compression="lz4")
+
+
+def test_closing_stops_the_producer(context_dir):
+    context = ContextStream(context_dir, max_chunks=1)
+    chunks = iter(context)
+    next(chunks)
+    chunks.close()
+
+    context.thread.join(5)
+    assert not context.thread.is_alive()
+
+
+def test_failed_build_stops_the_producer(context_dir, monkeypatch):
+    streams = []
+
+    class Recorded(ContextStream):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, max_chunks=1)
+            streams.append(self)
+
+    uploads = []
+
+    def build(fileobj=None, **kwargs):
+        # the connection to the daemon drops after the first chunk, the upload is
+        # still referenced like it is by the http connection
+        uploads.append(iter(fileobj))
+        next(uploads[0])
+        raise docker.errors.APIError("connection reset")
+
+    monkeypatch.setattr(cli, "ContextStream", Recorded)
+    client = FakeDockerClient(0)
+    client.api.build = build
+
+    with pytest.raises(docker.errors.APIError):
+        cli.build_single_arch(client, context_dir)
+    (context,) = streams
+    context.thread.join(5)
+    assert not context.thread.is_alive()
+
+
+def test_build_error(context_dir):
+    client = FakeDockerClient(0)
+    client.api.build = lambda fileobj=None, **kwargs: iter([{"error": "COPY failed\n"}])
+
+    with pytest.raises(docker.errors.BuildError, match="COPY failed"):
+        cli.build_single_arch(client, context_dir)
+
+
+def test_build(context_dir):
+    client = FakeDockerClient(0)
+    image = cli.build_single_arch(client, context_dir, tag="course:v1")
+    assert client.images.get("course:v1") is image
+    assert client.context_bytes > 0
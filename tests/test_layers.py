@@ -0,0 +1,89 @@
+import os
+import shutil
+
+from builder.layers import assign_groups, list_files, split_directory, split_layers
+
+DOCKERFILE = os.path.join(
+    os.path.dirname(__file__), "..", "builder", "data", "Dockerfile"
+)
+
+
+def write(path, size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def sample_files(count: int):
+    return [
+        (f"week{i % 7}/lecture{i}.mp4", 1000 + (i * 7919) % 5000) for i in range(count)
+    ]
+
+
+def test_assignment_is_balanced():
+    files = sample_files(500)
+    assignment = assign_groups(files, 4)
+
+    loads = [0] * 4
+    for path, size in files:
+        loads[assignment[path]] += size
+    assert max(loads) - min(loads) < 0.1 * sum(loads) / 4
+
+
+def test_assignment_is_stable():
+    files = sample_files(500)
+    before = assign_groups(files, 4)
+
+    # a small change to a single file does not move any of the others
+    files[0] = (files[0][0], files[0][1] + 10)
+    after = assign_groups(files + [("week0/extra.txt", 10)], 4)
+    assert {path: after[path] for path in before} == before
+
+
+def test_split_directory(tmp_path):
+    write(tmp_path / "lectures" / "a" / "one.txt", 300)
+    write(tmp_path / "lectures" / "a" / "b" / "two.txt", 200)
+    write(tmp_path / "lectures" / "three.txt", 100)
+    os.makedirs(tmp_path / "lectures" / "empty")
+    before = list_files(str(tmp_path / "lectures"))
+
+    layers = split_directory(str(tmp_path), "lectures", 3)
+
+    assert layers == [f"lectures.layers/{i}" for i in range(3)]
+    assert not os.path.exists(tmp_path / "lectures")
+    assert os.path.isdir(tmp_path / "lectures.layers" / "0" / "empty")
+    after = []
+    for layer in layers:
+        assert os.path.isdir(tmp_path / layer)
+        after += list_files(str(tmp_path / layer))
+    assert sorted(after) == before
+
+
+def test_missing_directory_is_not_split(tmp_path):
+    assert split_directory(str(tmp_path), "lectures", 3) == ["lectures"]
+
+
+def test_split_layers(tmp_path):
+    shutil.copy2(DOCKERFILE, tmp_path / "Dockerfile")
+    write(tmp_path / "lectures" / "one.txt", 100)
+    write(tmp_path / "lectures" / "two.txt", 100)
+    with open(tmp_path / "Dockerfile") as f:
+        original = f.read()
+
+    assert split_layers(str(tmp_path), 1) == {}
+    assert os.path.isdir(tmp_path / "lectures")
+
+    layers = split_layers(str(tmp_path), 2)
+    assert layers == {
+        "lectures": ["lectures.layers/0", "lectures.layers/1"],
+        # practiceProblems is missing so its line is kept
+        "practiceProblems": ["practiceProblems"],
+    }
+    with open(tmp_path / "Dockerfile") as f:
+        dockerfile = f.read()
+    expected = original.replace(
+        "COPY --chown=${UID}:${UID} lectures /opt/static/lectures/",
+        "COPY --chown=${UID}:${UID} lectures.layers/0 /opt/static/lectures/\n"
+        "COPY --chown=${UID}:${UID} lectures.layers/1 /opt/static/lectures/",
+    )
+    assert dockerfile == expected != original
@@ -0,0 +1,81 @@
+import logging
+import threading
+from itertools import count
+
+from builder.pool import WarmPool
+
+
+class Items:
+    """Create numbered items and record what happened to them."""
+
+    def __init__(self):
+        self.ids = count(1)
+        self.reset_fails = False
+        self.destroyed = []
+
+    def create(self, key: str) -> str:
+        logging.getLogger("builder.pool").info(f"creating an item for {key}")
+        return f"{key}-{next(self.ids)}"
+
+    def reset(self, item: str) -> None:
+        if self.reset_fails:
+            raise RuntimeError("the container died")
+
+    def destroy(self, item: str) -> None:
+        self.destroyed.append(item)
+
+
+def test_items_are_reused():
+    items = Items()
+    pool = WarmPool(1, items.create, items.reset, items.destroy)
+
+    first = pool.acquire("wiki")
+    # the pool is empty, so the next item is created right away
+    second = pool.acquire("wiki")
+    assert {first, second} == {"wiki-1", "wiki-2"}
+
+    pool.release("wiki", first)
+    pool.release("wiki", second)
+    assert items.destroyed == [second]
+    assert pool.acquire("wiki") == first
+
+    pool.release("wiki", first, reusable=False)
+    assert items.destroyed == [second, first]
+    pool.close()
+
+
+def test_failed_resets_are_replaced():
+    items = Items()
+    pool = WarmPool(1, items.create, items.reset, items.destroy)
+    item = pool.acquire("wiki")
+
+    items.reset_fails = True
+    pool.release("wiki", item)
+    assert pool.acquire("wiki") == "wiki-2"
+    assert items.destroyed == [item]
+    pool.close()
+
+
+def test_close_destroys_idle_items():
+    items = Items()
+    pool = WarmPool(2, items.create, items.reset, items.destroy)
+    pool.release("wiki", pool.acquire("wiki"))
+    pool.close()
+    assert sorted(items.destroyed) == ["wiki-1", "wiki-2"]
+
+
+def test_items_are_prepared_for_their_build(caplog):
+    caplog.set_level(logging.INFO)
+    items = Items()
+    pool = WarmPool(1, items.create, items.reset, items.destroy)
+
+    def build() -> None:
+        pool.acquire("wiki")
+
+    thread = threading.Thread(target=build, name="job-abc")
+    thread.start()
+    thread.join()
+    pool.close()
+
+    created = [r.threadName for r in caplog.records if "creating" in r.message]
+    assert created == ["job-abc-pool"]
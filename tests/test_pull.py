@@ -0,0 +1,113 @@
+import io
+import json
+
+import docker
+import pytest
+
+from benchmarks.fakes import FakeDockerClient
+from builder.cli import fetch_latest
+from builder.pull import PullCache, split_image
+
+IMAGE = "marshallasch/base-resource:latest"
+
+
+class Counting(FakeDockerClient):
+    """Count the pulls and the registry checks."""
+
+    def __init__(self):
+        super().__init__(0)
+        self.pulls = 0
+        self.checks = 0
+        pull = self.api.pull
+        registry_data = self.images.get_registry_data
+
+        def counted_pull(*args, **kwargs):
+            self.pulls += 1
+            return pull(*args, **kwargs)
+
+        def counted_registry_data(*args, **kwargs):
+            self.checks += 1
+            return registry_data(*args, **kwargs)
+
+        self.api.pull = counted_pull
+        self.images.get_registry_data = counted_registry_data
+
+
+@pytest.fixture
+def client():
+    return Counting()
+
+
+def fetch(client, cache=None) -> int:
+    return fetch_latest(client, IMAGE, cache=cache, progress_file=io.StringIO())
+
+
+def test_split_image():
+    assert split_image("ubuntu") == ("ubuntu", "latest")
+    assert split_image("localhost:5000/base:v1") == ("localhost:5000/base", "v1")
+    assert split_image("base@sha256:abc") == ("base", "sha256:abc")
+
+
+def test_only_pulls_new_digests(client):
+    assert fetch(client) > 0
+    assert client.pulls == 1
+
+    assert fetch(client) == 0
+    assert (client.pulls, client.checks) == (1, 2)
+
+    client.registry.publish(IMAGE)
+    assert fetch(client) > 0
+    assert client.pulls == 2
+
+
+def test_pinned_digests_are_not_checked(client):
+    name = "marshallasch/base-resource@sha256:" + "0" * 64
+    assert fetch_latest(client, name, progress_file=io.StringIO()) == 0
+    assert (client.pulls, client.checks) == (0, 0)
+
+
+def test_registry_errors_pull(client):
+    def unreachable(name):
+        raise docker.errors.APIError("registry is down")
+
+    client.images.get_registry_data = unreachable
+    assert fetch(client) > 0
+    assert fetch(client) > 0
+    assert client.pulls == 2
+
+
+def test_cache_skips_the_registry(client, tmp_path):
+    cache = PullCache(str(tmp_path / "pulls.json"), ttl=60)
+    assert fetch(client, cache) > 0
+    assert client.checks == 1
+
+    # a new version within the ttl is not noticed
+    client.registry.publish(IMAGE)
+    assert fetch(client, cache) == 0
+    assert (client.pulls, client.checks) == (1, 1)
+
+    with open(cache.path) as f:
+        entries = json.load(f)
+    entries[IMAGE]["checked"] -= 120
+    with open(cache.path, "w") as f:
+        json.dump(entries, f)
+
+    assert fetch(client, cache) > 0
+    assert (client.pulls, client.checks) == (2, 2)
+
+
+def test_cache_is_for_the_same_image(client, tmp_path):
+    cache = PullCache(str(tmp_path / "pulls.json"), ttl=60)
+    fetch(client, cache)
+    assert cache.fresh(IMAGE, client.images.get(IMAGE).id)
+
+    # the local image was replaced, by a build or a `docker pull`
+    client.images.get(IMAGE).id = "sha256:" + "1" * 64
+    assert not cache.fresh(IMAGE, client.images.get(IMAGE).id)
+    assert fetch(client, cache) == 0
+    assert client.checks == 2
+
+
+def test_cache_disabled(tmp_path):
+    cache = PullCache(str(tmp_path / "pulls.json"), ttl=0)
+    assert not cache.fresh(IMAGE, "sha256:" + "0" * 64)
@@ -0,0 +1,144 @@
+import io
+import threading
+from typing import Dict, List
+
+import docker
+import pytest
+from requests.exceptions import ConnectionError
+
+from benchmarks.fakes import FakeDockerClient, FakeImage
+from builder import push
+from builder.push import expand_tags, push_tags, push_with_retry
+
+LAYER = 1024
+
+
+class Registry:
+    """Answer `api.push` and fail each tag the given number of times."""
+
+    def __init__(self, failures: Dict[str, List[Exception]] = None):
+        self.failures = failures or {}
+        self.pushed: List[str] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, repository: str, tag: str = "latest", **kwargs):
+        name = f"{repository}:{tag}"
+        with self.lock:
+            self.pushed.append(name)
+            errors = self.failures.get(name, [])
+            error = errors.pop(0) if errors else None
+        if isinstance(error, Exception):
+            raise error
+
+        yield {
+            "status": "Pushing",
+            "id": "layer0",
+            "progressDetail": {"current": LAYER // 2, "total": LAYER},
+        }
+        if error:
+            yield {"error": error}
+            return
+        yield {"status": "Pushed", "id": "layer0"}
+        yield {"status": "Layer already exists", "id": "layer1"}
+        yield {"aux": {"Tag": tag, "Digest": f"sha256:{tag}", "Size": 1}}
+
+
+class Image(FakeImage):
+    def __init__(self, name: str):
+        super().__init__("sha256:image", [name])
+
+    def tag(self, repository: str, tag: str) -> bool:
+        self.tags.append(f"{repository}:{tag}")
+        return True
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(push, "sleep", lambda seconds: None)
+
+
+def client(registry: Registry) -> FakeDockerClient:
+    client = FakeDockerClient(0)
+    client.api.push = registry
+    return client
+
+
+def test_expand_tags():
+    assert expand_tags("org/course:1.0", []) == ["org/course:1.0"]
+    assert expand_tags(
+        "localhost:5000/org/course:1.0",
+        [
+            ":latest",
+            "ghcr.io/org/course:1.0",
+            ":latest",
+            "localhost:5000/org/course:1.0",
+        ],
+    ) == [
+        "localhost:5000/org/course:1.0",
+        "localhost:5000/org/course:latest",
+        "ghcr.io/org/course:1.0",
+    ]
+
+
+def test_push_progress():
+    registry = Registry()
+    digest, uploaded = push_with_retry(
+        client(registry), "org/course:1.0", progress_file=io.StringIO()
+    )
+    assert (digest, uploaded) == ("sha256:1.0", LAYER)
+
+
+@pytest.mark.parametrize(
+    "error", [ConnectionError("reset"), "received unexpected HTTP status: 502"]
+)
+def test_push_is_retried(error):
+    registry = Registry({"org/course:1.0": [error, error]})
+    digest, _ = push_with_retry(
+        client(registry), "org/course:1.0", retries=2, progress_file=io.StringIO()
+    )
+    assert digest == "sha256:1.0"
+    assert registry.pushed == ["org/course:1.0"] * 3
+
+
+def test_push_gives_up():
+    registry = Registry({"org/course:1.0": ["502"] * 3})
+    with pytest.raises(docker.errors.APIError):
+        push_with_retry(
+            client(registry), "org/course:1.0", retries=2, progress_file=io.StringIO()
+        )
+    assert len(registry.pushed) == 3
+
+
+def test_denied_push_is_not_retried():
+    registry = Registry(
+        {"org/course:1.0": ["denied: requested access to the resource is denied"]}
+    )
+    with pytest.raises(docker.errors.APIError, match="denied"):
+        push_with_retry(client(registry), "org/course:1.0", progress_file=io.StringIO())
+    assert registry.pushed == ["org/course:1.0"]
+
+
+def test_push_tags():
+    names = expand_tags(
+        "org/course:1.0", [":latest", ":fall", "ghcr.io/org/course:1.0"]
+    )
+    registry = Registry()
+    image = Image(names[0])
+
+    digests = push_tags(client(registry), image, names, progress_file=io.StringIO())
+
+    assert digests == {name: f"sha256:{name.split(':')[-1]}" for name in names}
+    assert sorted(image.tags) == sorted(names)
+    # the first tag of a registry is pushed before its other tags
+    docker_hub = [name for name in registry.pushed if not name.startswith("ghcr.io")]
+    assert docker_hub[0] == "org/course:1.0"
+    assert sorted(registry.pushed) == sorted(names)
+
+
+def test_failed_registry_skips_its_other_tags():
+    names = ["org/course:1.0", "org/course:latest", "ghcr.io/org/course:1.0"]
+    registry = Registry({"org/course:1.0": ["unauthorized: authentication required"]})
+
+    with pytest.raises(docker.errors.APIError, match="2 of 3"):
+        push_tags(client(registry), Image(names[0]), names, progress_file=io.StringIO())
+    assert sorted(registry.pushed) == ["ghcr.io/org/course:1.0", "org/course:1.0"]
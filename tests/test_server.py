@@ -0,0 +1,266 @@
+import logging
+import os
+import stat
+import threading
+from http.server import ThreadingHTTPServer
+from time import monotonic, sleep
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from benchmarks.run import default_options
+from builder.batch import course_options
+from builder.server import (
+    CANCELLED,
+    FAILED,
+    FINISHED,
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    BuildServer,
+    Job,
+    JobStore,
+    make_handler,
+)
+
+TOKEN = "secret"
+AUTH = {"Authorization": f"Bearer {TOKEN}"}
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Builds:
+    """The build callbacks of a server, recording which thread calls them."""
+
+    def __init__(self):
+        self.calls = []
+        self.release_event = threading.Event()
+
+    def validate(self, spec: dict, id: str) -> dict:
+        if spec.get("tag") == "invalid":
+            raise ValueError("not a valid tag")
+        return dict(spec)
+
+    def build(self, opts: dict, cleanup, progress) -> bool:
+        self.calls.append(("build", opts))
+        _LOGGER.info(f"building {opts['tag']}")
+        # the threads a build starts are named after the job
+        thread = threading.Thread(
+            target=lambda: _LOGGER.info("from a stage"),
+            name=f"{threading.current_thread().name}-stage",
+        )
+        thread.start()
+        thread.join()
+
+        if opts["tag"] == "wait":
+            while not cleanup.cancelled:
+                sleep(0.01)
+            raise RuntimeError("the build was cancelled")
+        if opts["tag"] == "fail":
+            raise RuntimeError("broken")
+        if opts["tag"] == "exit":
+            raise SystemExit("Failed to push the image")
+        return True
+
+    def new_cleanup(self) -> SimpleNamespace:
+        return SimpleNamespace(cancelled=False)
+
+    def interrupt(self, cleanup) -> None:
+        self.calls.append(("interrupt", threading.current_thread().name))
+        cleanup.cancelled = True
+
+    def release(self, cleanup) -> None:
+        self.calls.append(("release", threading.current_thread().name))
+        self.release_event.set()
+
+
+def wait_for(job: Job, statuses=FINISHED) -> Job:
+    deadline = monotonic() + 5
+    while job.status not in statuses:
+        assert monotonic() < deadline, f"job is still {job.status}"
+        sleep(0.01)
+    return job
+
+
+@pytest.fixture
+def builds():
+    return Builds()
+
+
+@pytest.fixture
+def server(tmp_path, builds, caplog):
+    caplog.set_level(logging.INFO)
+    server = BuildServer(
+        JobStore(str(tmp_path / "jobs")),
+        builds.validate,
+        builds.build,
+        builds.new_cleanup,
+        builds.interrupt,
+        builds.release,
+        token=TOKEN,
+    )
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def url(server):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(server))
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/jobs"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_job_lifecycle(server, url):
+    r = requests.post(url, json={"tag": "course:v1"}, headers=AUTH)
+    assert r.status_code == 201
+    job = server.store.get(r.json()["id"])
+    assert wait_for(job).status == SUCCEEDED
+
+    r = requests.get(f"{url}/{job.id}", headers=AUTH)
+    assert r.json()["status"] == SUCCEEDED
+    assert [j["id"] for j in requests.get(url, headers=AUTH).json()] == [job.id]
+
+    log = requests.get(f"{url}/{job.id}/log", headers=AUTH).text
+    assert "building course:v1" in log
+    assert "from a stage" in log
+
+
+def test_requests_need_the_token(url):
+    assert requests.get(url).status_code == 401
+    r = requests.get(url, headers={"Authorization": "Bearer wrong"})
+    assert r.status_code == 401
+    assert r.headers["WWW-Authenticate"] == "Bearer"
+    assert requests.post(url, json={"tag": "x"}).status_code == 401
+    assert requests.delete(f"{url}/abc").status_code == 401
+
+
+def test_submitted_specs(server, url):
+    r = requests.post(
+        url, data='{"tag": "x"}', headers={**AUTH, "Content-Type": "text/plain"}
+    )
+    assert r.status_code == 415
+
+    r = requests.post(url, json={"tag": "x", "workdir": "/"}, headers=AUTH)
+    assert r.status_code == 400
+    assert "workdir" in r.json()["error"]
+
+    r = requests.post(url, json={"tag": "invalid"}, headers=AUTH)
+    assert r.status_code == 400
+    assert r.json()["error"] == "not a valid tag"
+
+    assert requests.post(url, json=["x"], headers=AUTH).status_code == 400
+    assert server.store.all() == []
+    assert requests.get(f"{url}/missing", headers=AUTH).status_code == 404
+
+
+def test_secrets_are_not_returned(server, builds, url):
+    spec = {"tag": "course:v1", "wiki_git_password": "hunter2"}
+    r = requests.post(url, json=spec, headers=AUTH)
+    job = wait_for(server.store.get(r.json()["id"]))
+    assert builds.calls[0] == ("build", spec)
+
+    responses = [
+        r,
+        requests.get(url, headers=AUTH),
+        requests.get(f"{url}/{job.id}", headers=AUTH),
+        requests.get(f"{url}/{job.id}/log", headers=AUTH),
+        requests.delete(f"{url}/{job.id}", headers=AUTH),
+    ]
+    for response in responses:
+        assert response.status_code in [200, 201]
+        assert "hunter2" not in response.text
+    assert r.json()["spec"] == {"tag": "course:v1", "wiki_git_password": "***"}
+
+    # the spec is kept so the job can be built again after a restart
+    if os.name == "posix":
+        assert stat.S_IMODE(os.stat(server.store.dir).st_mode) == 0o700
+        for name in os.listdir(server.store.dir):
+            mode = os.stat(os.path.join(server.store.dir, name)).st_mode
+            assert stat.S_IMODE(mode) == 0o600
+
+
+@pytest.mark.parametrize(
+    "tag, message",
+    [("fail", "broken"), ("exit", "Failed to push the image")],
+)
+def test_failed_jobs(server, builds, tag, message):
+    job = wait_for(server.submit({"tag": tag}))
+    assert (job.status, job.message) == (FAILED, message)
+    assert [call for call, _ in builds.calls] == ["build"]
+
+
+def test_cancel_running_job(server, builds, url):
+    job = wait_for(server.submit({"tag": "wait"}), [RUNNING])
+
+    r = requests.delete(f"{url}/{job.id}", headers=AUTH)
+    assert r.json()["status"] == CANCELLED
+    assert builds.release_event.wait(5)
+
+    # the build is released by its own thread once it has stopped
+    (interrupt, interrupted_by), (release, released_by) = builds.calls[1:]
+    assert (interrupt, release) == ("interrupt", "release")
+    assert not interrupted_by.startswith("job-")
+    assert released_by == f"job-{job.id}"
+    assert server.store.get(job.id).message == "cancelled while it was running"
+
+
+def test_cancel_queued_job(server, builds):
+    running = wait_for(server.submit({"tag": "wait"}), [RUNNING])
+    queued = server.submit({"tag": "never"})
+    assert server.cancel(queued).status == CANCELLED
+
+    server.cancel(running)
+    assert builds.release_event.wait(5)
+    assert [call for call, _ in builds.calls] == ["build", "interrupt", "release"]
+    assert queued.started is None
+
+
+def test_unfinished_jobs_are_restarted(tmp_path, builds):
+    store = JobStore(str(tmp_path / "jobs"))
+    store.save(Job("running", {"tag": "a"}, status=RUNNING))
+    store.save(Job("queued", {"tag": "b"}, status=QUEUED))
+    store.save(Job("done", {"tag": "c"}, status=SUCCEEDED))
+
+    server = BuildServer(
+        JobStore(store.dir),
+        builds.validate,
+        builds.build,
+        builds.new_cleanup,
+        builds.interrupt,
+        builds.release,
+    )
+    server.start()
+    try:
+        for id in ["running", "queued"]:
+            assert wait_for(server.store.get(id)).status == SUCCEEDED
+    finally:
+        server.stop()
+
+
+def test_jobs_get_their_own_outputs(tmp_path, builds):
+    opts = default_options("--workdir=/builds", "--trace-file=trace.json")
+    server = BuildServer(
+        JobStore(str(tmp_path / "jobs")),
+        lambda spec, id: course_options(opts, {}, spec, id=id),
+        builds.build,
+        builds.new_cleanup,
+        builds.interrupt,
+        builds.release,
+        workers=2,
+    )
+    server.start()
+    try:
+        jobs = [wait_for(server.submit({"tag": "course:v1"})) for _ in range(2)]
+    finally:
+        server.stop()
+
+    built = {opts["workdir"]: opts["trace_file"] for _, opts in builds.calls}
+    assert built == {
+        os.path.join("/builds", job.id): f"trace-{job.id}.json" for job in jobs
+    }
@@ -0,0 +1,176 @@
+import threading
+
+import pytest
+
+from builder.stages import Checkpoints, StageGraph, StopGraph
+
+
+def test_stages_run_after_their_inputs():
+    order = []
+    graph = StageGraph()
+    graph.add("sum", lambda a, b: order.append("sum") or a + b, ["a", "b"], ["sum"])
+    graph.add("a", lambda x: order.append("a") or x, ["x"], ["a"])
+    graph.add("b", lambda: order.append("b") or 2, [], ["b"])
+    graph.add("pair", lambda sum: (sum, -sum), ["sum"], ["plus", "minus"])
+
+    values = graph.run(values={"x": 1})
+    assert order.index("sum") > max(order.index("a"), order.index("b"))
+    assert (values["sum"], values["plus"], values["minus"]) == (3, 3, -3)
+    assert [s.name for s in graph.critical_path()][-2:] == ["sum", "pair"]
+    assert graph.report().startswith("critical path")
+
+
+def test_independent_stages_run_at_the_same_time():
+    barrier = threading.Barrier(2, timeout=5)
+    graph = StageGraph()
+    graph.add("a", lambda: barrier.wait(), [], ["a"])
+    graph.add("b", lambda: barrier.wait(), [], ["b"])
+    graph.run(max_parallel=2)
+
+
+def test_invalid_graphs():
+    graph = StageGraph()
+    graph.add("a", lambda b: b, ["b"], ["a"])
+    graph.add("b", lambda a: a, ["a"], ["b"])
+    with pytest.raises(ValueError, match="depend on each other"):
+        graph.run()
+
+    graph = StageGraph()
+    graph.add("a", lambda missing: missing, ["missing"], ["a"])
+    with pytest.raises(ValueError, match="no stage produces it"):
+        graph.run()
+
+    graph = StageGraph()
+    graph.add("a", lambda: 1, [], ["a"])
+    graph.add("b", lambda: 2, [], ["a"])
+    with pytest.raises(ValueError, match="produced by both"):
+        graph.run()
+
+    with pytest.raises(ValueError, match="already is a stage"):
+        graph.add("a", lambda: 1)
+
+
+def test_failure_waits_for_running_stages():
+    started = threading.Event()
+    stops = []
+    ran = []
+
+    def slow() -> int:
+        started.set()
+        graph.stopping.wait(5)
+        ran.append("slow")
+        return 1
+
+    def fail() -> None:
+        started.wait(5)
+        raise RuntimeError("failed")
+
+    graph = StageGraph()
+    graph.add("slow", slow, [], ["slow"])
+    graph.add("fail", fail, [], ["fail"])
+    graph.add("after", lambda fail: ran.append("after"), ["fail"], [])
+
+    with pytest.raises(RuntimeError, match="failed"):
+        graph.run(max_parallel=2, on_stop=lambda: stops.append(True))
+    assert ran == ["slow"]
+    assert stops == [True]
+    assert graph.stopping.is_set()
+
+
+def test_stop_graph():
+    def check() -> None:
+        raise StopGraph("done")
+
+    graph = StageGraph()
+    graph.add("check", check, [], ["ok"])
+    graph.add("build", lambda ok: pytest.fail("should not run"), ["ok"], [])
+
+    with pytest.raises(StopGraph) as e:
+        graph.run()
+    assert e.value.result == "done"
+
+
+def test_stages_interrupted_by_a_stop():
+    started = threading.Event()
+
+    def unchanged() -> None:
+        started.wait(5)
+        raise StopGraph(True)
+
+    def interrupted() -> None:
+        started.set()
+        graph.stopping.wait(5)
+        raise RuntimeError("the wiki container was killed")
+
+    graph = StageGraph()
+    graph.add("manifest", unchanged, [], ["manifest"])
+    graph.add("wiki", interrupted, [], ["database"])
+
+    with pytest.raises(StopGraph) as e:
+        graph.run(max_parallel=2)
+    assert e.value.result is True
+
+
+def test_check_stops_the_graph():
+    def check() -> None:
+        raise KeyboardInterrupt()
+
+    graph = StageGraph()
+    graph.add("a", lambda: pytest.fail("should not run"), [], ["a"])
+    with pytest.raises(KeyboardInterrupt):
+        graph.run(check=check)
+
+
+def build(path: str, version: int, calls: list, exists: bool = True) -> StageGraph:
+    def fetch(uri: str) -> str:
+        calls.append("fetch")
+        return f"{uri}@{version}"
+
+    def compile(source: str) -> str:
+        calls.append("compile")
+        return source.upper()
+
+    graph = StageGraph(Checkpoints(path))
+    graph.add(
+        "fetch",
+        fetch,
+        ["uri"],
+        ["source"],
+        fingerprint=lambda uri: version,
+        exists=lambda uri, source: exists,
+    )
+    graph.add("compile", compile, ["source"], ["binary"], fingerprint=lambda source: 1)
+    graph.add("publish", lambda binary: calls.append("publish"), ["binary"], [])
+    return graph
+
+
+def test_checkpoints_are_restored(tmp_path):
+    path = str(tmp_path / "checkpoints.json")
+    values = {"uri": "repo"}
+
+    calls = []
+    assert build(path, 1, calls).run(values=values)["binary"] == "REPO@1"
+    assert calls == ["fetch", "compile", "publish"]
+
+    calls = []
+    graph = build(path, 1, calls)
+    assert graph.run(values=values)["binary"] == "REPO@1"
+    assert calls == ["publish"]
+    assert graph.stages["fetch"].restored and graph.stages["compile"].restored
+
+    # a stage that runs again invalidates the checkpoints of the stages after it
+    calls = []
+    assert build(path, 2, calls).run(values=values)["binary"] == "REPO@2"
+    assert calls == ["fetch", "compile", "publish"]
+
+    calls = []
+    build(path, 2, calls, exists=False).run(values=values)
+    assert calls == ["fetch", "compile", "publish"]
+
+
+def test_checkpoints_without_resume(tmp_path):
+    path = str(tmp_path / "checkpoints.json")
+    build(path, 1, []).run(values={"uri": "repo"})
+
+    assert Checkpoints(path).get("fetch", "wrong") is None
+    assert Checkpoints(path, resume=False).entries == {}
@@ -0,0 +1,83 @@
+import errno
+import os
+
+import pytest
+
+from builder import staging
+from builder.staging import StageStats, Stager, stage_tree
+
+
+def unsupported(code: int):
+    def fail(*args):
+        raise OSError(code, os.strerror(code))
+
+    return fail
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "source"
+    (root / "week01").mkdir(parents=True)
+    (root / "week01" / "a.txt").write_bytes(b"a" * 10)
+    (root / "b.txt").write_bytes(b"b" * 20)
+    return root
+
+
+def test_hardlink_when_reflinks_are_not_supported(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(staging, "reflink", unsupported(errno.EOPNOTSUPP))
+    stager = Stager()
+
+    stats = stager.stage_tree(str(source), str(tmp_path / "target"))
+    assert stats == StageStats(files=2, hardlinked_bytes=30)
+    assert stager.methods == ["hardlink", "copy"]
+    assert os.path.samefile(source / "b.txt", tmp_path / "target" / "b.txt")
+
+
+def test_copy_across_filesystems(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(staging, "reflink", unsupported(errno.EXDEV))
+    monkeypatch.setattr(staging.os, "link", unsupported(errno.EXDEV))
+    stager = Stager()
+
+    stats = stager.stage_tree(str(source), str(tmp_path / "target"))
+    assert stats == StageStats(files=2, copied_bytes=30)
+    assert stager.methods == ["copy"]
+    assert (tmp_path / "target" / "week01" / "a.txt").read_bytes() == b"a" * 10
+    assert not os.path.samefile(source / "b.txt", tmp_path / "target" / "b.txt")
+
+
+def test_unexpected_errors_are_raised(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(staging, "reflink", unsupported(errno.ENOSPC))
+
+    with pytest.raises(OSError) as e:
+        Stager().stage_tree(str(source), str(tmp_path / "target"))
+    assert e.value.errno == errno.ENOSPC
+
+
+def test_forced_mode_does_not_fall_back(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(staging.os, "link", unsupported(errno.EXDEV))
+
+    with pytest.raises(OSError):
+        stage_tree(str(source), str(tmp_path / "target"), mode="hardlink")
+    assert stage_tree(str(source), str(tmp_path / "copy"), mode="copy") == StageStats(
+        files=2, copied_bytes=30
+    )
+
+
+def test_stage_tree_merges_into_the_target(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(staging, "reflink", unsupported(errno.EOPNOTSUPP))
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / "b.txt").write_bytes(b"old")
+    (target / "keep.txt").write_bytes(b"keep")
+
+    stager = Stager()
+    stager.stage_tree(str(source), str(target))
+    stager.stage_tree(str(source), str(target))
+    assert (target / "b.txt").read_bytes() == b"b" * 20
+    assert (target / "keep.txt").read_bytes() == b"keep"
+    assert stager.stats.files == 4
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        Stager("symlink")
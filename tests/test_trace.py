@@ -0,0 +1,113 @@
+import json
+import threading
+from time import perf_counter
+
+import pytest
+
+from builder.cli import write_trace
+from builder.trace import METRIC_PREFIX, Tracer
+
+
+def test_spans_and_counters():
+    tracer = Tracer()
+    with tracer.span("clone", item="lectures"):
+        pass
+    with tracer.span("clone"):
+        pass
+    with pytest.raises(ValueError):
+        with tracer.span("build"):
+            raise ValueError()
+    tracer.record("COPY lectures", perf_counter(), 1.5, "main")
+    tracer.count("image_bytes", 100)
+    tracer.count("image_bytes", 50)
+
+    assert [span.name for span in tracer.spans] == [
+        "clone",
+        "clone",
+        "build",
+        "COPY lectures",
+    ]
+    assert tracer.spans[0].args == {"item": "lectures"}
+    assert tracer.spans[2].args == {"error": True}
+    assert set(tracer.durations()) == {"clone", "build", "COPY lectures"}
+    assert tracer.durations()["COPY lectures"] == 1.5
+    assert tracer.counters == {"image_bytes": 150}
+
+
+def test_chrome_trace(tmp_path):
+    tracer = Tracer()
+
+    def work():
+        with tracer.span("wiki_start"):
+            pass
+
+    thread = threading.Thread(target=work, name="wiki")
+    thread.start()
+    thread.join()
+    with tracer.span("stage_content"):
+        pass
+
+    tracer.write_chrome_trace(str(tmp_path / "trace.json"))
+    with open(tmp_path / "trace.json") as f:
+        trace = json.load(f)
+
+    events = trace["traceEvents"]
+    spans = [e for e in events if e["ph"] == "X"]
+    threads = {e["tid"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert [(e["name"], threads[e["tid"]]) for e in spans] == [
+        ("wiki_start", "wiki"),
+        ("stage_content", threading.current_thread().name),
+    ]
+    assert spans[0]["ts"] <= spans[1]["ts"]
+    assert list(tmp_path.iterdir()) == [tmp_path / "trace.json"]
+
+
+def test_metrics(tmp_path):
+    tracer = Tracer()
+    tracer.record("wiki_import", perf_counter(), 2, "main")
+    tracer.count("context-bytes sent", 1024)
+
+    path = tmp_path / "build.prom"
+    tracer.write_metrics(str(path), {"tag": 'course"1', "base": "base:latest"})
+    lines = path.read_text().splitlines()
+
+    labels = 'base="base:latest",tag="course\\"1"'
+    assert (
+        f'{METRIC_PREFIX}_stage_duration_seconds{{{labels},stage="wiki_import"}} 2.000000'
+        in lines
+    )
+    assert f"{METRIC_PREFIX}_context_bytes_sent{{{labels}}} 1024" in lines
+    assert f"# TYPE {METRIC_PREFIX}_last_build_timestamp_seconds gauge" in lines
+
+
+def test_metrics_without_labels(tmp_path):
+    tracer = Tracer()
+    tracer.count("image_bytes", 1)
+    tracer.write_metrics(str(tmp_path / "build.prom"), {})
+    assert f"{METRIC_PREFIX}_image_bytes{{}} 1" in (tmp_path / "build.prom").read_text()
+
+
+def test_failed_builds_are_written(tmp_path):
+    opts = {
+        "trace_file": str(tmp_path / "trace.json"),
+        "metrics_file": str(tmp_path / "build.prom"),
+        "tag": "course",
+        "base": "base",
+    }
+    write_trace(Tracer(), opts, False)
+
+    assert json.loads((tmp_path / "trace.json").read_text())["traceEvents"] == []
+    assert (
+        f'{METRIC_PREFIX}_build_success{{base="base",tag="course"}} 0'
+        in (tmp_path / "build.prom").read_text()
+    )
+
+
+def test_unwritable_trace_is_logged(tmp_path, caplog):
+    opts = {
+        "trace_file": str(tmp_path / "missing" / "trace.json"),
+        "tag": "",
+        "base": "",
+    }
+    write_trace(Tracer(), opts, True)
+    assert "Failed to write the build trace" in caplog.text
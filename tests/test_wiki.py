@@ -0,0 +1,133 @@
+import socket
+from time import monotonic
+
+import pytest
+
+from benchmarks.fakes import FakeContainer, FakeDockerClient, StubWiki
+from builder.cli import (
+    wait_for_wiki_to_be_ready,
+    wait_for_wiki_to_be_ready_no_healthcheck,
+)
+from builder.wiki import Mutation, WikiClient, WikiError
+
+
+class FailingWiki(StubWiki):
+    """A wiki that rejects every mutation."""
+
+    def respond(self, query: str) -> dict:
+        data = super().respond(query)
+        for result in data.values():
+            for field in result.values():
+                if isinstance(field, dict) and "responseResult" in field:
+                    field["responseResult"]["succeeded"] = False
+                    field["responseResult"]["message"] = "denied"
+        return data
+
+
+class Events:
+    def __init__(self, events):
+        self.events = iter(events)
+        self.closed = False
+
+    def __iter__(self):
+        return self.events
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def healthcheck_container(client: FakeDockerClient, status: str) -> FakeContainer:
+    container = FakeContainer(client, "wiki")
+    container.attrs["State"]["Health"] = {"Status": status}
+    return container
+
+
+def test_batch_is_a_single_request():
+    with StubWiki() as stub, WikiClient("127.0.0.1", stub.port) as wiki:
+        messages = wiki.batch(
+            [
+                Mutation("site", "updateConfig", {"title": ("String", "Course")}),
+                Mutation("navigation", "updateConfig", {"mode": ("String", "MIXED")}),
+                Mutation("pages", "rebuildTree"),
+            ]
+        )
+        assert messages == ["", "", ""]
+        assert stub.requests == 1
+        assert wiki.batch([]) == []
+        assert stub.requests == 1
+
+
+def test_failed_mutations_raise():
+    with FailingWiki() as stub, WikiClient("127.0.0.1", stub.port) as wiki:
+        with pytest.raises(WikiError, match="site.updateConfig"):
+            wiki.mutate(Mutation("site", "updateConfig", {"title": ("String", "x")}))
+
+
+def test_query_timeout():
+    with StubWiki(delay=1) as stub, WikiClient("127.0.0.1", stub.port) as wiki:
+        start = monotonic()
+        with pytest.raises(WikiError, match="Failed to reach the wiki"):
+            wiki.query("{ __typename }", timeout=0.2)
+        assert monotonic() - start < 1
+
+
+def test_unreachable_wiki():
+    with WikiClient("127.0.0.1", unused_port(), timeout=1) as wiki:
+        with pytest.raises(WikiError, match="Failed to reach the wiki"):
+            wiki.query("{ __typename }")
+
+
+def test_ready_when_the_wiki_responds():
+    with StubWiki() as stub:
+        assert wait_for_wiki_to_be_ready_no_healthcheck("127.0.0.1", port=stub.port)
+
+
+def test_ready_times_out():
+    start = monotonic()
+    ready = wait_for_wiki_to_be_ready_no_healthcheck(
+        "127.0.0.1", port=unused_port(), deadline=monotonic() + 0.5
+    )
+    assert not ready
+    assert monotonic() - start < 2
+
+
+def test_ready_stops_when_the_container_exits():
+    container = FakeContainer(FakeDockerClient(0), "wiki")
+    container.stop()
+
+    start = monotonic()
+    ready = wait_for_wiki_to_be_ready_no_healthcheck(
+        "127.0.0.1", port=unused_port(), container=container
+    )
+    assert not ready
+    assert monotonic() - start < 1
+
+
+@pytest.mark.parametrize(
+    "events, expected",
+    [
+        ([{"Action": "health_status: healthy"}], True),
+        ([{"Action": "health_status: unhealthy"}], False),
+        ([{"Action": "die"}], False),
+    ],
+)
+def test_ready_from_the_healthcheck_events(events, expected):
+    client = FakeDockerClient(0)
+    stream = Events(events)
+    client.events = lambda **kwargs: stream
+    container = healthcheck_container(client, "starting")
+
+    assert wait_for_wiki_to_be_ready(client, container, "127.0.0.1") is expected
+    assert stream.closed
+
+
+def test_ready_when_already_healthy():
+    client = FakeDockerClient(0)
+    container = healthcheck_container(client, "healthy")
+    assert wait_for_wiki_to_be_ready(client, container, "127.0.0.1", timeout=1)
@@ -0,0 +1,369 @@
+import io
+import json
+import os
+import sqlite3
+import tarfile
+
+import docker
+import pytest
+from git import Repo  # noqa: I900
+from tqdm import tqdm
+
+from benchmarks.content import AUTHOR
+from benchmarks.fakes import FakeContainer, FakeDockerClient
+from benchmarks.run import default_options
+from builder import wikidb
+from builder import cli
+from builder.cli import Authentication, compile_wiki, optimize_db
+from builder.wikidb import (
+    CompileError,
+    PageRenderer,
+    build_tree,
+    load_repository,
+    missing_packages,
+    PAGE_SIZES,
+    optimize_archive,
+    parse_page,
+    write_archive,
+)
+
+# the tables of the Wiki.js schema that the compiler writes to, `pages` is missing
+# its `extra` column like the older versions of the schema
+SCHEMA = """
+CREATE TABLE pages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT, hash TEXT, title TEXT,
+    description TEXT, isPrivate BOOLEAN, isPublished BOOLEAN, privateNS TEXT,
+    publishStartDate TEXT, publishEndDate TEXT, content TEXT, render TEXT, toc TEXT,
+    contentType TEXT, createdAt TEXT, updatedAt TEXT, editorKey TEXT,
+    localeCode TEXT, authorId INTEGER, creatorId INTEGER
+);
+CREATE TABLE tags (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, tag TEXT UNIQUE, title TEXT,
+    createdAt TEXT, updatedAt TEXT
+);
+CREATE TABLE pageTags (id INTEGER PRIMARY KEY AUTOINCREMENT, pageId INTEGER, tagId INTEGER);
+CREATE TABLE pageLinks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT, localeCode TEXT, pageId INTEGER
+);
+CREATE TABLE pageTree (
+    id INTEGER PRIMARY KEY, path TEXT, depth INTEGER, title TEXT, isPrivate BOOLEAN,
+    isFolder BOOLEAN, privateNS TEXT, parent INTEGER, pageId INTEGER,
+    localeCode TEXT, ancestors TEXT
+);
+CREATE TABLE assetFolders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, slug TEXT, parentId INTEGER
+);
+CREATE TABLE assets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT, hash TEXT, ext TEXT,
+    kind TEXT, mime TEXT, fileSize INTEGER, metadata TEXT, createdAt TEXT,
+    updatedAt TEXT, folderId INTEGER, authorId INTEGER
+);
+CREATE TABLE assetData (id INTEGER PRIMARY KEY, data BLOB);
+CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT, updatedAt TEXT);
+CREATE TABLE storage (
+    key TEXT PRIMARY KEY, isEnabled BOOLEAN, mode TEXT, config TEXT,
+    syncInterval TEXT, state TEXT
+);
+INSERT INTO settings VALUES ('lang', '{"code": "en", "namespacing": false}', '');
+INSERT INTO settings VALUES ('nav', '{"mode": "STATIC"}', '');
+"""
+
+PAGES = {
+    "home.md": "---\ntitle: Welcome\ndescription: The course wiki\n---\n"
+    "# Welcome\n\nStart with [the first week](week1/intro).\n",
+    "week1/intro.md": "---\ntitle: 'Introduction'\ntags: Java, Basics, java\n"
+    "date: 2023-09-01T12:00:00.000Z\n---\n\n# Intro\n\n## Setup\n\n### Tools\n\n"
+    "## Setup\n\nSee [home](/home), [the french home](/fr/accueil), "
+    "[a missing page](/week1/missing), [the admin area](/a/pages), "
+    "[a diagram](/week1/img/diagram.png) and [python](https://python.org).\n",
+    "week1/notes.html": "<!--\ntitle: Notes\n-->\n<p>some notes</p>\n",
+    "week1/img/Course Diagram.PNG": "not really a png",
+    "empty.md": "---\ntitle: Empty\n---\n",
+    "blank.txt": "",
+}
+
+needs_markdown = pytest.mark.skipif(
+    bool(missing_packages()), reason="needs the `wiki` extra"
+)
+
+
+def make_wiki(dir: str) -> str:
+    repo = Repo.init(dir)
+    for name, content in PAGES.items():
+        path = os.path.join(dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+    repo.index.add(list(PAGES))
+    repo.index.commit("wiki content", author=AUTHOR, committer=AUTHOR)
+    return repo.active_branch.name
+
+
+def template_archive(dir: str) -> bytes:
+    path = os.path.join(dir, "template.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.commit()
+    conn.close()
+
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w") as tar:
+        tar.add(path, arcname="database.sqlite")
+    return data.getvalue()
+
+
+def rows(conn: sqlite3.Connection, query: str) -> list:
+    return [tuple(row) for row in conn.execute(query).fetchall()]
+
+
+def test_parse_page():
+    page = parse_page("week1/intro.v2.md", PAGES["week1/intro.md"], "en", "now")
+    assert page.path == "week1/introv2"
+    assert page.title == "Introduction"
+    assert page.tags == ["java", "basics"]
+    assert (page.created, page.updated) == ("2023-09-01T12:00:00.000Z",) * 2
+    assert page.content.startswith("# Intro")
+
+    page = parse_page("week1/notes.html", PAGES["week1/notes.html"], "en", "now")
+    assert (page.content_type, page.editor, page.title) == ("html", "ckeditor", "Notes")
+    assert page.content == "<p>some notes</p>\n"
+
+    page = parse_page("plain.md", "no header", "en", "now")
+    assert (page.title, page.content, page.created) == ("plain", "no header", "now")
+
+
+def test_load_repository(tmp_path):
+    make_wiki(str(tmp_path))
+    pages, assets = load_repository(str(tmp_path), "en", "now")
+
+    assert [p.path for p in pages] == ["home", "week1/intro", "week1/notes"]
+    assert [(a.source, a.folders, a.filename, a.size) for a in assets] == [
+        ("week1/img/Course Diagram.PNG", ["week1", "img"], "course_diagram.png", 16)
+    ]
+
+
+@needs_markdown
+def test_render():
+    page = parse_page("week1/intro.md", PAGES["week1/intro.md"], "en", "now")
+    renderer = PageRenderer({("en", "home"), ("fr", "accueil"), ("en", "week1/intro")})
+    html, toc, links = renderer.render(page)
+
+    assert toc == [
+        {
+            "title": "Intro",
+            "anchor": "#intro",
+            "children": [
+                {
+                    "title": "Setup",
+                    "anchor": "#setup",
+                    "children": [
+                        {"title": "Tools", "anchor": "#tools", "children": []}
+                    ],
+                },
+                {"title": "Setup", "anchor": "#setup-1", "children": []},
+            ],
+        }
+    ]
+    assert '<h2 id="setup-1" class="toc-header">' in html
+    assert links == [("en", "home"), ("fr", "accueil"), ("en", "week1/missing")]
+    assert 'href="/fr/accueil" class="is-internal-link is-valid-page"' in html
+    assert 'href="/week1/missing" class="is-internal-link is-invalid-page"' in html
+    assert 'class="is-system-link"' in html
+    assert 'class="is-asset-link"' in html
+    assert 'class="is-external-link"' in html
+
+    home = parse_page("home.md", PAGES["home.md"], "en", "now")
+    assert renderer.render(home)[2] == [("en", "week1/intro")]
+
+
+def test_build_tree():
+    tree = build_tree(
+        [
+            (1, "home", "en", "Home", False, None),
+            (2, "week1", "en", "Week 1", False, None),
+            (3, "week1/intro", "en", "Intro", True, "ns"),
+        ]
+    )
+    assert [
+        (n["id"], n["path"], n["title"], n["isFolder"], n["parent"], n["ancestors"])
+        for n in tree
+    ] == [
+        (1, "home", "Home", False, None, "[]"),
+        (2, "week1", "Week 1", True, None, "[]"),
+        (3, "week1/intro", "Intro", False, 2, "[2]"),
+    ]
+    assert (tree[1]["pageId"], tree[2]["pageId"]) == (2, 3)
+    assert (tree[2]["isPrivate"], tree[2]["privateNS"]) == (True, "ns")
+
+
+@needs_markdown
+def test_compile_wiki(tmp_path):
+    branch = make_wiki(str(tmp_path / "wiki"))
+    client = FakeDockerClient(0)
+    client.database = template_archive(str(tmp_path))
+    opts = default_options(
+        f"--wiki-git-repo={tmp_path / 'wiki'}",
+        f"--wiki-git-branch={branch}",
+        "--wiki-title=Course Wiki",
+        "--wiki-navigation=MIXED",
+        "--wiki-comments",
+        "--keep-git",
+    )
+    out = tmp_path / "out"
+    out.mkdir()
+
+    compiled = compile_wiki(
+        client, opts, str(out), Authentication(None, None), tqdm(disable=True)
+    )
+    assert compiled
+
+    with tarfile.open(out / "database.sqlite.tar") as tar:
+        (member,) = tar.getmembers()
+        assert (member.name, member.uid, member.mode) == ("database.sqlite", 0, 0o644)
+        tar.extract(member, tmp_path)
+    conn = sqlite3.connect(str(tmp_path / "database.sqlite"))
+
+    pages = rows(conn, "SELECT id, path, title, contentType, localeCode FROM pages")
+    assert pages == [
+        (1, "home", "Welcome", "markdown", "en"),
+        (2, "week1/intro", "Introduction", "markdown", "en"),
+        (3, "week1/notes", "Notes", "html", "en"),
+    ]
+    assert rows(conn, "SELECT path, isFolder, parent, pageId FROM pageTree") == [
+        ("home", 0, None, 1),
+        ("week1", 1, None, None),
+        ("week1/intro", 0, 2, 2),
+        ("week1/notes", 0, 2, 3),
+    ]
+    assert rows(
+        conn,
+        "SELECT tag FROM tags JOIN pageTags ON tags.id = tagId ORDER BY tags.id",
+    ) == [("java",), ("basics",)]
+    assert rows(conn, "SELECT pageId, localeCode, path FROM pageLinks") == [
+        (1, "en", "week1/intro"),
+        (2, "en", "home"),
+        (2, "fr", "accueil"),
+        (2, "en", "week1/missing"),
+    ]
+    assert rows(conn, "SELECT name, slug, parentId FROM assetFolders") == [
+        ("week1", "week1", None),
+        ("img", "img", 1),
+    ]
+    assert rows(
+        conn,
+        "SELECT filename, folderId, kind, data FROM assets JOIN assetData USING (id)",
+    ) == [("course_diagram.png", 2, "image", b"not really a png")]
+
+    settings = {
+        k: json.loads(v) for k, v in rows(conn, "SELECT key, value FROM settings")
+    }
+    assert settings["title"] == {"v": "Course Wiki"}
+    assert settings["nav"] == {"mode": "MIXED"}
+    assert settings["features"] == {"featurePageComments": True}
+    assert settings["api"] == {"isEnabled": False}
+    ((key, config),) = rows(conn, "SELECT key, config FROM storage")
+    assert (key, json.loads(config)["branch"]) == ("git", branch)
+    conn.close()
+
+
+def test_compile_wiki_without_a_database(tmp_path):
+    client = FakeDockerClient(0)
+    container = FakeContainer(client, "template")
+
+    def missing(path: str):
+        raise docker.errors.NotFound(f"No such file: {path}")
+
+    container.get_archive = missing
+    client.containers.create = lambda image, **kwargs: container
+    compiled = compile_wiki(
+        client,
+        default_options(),
+        str(tmp_path),
+        Authentication(None, None),
+        tqdm(disable=True),
+    )
+    assert not compiled
+
+
+def deleted_rows_archive(tmp_path) -> str:
+    database = str(tmp_path / "database.sqlite")
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE data (value TEXT)")
+    conn.executemany("INSERT INTO data VALUES (?)", [("x" * 1000,)] * 1000)
+    conn.commit()
+    conn.execute("DELETE FROM data")
+    conn.commit()
+    conn.close()
+
+    archive = str(tmp_path / "database.sqlite.tar")
+    write_archive(database, archive, mtime=1000)
+    return archive
+
+
+def test_optimize_archive(tmp_path):
+    archive = deleted_rows_archive(tmp_path)
+    before, after = optimize_archive(archive, page_size=8192)
+    assert after < before
+
+    with tarfile.open(archive) as tar:
+        (member,) = tar.getmembers()
+        assert (member.name, member.mtime, member.size) == (
+            "database.sqlite",
+            1000,
+            after,
+        )
+        tar.extract(member, tmp_path / "out")
+    conn = sqlite3.connect(str(tmp_path / "out" / "database.sqlite"))
+    assert conn.execute("PRAGMA page_size").fetchone() == (8192,)
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+    conn.close()
+
+
+@pytest.mark.parametrize("page_size", [PAGE_SIZES[0], PAGE_SIZES[-1], None])
+def test_optimize_page_sizes(tmp_path, page_size):
+    archive = deleted_rows_archive(tmp_path)
+    optimize_archive(archive, page_size=page_size)
+
+    with tarfile.open(archive) as tar:
+        (member,) = tar.getmembers()
+        assert (member.uid, member.mode) == (0, 0o644)
+        tar.extract(member, tmp_path / "out")
+    conn = sqlite3.connect(str(tmp_path / "out" / "database.sqlite"))
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    if page_size:
+        assert conn.execute("PRAGMA page_size").fetchone() == (page_size,)
+    conn.close()
+
+
+@pytest.mark.parametrize("page_size", ["1000", "256", "131072", "large"])
+def test_invalid_page_sizes(page_size):
+    opts = default_options("--no-pull", f"--db-page-size={page_size}")
+    with pytest.raises(SystemExit, match="Incompatible arguments"):
+        cli.run(opts, client=FakeDockerClient(0), progress_file=io.StringIO())
+
+
+def test_archive_without_a_database(tmp_path):
+    archive = str(tmp_path / "database.sqlite.tar")
+    with tarfile.open(archive, "w") as tar:
+        info = tarfile.TarInfo("wiki")
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+    with pytest.raises(tarfile.TarError):
+        optimize_archive(archive)
+
+
+def test_failed_optimize_keeps_the_archive(tmp_path):
+    (tmp_path / "database.sqlite").write_bytes(b"not a database" * 100)
+    archive = tmp_path / "database.sqlite.tar"
+    write_archive(str(tmp_path / "database.sqlite"), str(archive))
+    original = archive.read_bytes()
+
+    optimize_db(str(tmp_path), 4096)
+    assert archive.read_bytes() == original
+    assert not os.path.exists(f"{archive}.tmp")
+
+
+def test_renderer_needs_the_extra(monkeypatch):
+    monkeypatch.setattr(wikidb, "MarkdownIt", None)
+    with pytest.raises(CompileError, match=r"scioer-builder\[wiki\]"):
+        PageRenderer(set())
@@ -0,0 +1,154 @@
+import io
+import json
+import os
+
+import docker
+import pytest
+
+from benchmarks.content import make_directory
+from benchmarks.fakes import FakeDockerClient, StubWiki
+from benchmarks.run import default_options
+from builder import cli
+from builder.cli import content_exists, reset_content, setup_workdir
+
+
+@pytest.fixture
+def wiki():
+    with StubWiki() as wiki:
+        yield wiki
+
+
+@pytest.fixture
+def lectures(tmp_path):
+    return make_directory(str(tmp_path / "lectures"), 64 * 1024, 8)
+
+
+@pytest.fixture
+def staged(monkeypatch):
+    """Count the times the content is staged."""
+
+    calls = []
+    stage_content = cli.stage_content
+
+    def counted(*args, **kwargs):
+        calls.append("content")
+        return stage_content(*args, **kwargs)
+
+    monkeypatch.setattr(cli, "stage_content", counted)
+    return calls
+
+
+def build(client, workdir, lectures, *args) -> bool:
+    opts = default_options(
+        "--no-pull",
+        f"--lectures-directory={lectures}",
+        f"--workdir={workdir}",
+        "--hash-cache-file=",
+        *args,
+    )
+    return cli.run(opts, client=client, progress_file=io.StringIO())
+
+
+def failing_build(client):
+    build = client.api.build
+
+    def fail(*args, **kwargs):
+        client.api.build = build
+        raise docker.errors.APIError("the daemon went away")
+
+    client.api.build = fail
+
+
+def test_resume_a_failed_build(tmp_path, wiki, lectures, staged):
+    client = FakeDockerClient(wiki.port)
+    workdir = str(tmp_path / "work")
+    failing_build(client)
+    with pytest.raises(docker.errors.APIError):
+        build(client, workdir, lectures)
+    assert staged == ["content"]
+    assert os.path.isfile(os.path.join(workdir, "build", "database.sqlite.tar"))
+    with open(os.path.join(workdir, "checkpoints.json")) as f:
+        assert {"content", "wiki"} <= set(json.load(f))
+
+    requests = wiki.requests
+    assert build(client, workdir, lectures, "--resume")
+    assert staged == ["content"]
+    assert wiki.requests == requests
+    assert client.context_bytes > 0
+
+
+def test_changed_content_is_staged_again(tmp_path, wiki, lectures, staged):
+    client = FakeDockerClient(wiki.port)
+    workdir = str(tmp_path / "work")
+    failing_build(client)
+    with pytest.raises(docker.errors.APIError):
+        build(client, workdir, lectures)
+
+    with open(os.path.join(lectures, "new.txt"), "w") as f:
+        f.write("new")
+    requests = wiki.requests
+    assert build(client, workdir, lectures, "--resume")
+    assert staged == ["content", "content"]
+    # the wiki does not depend on the lectures
+    assert wiki.requests == requests
+    assert os.path.isfile(os.path.join(workdir, "build", "lectures", "new.txt"))
+
+
+def test_build_without_resume_starts_over(tmp_path, wiki, lectures, staged):
+    client = FakeDockerClient(wiki.port)
+    workdir = str(tmp_path / "work")
+    assert build(client, workdir, lectures)
+    leftover = os.path.join(workdir, "build", "leftover.txt")
+    open(leftover, "w").close()
+
+    requests = wiki.requests
+    assert build(client, workdir, lectures, "--force")
+    assert staged == ["content", "content"]
+    assert wiki.requests > requests
+    assert not os.path.exists(leftover)
+
+
+def test_resume_needs_a_workdir():
+    opts = default_options("--no-pull", "--resume")
+    with pytest.raises(SystemExit, match="Incompatible arguments"):
+        cli.run(opts, client=FakeDockerClient(0), progress_file=io.StringIO())
+
+
+def test_setup_workdir(tmp_path):
+    dir = setup_workdir(str(tmp_path))
+    assert dir == str(tmp_path / "build")
+    assert os.path.isfile(os.path.join(dir, "Dockerfile"))
+
+    open(os.path.join(dir, "database.sqlite.tar"), "w").close()
+    assert setup_workdir(str(tmp_path), resume=True) == dir
+    assert os.path.isfile(os.path.join(dir, "database.sqlite.tar"))
+
+    setup_workdir(str(tmp_path))
+    assert os.listdir(dir) == ["Dockerfile"]
+
+
+def test_reset_content(tmp_path):
+    dir = setup_workdir(str(tmp_path))
+    for name in [
+        "jupyter",
+        "practiceProblems",
+        "lectures.layers/0",
+        "lectures.layers/1",
+    ]:
+        os.makedirs(os.path.join(dir, name))
+    open(os.path.join(dir, "motd.txt"), "w").close()
+    layers = {
+        "lectures": ["lectures.layers/0", "lectures.layers/1"],
+        "practiceProblems": ["practiceProblems"],
+    }
+    assert content_exists(dir, layers)
+    assert not content_exists(dir, {})
+
+    with open(os.path.join(dir, "Dockerfile"), "a") as f:
+        f.write("COPY lectures.layers/0 /opt/static/lectures/")
+    open(os.path.join(dir, "database.sqlite.tar"), "w").close()
+    reset_content(dir)
+
+    assert sorted(os.listdir(dir)) == ["Dockerfile", "database.sqlite.tar"]
+    with open(os.path.join(dir, "Dockerfile")) as f:
+        assert "lectures.layers" not in f.read()